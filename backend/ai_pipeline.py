@@ -0,0 +1,456 @@
+"""
+AI Pipeline Orchestration
+
+Runs the per-folder extraction branches from ai_processor for a job and builds
+the review payload that is stored on the job document. The extraction
+functions are blocking (LLM calls, pdfplumber/pandas parsing), so every
+branch is executed on a bounded thread pool instead of the event loop.
+
+Branches are looked up in EXTRACTORS, which maps each checklist folder with a
+real extractor to its review field. Folders without one (timesheets, third
+party, performance proof) are only checked for presence by the validation.
+"""
+
+import os
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple, Callable, AsyncIterator
+
+from bson import ObjectId
+
+from db import jobs_collection
+from extraction_cache import make_cache_key
+from ai_processor import (
+    MEDIA_PLAN_LOCAL_EXTRACTION,
+    PDF_TEXT_BUDGETS,
+    PROMPT_VERSIONS,
+    TEXT_EXTRACTION_VERSION,
+    validate_job_checklist,
+    extract_invoices_text,
+    extract_agency_details_from_invoices,
+    extract_po_details_from_job_order,
+    extract_media_plan_details,
+)
+from combined_extraction import extract_job_details_combined
+from llm_providers import get_llm_provider
+from media_plan_text import MEDIA_PLAN_TOKEN_BUDGET
+from ocr_service import ocr_signature
+
+logger = logging.getLogger(__name__)
+
+# "concurrent" runs the invoice, job order and media plan branches in parallel;
+# "sequential" runs them one after another (still off the event loop);
+# "combined" sends everything the job needs from the LLM in a single call.
+EXECUTION_MODES = ("concurrent", "sequential", "combined")
+AI_EXECUTION_MODE = os.getenv("AI_EXECUTION_MODE", "concurrent").lower()
+# Maximum number of extraction branches running at once across all jobs
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "3"))
+# Maximum number of jobs of one batch request being processed at once
+AI_BATCH_JOB_CONCURRENCY = int(os.getenv("AI_BATCH_JOB_CONCURRENCY", "4"))
+
+# Run the extractors of changed folders when documents are uploaded
+AI_EXTRACT_ON_UPLOAD = os.getenv("AI_EXTRACT_ON_UPLOAD", "true").lower() in ("1", "true", "yes")
+
+BRANCHES = ("invoice", "po", "media_plan")
+# Key of the source document fingerprint stored in each raw_ai_*_output
+SOURCE_FINGERPRINT_FIELD = "source_fingerprint"
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_ai_executor() -> ThreadPoolExecutor:
+    """Get or create the shared thread pool used for extraction branches"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, AI_MAX_CONCURRENCY),
+            thread_name_prefix="ai-branch"
+        )
+    return _executor
+
+
+async def run_blocking(func: Callable, *args) -> Any:
+    """Run a blocking extraction function on the AI thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_ai_executor(), partial(func, *args))
+
+
+def extract_invoice_branch(agency_invoices: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Read the agency invoice PDFs and extract their details"""
+    invoices_text_extracted = extract_invoices_text(agency_invoices)
+    return extract_agency_details_from_invoices(invoices_text_extracted, agency_invoices)
+
+
+class FolderExtractor(NamedTuple):
+    """How one checklist folder is turned into a raw_ai_*_output of the review"""
+    folder: str
+    review_field: str
+    extract: Callable[[List[Dict[str, Any]]], Dict[str, Any]]
+    # Prompt kinds (PROMPT_VERSIONS) the output depends on
+    prompt_kinds: Tuple[str, ...]
+    # Extraction settings the output depends on
+    settings: Dict[str, Any]
+
+
+# Extraction branch name -> extractor
+EXTRACTORS: Dict[str, FolderExtractor] = {
+    "invoice": FolderExtractor(
+        "agency_invoice", "raw_ai_invoice_output", extract_invoice_branch, ("agency_invoice",),
+        PDF_TEXT_BUDGETS["agency_invoice"]
+    ),
+    "po": FolderExtractor(
+        "job_order", "raw_ai_po_output", extract_po_details_from_job_order, ("job_order",),
+        PDF_TEXT_BUDGETS["job_order"]
+    ),
+    "media_plan": FolderExtractor(
+        "approved_quotation", "raw_ai_media_plan_output", extract_media_plan_details,
+        ("media_plan_selection", "media_plan"),
+        {"local_extraction": MEDIA_PLAN_LOCAL_EXTRACTION, "token_budget": MEDIA_PLAN_TOKEN_BUDGET}
+    ),
+}
+
+
+def folder_fingerprint(documents: List[Dict[str, Any]], extractor: FolderExtractor, mode: str) -> str:
+    """
+    Fingerprint of the documents an extraction branch reads (paths and names,
+    in order) and of everything else its output depends on: extraction
+    versions and settings, OCR settings, LLM provider/model and execution mode.
+    """
+    return make_cache_key(
+        [(doc.get("file_path"), doc.get("original_filename")) for doc in documents or []],
+        [PROMPT_VERSIONS[kind] for kind in extractor.prompt_kinds],
+        TEXT_EXTRACTION_VERSION,
+        extractor.settings,
+        ocr_signature(),
+        get_llm_provider().cache_namespace,
+        # Concurrent and sequential runs make the same calls; combined runs do not
+        "combined" if mode == "combined" else "per_branch"
+    )
+
+
+def job_fingerprints(job: Dict[str, Any], mode: str) -> Dict[str, str]:
+    """Current source fingerprint of every extraction branch of a job"""
+    checklist = job.get("checklist", {}) or {}
+    return {
+        branch: folder_fingerprint(checklist.get(extractor.folder, []), extractor, mode)
+        for branch, extractor in EXTRACTORS.items()
+    }
+
+
+def _is_reusable(output: Any, fingerprint: str) -> bool:
+    """A previous output can be reused if it was computed from the same documents and did not fail"""
+    if not isinstance(output, dict) or output.get(SOURCE_FINGERPRINT_FIELD) != fingerprint:
+        return False
+    if output.get("error"):
+        return False
+    return not any(isinstance(item, dict) and item.get("error") for item in output.get("invoices", []) or [])
+
+
+def reusable_outputs(job: Dict[str, Any], fingerprints: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """Previous raw_ai_*_output of every branch whose documents have not changed"""
+    review = job.get("review") or {}
+    reusable = {}
+    for branch, extractor in EXTRACTORS.items():
+        output = review.get(extractor.review_field)
+        if _is_reusable(output, fingerprints[branch]):
+            reusable[branch] = output
+    return reusable
+
+
+async def extract_job_details(
+    job: Dict[str, Any], mode: Optional[str] = None, branches: Tuple[str, ...] = BRANCHES
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Run the invoice, job order (PO) and media plan extraction branches for a job.
+
+    Args:
+        job: The job document from MongoDB
+        mode: "concurrent", "sequential" or "combined"; defaults to AI_EXECUTION_MODE
+        branches: The branches to run; the others are returned as None
+
+    Returns:
+        Tuple of (invoice_details, po_details, media_plan_details)
+    """
+    mode = (mode or AI_EXECUTION_MODE).lower()
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"Invalid execution mode '{mode}'. Must be one of: {', '.join(EXECUTION_MODES)}")
+
+    checklist = job.get("checklist", {}) or {}
+    if not branches:
+        return None, None, None
+    if mode == "combined":
+        return await run_blocking(extract_job_details_combined, checklist, tuple(branches))
+
+    calls = [
+        (branch, EXTRACTORS[branch].extract, checklist.get(EXTRACTORS[branch].folder, []))
+        for branch in BRANCHES if branch in branches
+    ]
+    if mode == "sequential":
+        results = [await run_blocking(func, docs) for _, func, docs in calls]
+    else:
+        results = await asyncio.gather(*(run_blocking(func, docs) for _, func, docs in calls))
+
+    by_branch = {branch: result for (branch, _, _), result in zip(calls, results)}
+    return by_branch.get("invoice"), by_branch.get("po"), by_branch.get("media_plan")
+
+
+def build_review_data(
+    job: Dict[str, Any],
+    invoice_details: Dict[str, Any],
+    po_details: Dict[str, Any],
+    media_plan_details: Dict[str, Any],
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Combine the extraction results and checklist validation into the job review.
+
+    Returns:
+        Tuple of (review data, validation result)
+    """
+    validation_result = validate_job_checklist(job)
+
+    final_review_data = {
+        # Header / identifiers
+        "market_bu": media_plan_details.get("market_type"),
+        "agency_invoice_number": invoice_details.get("summary", {}).get("agency_invoice_details"),
+        "po_number": po_details.get("po_number"),
+        "period_month": media_plan_details.get("period_month"),
+
+        # Timeline (dates) - Currently not extracted by AI, so set to None
+        "date_invoice_sent_to_medpush": None,
+        "date_medpush_shared_feedback": None,
+        "date_agency_responded_to_feedback": None,
+        "date_medpush_approved_invoice": None,
+
+        # Campaign / medium
+        "medium": media_plan_details.get("medium"),
+        "campaign_name": (
+            invoice_details.get("invoices", [{}])[0].get("campaign_name")
+            if invoice_details.get("invoices") and len(invoice_details.get("invoices", [])) > 0
+            else None
+        ),
+
+        # Financials
+        "net_media_cost": media_plan_details.get("net_media_cost"),
+        "agency_fee": media_plan_details.get("agency_fees"),
+        "taxes": media_plan_details.get("taxes_amount"),
+        "other_third_party_cost": media_plan_details.get("third_party_cost"),
+        "agency_invoice_total_amount": invoice_details.get("summary", {}).get("total_amount"),
+        "media_plan_total_amount": media_plan_details.get("media_plan_total_amount"),
+        "po_amount_with_af": po_details.get("po_amount"),
+
+        # Review text - Now set based on validation results
+        "initial_review_outcome": validation_result["initial_review_outcome"],
+        "agency_feedback_action": None,
+        "final_review_outcome": validation_result["final_review_outcome"],
+        "status_of_received_invoices": None,
+
+        # Month tag
+        "month_medpush_received_invoice": None,
+
+        # Durations (# of days)
+        "days_medpush_to_review_and_share_feedback": None,
+        "days_agency_to_revert_to_medpush": None,
+        "days_medpush_to_approve_after_revision": None,
+
+        # Raw AI Output
+        "raw_ai_invoice_output": invoice_details,
+        "raw_ai_po_output": po_details,
+        "raw_ai_media_plan_output": media_plan_details
+    }
+
+    return final_review_data, validation_result
+
+
+async def extract_changed_branches(
+    job: Dict[str, Any], mode: Optional[str] = None, force: bool = False
+) -> Tuple[Dict[str, Any], Tuple[str, ...]]:
+    """
+    Extract the branches whose folder or extraction settings changed since the
+    last run and reuse the stored raw_ai_*_output of the others. New outputs are stamped with their
+    source fingerprint. force=True re-extracts everything.
+
+    Returns:
+        Tuple of (output per branch, branches that were extracted)
+    """
+    mode = (mode or AI_EXECUTION_MODE).lower()
+    fingerprints = job_fingerprints(job, mode)
+    outputs = {} if force else reusable_outputs(job, fingerprints)
+    branches = tuple(branch for branch in BRANCHES if branch not in outputs)
+    if outputs:
+        logger.info(f"Job {job['_id']}: reusing {', '.join(outputs)} extraction, re-extracting {', '.join(branches) or 'nothing'}")
+
+    extracted = await extract_job_details(job, mode, branches)
+    for branch, details in zip(BRANCHES, extracted):
+        if branch in branches:
+            if isinstance(details, dict):
+                details = {**details, SOURCE_FINGERPRINT_FIELD: fingerprints[branch]}
+            outputs[branch] = details
+    return outputs, branches
+
+
+async def run_job_ai_process(
+    job_id: str, mode: Optional[str] = None, force: bool = False
+) -> Optional[Dict[str, Any]]:
+    """
+    Run the full AI process for a job: extract details, validate the checklist
+    and store the review and compliance status on the job.
+
+    Only branches whose folder changed since the last run are extracted again;
+    the other raw_ai_*_output values are reused. force=True re-extracts everything.
+
+    Returns:
+        The updated job document, or None if the job does not exist
+    """
+    object_id = ObjectId(job_id)
+    job = await jobs_collection.find_one({"_id": object_id})
+    if not job:
+        return None
+
+    outputs, _ = await extract_changed_branches(job, mode, force)
+    invoice_details, po_details, media_plan_details = (outputs[branch] for branch in BRANCHES)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Job {job_id} invoice details: {json.dumps(invoice_details, default=str)}")
+        logger.debug(f"Job {job_id} PO details: {json.dumps(po_details, default=str)}")
+        logger.debug(f"Job {job_id} media plan details: {json.dumps(media_plan_details, default=str)}")
+
+    final_review_data, validation_result = build_review_data(
+        job, invoice_details, po_details, media_plan_details
+    )
+
+    # Update the review and the status based on the validation result
+    new_status = "Compliant" if validation_result["is_compliant"] else "Not Compliant"
+    update_data = {
+        "review": final_review_data,
+        "status": new_status,
+        "updated_at": datetime.utcnow()
+    }
+
+    return await jobs_collection.find_one_and_update(
+        {"_id": object_id},
+        {"$set": update_data},
+        return_document=True
+    )
+
+
+async def run_jobs_ai_process(
+    job_ids: List[str], mode: Optional[str] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run the AI process for many jobs, yielding a progress event as each job finishes.
+
+    Jobs share the AI thread pool and the extraction caches, so a document that
+    appears in several jobs (e.g. the same media plan) is parsed and sent to the
+    LLM only once. At most AI_BATCH_JOB_CONCURRENCY jobs are in progress at once.
+    """
+    total = len(job_ids)
+    semaphore = asyncio.Semaphore(max(1, AI_BATCH_JOB_CONCURRENCY))
+
+    async def process(job_id: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                updated_job = await run_job_ai_process(job_id, mode)
+                if not updated_job:
+                    return {"event": "job_failed", "job_id": job_id, "error": "Job not found"}
+                return {"event": "job_completed", "job_id": job_id, "status": updated_job.get("status")}
+            except Exception as e:
+                logger.exception(f"Batch AI process failed for job {job_id}")
+                return {"event": "job_failed", "job_id": job_id, "error": str(e)}
+
+    yield {"event": "started", "total": total}
+
+    tasks = [asyncio.create_task(process(job_id)) for job_id in job_ids]
+    succeeded = failed = 0
+    try:
+        for completed, next_result in enumerate(asyncio.as_completed(tasks), start=1):
+            result = await next_result
+            if result["event"] == "job_completed":
+                succeeded += 1
+            else:
+                failed += 1
+            yield {**result, "completed": completed, "total": total}
+    finally:
+        # Stop scheduling remaining jobs if the client went away
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    yield {"event": "finished", "total": total, "succeeded": succeeded, "failed": failed}
+
+
+async def process_job_documents(job: Dict[str, Any]) -> Tuple[str, ...]:
+    """
+    Run the extractors of the folders that changed since the last run and store
+    their raw_ai_*_output in the job review. The other review fields are left
+    to run_job_ai_process, which then reuses these outputs without extracting
+    again. Does nothing when no folder changed.
+
+    Returns:
+        The branches that were extracted
+    """
+    outputs, branches = await extract_changed_branches(job, "concurrent")
+    if not branches:
+        return branches
+
+    review_fields = {EXTRACTORS[branch].review_field: outputs[branch] for branch in branches}
+    if isinstance(job.get("review"), dict):
+        update = {f"review.{field}": output for field, output in review_fields.items()}
+    else:
+        update = {"review": review_fields}
+    update["updated_at"] = datetime.utcnow()
+    # Only store the outputs if the checklist is still the one they were extracted from
+    result = await jobs_collection.update_one(
+        {"_id": job["_id"], "checklist": job.get("checklist", {})},
+        {"$set": update}
+    )
+    if not result.modified_count:
+        logger.info(f"Job {job['_id']} documents changed during extraction; outputs not stored")
+    return branches
+
+
+async def process_job_documents_and_update_status(job_id: str):
+    """
+    Automatically process job documents and update compliance status
+    """
+    try:
+        # Get the job
+        job = await jobs_collection.find_one({"_id": ObjectId(job_id)})
+        if not job:
+            return
+        
+        # Extract the folders whose documents changed
+        if AI_EXTRACT_ON_UPLOAD:
+            branches = await process_job_documents(job)
+            if branches:
+                logger.info(f"Job {job_id}: extracted {', '.join(branches)} after document upload")
+        
+        # Get updated job with new review data
+        updated_job = await jobs_collection.find_one({"_id": ObjectId(job_id)})
+        if not updated_job:
+            return
+        
+        # Validate compliance based on documents
+        validation_result = validate_job_checklist(updated_job)
+        
+        # Determine new status
+        new_status = "Compliant" if validation_result["is_compliant"] else "Not Compliant"
+        
+        # Update job status if it changed
+        if updated_job.get("status") != new_status:
+            await jobs_collection.update_one(
+                {"_id": ObjectId(job_id)},
+                {"$set": {
+                    "status": new_status,
+                    "updated_at": datetime.utcnow()
+                }}
+            )
+            logger.info(f"Job {job_id} status updated to: {new_status}")
+        
+    except Exception as e:
+        logger.error(f"Error processing job {job_id}: {e}")
+        # Runs as a background task (not in the upload request): let it be marked failed
+        raise
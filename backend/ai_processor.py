@@ -8,57 +8,142 @@ It provides functions to extract text from documents and parse that text into st
 import os
 import re
 import json
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, Callable, List, Optional, Tuple
 from datetime import datetime
-import tempfile
 import io
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 import pdfplumber
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
 import openpyxl
 import pandas as pd
 import logging
+
+from gemini_client import GEMINI_MAX_CONCURRENT_CALLS
+from llm_providers import get_llm_provider
+from extraction_cache import llm_cache, text_cache, make_cache_key, document_cache_key
+from parsing_service import run_parse, extract_pdf_page_texts, join_page_texts, extract_excel_rows
+from ocr_service import ocr_pdf_pages, ocr_image_content, ocr_signature
+from media_plan_text import compact_media_plan_rows
+from media_plan_extractor import (
+    MEDIA_PLAN_FIELDS, MEDIUM_TYPES, extract_media_plan_locally, score_media_plan_candidates
+)
+from invoice_fast_path import try_invoice_fast_path
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-# Import these libraries when you're ready to implement the functions
-# import pytesseract
-# from PIL import Image
-# import pdfplumber
-# import cv2
-# import numpy as np
 
 # Constants
 UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
 
-# Local file storage (backend/uploads/) - no AWS required
+# Bump a version whenever its prompt or schema changes so cached results are not reused
+PROMPT_VERSIONS = {
+    "agency_invoice": "1",
+    "job_order": "1",
+    "media_plan_selection": "1",
+    "media_plan": "3",
+    "combined": "2",
+}
+
+# Bump when PDF/Excel text extraction changes so cached text is re-parsed
+TEXT_EXTRACTION_VERSION = "1"
+
+# Page/character budgets for PDF text per folder type (0 = no limit). Invoices and
+# job orders carry their details on the first pages; later pages are usually proofs.
+PDF_TEXT_BUDGETS = {
+    "agency_invoice": {
+        "max_pages": int(os.getenv("PDF_MAX_PAGES_AGENCY_INVOICE", "3")),
+        "max_chars": int(os.getenv("PDF_MAX_CHARS_AGENCY_INVOICE", "20000")),
+    },
+    "job_order": {
+        "max_pages": int(os.getenv("PDF_MAX_PAGES_JOB_ORDER", "5")),
+        "max_chars": int(os.getenv("PDF_MAX_CHARS_JOB_ORDER", "30000")),
+    },
+}
+
+# Compute media plan sums/lookups from the sheet and ask the LLM only for the rest
+MEDIA_PLAN_LOCAL_EXTRACTION = os.getenv("MEDIA_PLAN_LOCAL_EXTRACTION", "true").lower() in ("1", "true", "yes")
+
+_invoice_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_invoice_executor() -> ThreadPoolExecutor:
+    """Get or create the thread pool used to fan out per-invoice parsing and Gemini calls"""
+    global _invoice_executor
+    if _invoice_executor is None:
+        _invoice_executor = ThreadPoolExecutor(
+            max_workers=max(1, GEMINI_MAX_CONCURRENT_CALLS),
+            thread_name_prefix="invoice-ai"
+        )
+    return _invoice_executor
+
+# Uploaded files are read through the configured storage backend (local disk by default)
 def get_file_from_local(relative_path: str) -> bytes:
     """
-    Read file content from local uploads directory (backend/uploads/).
+    Read file content from storage (backend/uploads/ unless STORAGE_BACKEND says otherwise).
     relative_path: e.g. uploads/jobs/{job_id}/agency_invoice/file.pdf
     """
-    from local_storage import read_file as local_read
+    from storage import get_storage
     try:
-        return local_read(relative_path)
+        return get_storage().read_file(relative_path)
     except Exception as e:
         logger.error(f"Error reading file from local storage {relative_path}: {e}")
         raise
 
 
-def read_pdf_from_s3(file_path: str) -> str:
+def get_file_digest(relative_path: str) -> Optional[str]:
+    """
+    Return the SHA-256 of a stored file, or None if it cannot be read.
+    Used as the content address for cached extraction results.
+    """
+    from storage import get_storage
+    from blob_store import is_blob_path
+    if is_blob_path(relative_path):
+        # Blobs are named by their SHA-256
+        return os.path.basename(relative_path)
+    try:
+        return get_storage().file_sha256(relative_path)
+    except Exception as e:
+        logger.warning(f"Could not hash {relative_path}: {e}")
+        return None
+
+
+def extract_pdf_text_with_ocr(file_content: bytes, max_pages: int = 0, max_chars: int = 0) -> str:
+    """
+    Extract the text of a PDF within the page/character budget. Pages without a
+    text layer (scans) are OCR'd when OCR is available.
+    """
+    pages = run_parse(extract_pdf_page_texts, file_content, max_pages, max_chars)
+    scanned = [index for index, text in enumerate(pages) if not text.strip()]
+    if scanned:
+        ocr_texts = ocr_pdf_pages(file_content, scanned)
+        if ocr_texts:
+            logger.info(f"OCR'd {len(ocr_texts)} page(s) without a text layer")
+        for index, text in ocr_texts.items():
+            pages[index] = text
+    return join_page_texts(pages, max_chars)
+
+
+def read_pdf_from_s3(file_path: str, folder_type: Optional[str] = None) -> str:
     """
     Read PDF content from local storage and extract text.
     file_path: relative path e.g. uploads/jobs/.../file.pdf
+    folder_type: applies the page/character budget from PDF_TEXT_BUDGETS, if any
+    The extracted text is cached by content hash and reused on later runs.
     """
+    budget = PDF_TEXT_BUDGETS.get(folder_type, {})
+    max_pages = budget.get("max_pages", 0)
+    max_chars = budget.get("max_chars", 0)
     try:
         file_content = get_file_from_local(file_path)
-        with pdfplumber.open(io.BytesIO(file_content)) as pdf:
-            text = ""
-            for page in pdf.pages:
-                page_text = page.extract_text() or ""
-                text += page_text + "\n"
-            return text.strip()
+        digest = hashlib.sha256(file_content).hexdigest()
+        cache_key = document_cache_key(
+            digest, "pdf_text", TEXT_EXTRACTION_VERSION, max_pages, max_chars, ocr_signature()
+        )
+        return text_cache.get_or_compute(
+            cache_key, lambda: extract_pdf_text_with_ocr(file_content, max_pages, max_chars)
+        )
     except Exception as e:
         logger.error(f"Error reading PDF {file_path}: {e}")
         raise
@@ -68,99 +153,19 @@ def read_excel_from_s3(file_path: str) -> Optional[List[List[Any]]]:
     """
     Read Excel content from local storage and return as list of lists.
     file_path: relative path e.g. uploads/jobs/.../file.xlsx
+    The rows are cached by content hash; dates come back as strings from the cache.
     """
     try:
         file_content = get_file_from_local(file_path)
-        df = pd.read_excel(io.BytesIO(file_content), sheet_name=0, header=None)
-        return df.values.tolist()
+        digest = hashlib.sha256(file_content).hexdigest()
+        cache_key = document_cache_key(digest, "excel_rows", TEXT_EXTRACTION_VERSION)
+        return text_cache.get_or_compute(
+            cache_key, lambda: run_parse(extract_excel_rows, file_content)
+        )
     except Exception as e:
         logger.error(f"Error reading Excel {file_path}: {e}")
         return None
 
-# Main AI processing function
-def process_job_documents(job: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Main function to process all documents for a job.
-    This is the entry point for the AI processing pipeline.
-    
-    Args:
-        job: The job document from MongoDB
-        
-    Returns:
-        Dict containing extracted data to update the job's review field
-    """
-    extracted_data = {}
-    
-    # Check if job has documents in checklist
-    if not job.get("checklist"):
-        return extracted_data
-    
-    # Process each document type
-    for folder_type, documents in job["checklist"].items():
-        if not documents:
-            continue
-            
-        folder_data = process_folder_documents(folder_type, documents, str(job["_id"]))
-        extracted_data.update(folder_data)
-    
-    # Post-process the extracted data (e.g., calculate totals, validate data)
-    post_process_data(extracted_data)
-    
-    return extracted_data
-
-
-def process_folder_documents(folder_type: str, documents: List[Dict], job_id: str) -> Dict[str, Any]:
-    """
-    Process all documents in a specific folder type.
-    
-    Args:
-        folder_type: Type of folder (e.g., "agency_invoice")
-        documents: List of document objects
-        job_id: ID of the job
-        
-    Returns:
-        Dict containing extracted data from these documents
-    """
-    extracted_data = {}
-    
-    from local_storage import get_local_path
-    for doc in documents:
-        # Resolve relative path (uploads/jobs/.../file.pdf) to backend absolute path
-        relative_path = doc.get("file_path")
-        if not relative_path or not isinstance(relative_path, str):
-            continue
-        full_path = get_local_path(relative_path)
-        if not full_path.is_file():
-            print(f"File not found: {full_path}")
-            continue
-        file_path = str(full_path)
-        # Extract text from the document
-        text = extract_text_from_document(file_path)
-        if not text:
-            continue
-            
-        # Parse the text based on folder type
-        if folder_type == "agency_invoice":
-            data = parse_agency_invoice(text)
-        elif folder_type == "approved_quotation":
-            data = parse_approved_quotation(text)
-        elif folder_type == "job_order":
-            data = parse_job_order(text)
-        elif folder_type == "timesheet":
-            data = parse_timesheet(text)
-        elif folder_type == "third_party":
-            data = parse_third_party(text)
-        elif folder_type == "performance_proof":
-            data = parse_performance_proof(text)
-        else:
-            data = {}
-            
-        # Merge the extracted data
-        extracted_data.update(data)
-    
-    return extracted_data
-
-
 def extract_text_from_document(file_path: str) -> str:
     """
     Extract text from a document file.
@@ -186,7 +191,7 @@ def extract_text_from_document(file_path: str) -> str:
 
 def extract_text_from_pdf(file_path: str) -> str:
     """
-    Extract text from a PDF file.
+    Extract text from a PDF file, with OCR for scanned pages.
     
     Args:
         file_path: Path to the PDF file
@@ -194,18 +199,13 @@ def extract_text_from_pdf(file_path: str) -> str:
     Returns:
         Extracted text as a string
     """
-    # TODO: Implement this function using a PDF library like pdfplumber
-    # Example implementation:
-    # with pdfplumber.open(file_path) as pdf:
-    #     text = ""
-    #     for page in pdf.pages:
-    #         page_text = page.extract_text() or ""
-    #         text += page_text + "\n"
-    #     return text
-    
-    # For now, return a placeholder
-    print(f"Extracting text from PDF: {file_path}")
-    return f"This is placeholder text from PDF {os.path.basename(file_path)}"
+    try:
+        with open(file_path, "rb") as f:
+            file_content = f.read()
+    except OSError as e:
+        logger.error(f"Error reading PDF {file_path}: {e}")
+        return ""
+    return extract_pdf_text_with_ocr(file_content)
 
 
 def extract_text_from_image(file_path: str) -> str:
@@ -216,118 +216,15 @@ def extract_text_from_image(file_path: str) -> str:
         file_path: Path to the image file
         
     Returns:
-        Extracted text as a string
-    """
-    # TODO: Implement this function using an OCR library like pytesseract
-    # Example implementation:
-    # image = Image.open(file_path)
-    # text = pytesseract.image_to_string(image)
-    # return text
-    
-    # For now, return a placeholder
-    print(f"Extracting text from image: {file_path}")
-    return f"This is placeholder text from image {os.path.basename(file_path)}"
-
-
-# Document-specific parsers
-def parse_agency_invoice(text: str) -> Dict[str, Any]:
+        Extracted text as a string (empty if OCR is not available)
     """
-    Parse text from an agency invoice document.
-    
-    Args:
-        text: Extracted text from the document
-        
-    Returns:
-        Dict containing extracted fields
-    """
-    extracted_data = {}
-    
-    # TODO: Implement regex patterns to extract specific fields
-    # Example patterns:
-    
-    # Extract Agency Invoice Number
-    invoice_match = re.search(r"Invoice\s*(?:No|Number|#)?\s*[:#]?\s*([A-Za-z0-9|_-]+)", text, re.IGNORECASE)
-    if invoice_match:
-        extracted_data["agency_invoice_number"] = invoice_match.group(1).strip()
-    
-    # Extract PO Number
-    po_match = re.search(r"P\.?O\.?\s*(?:No|Number|#)?\s*[:#]?\s*([A-Za-z0-9\s]+)", text, re.IGNORECASE)
-    if po_match:
-        extracted_data["po_number"] = po_match.group(1).strip()
-    
-    # Extract Invoice Total Amount
-    amount_match = re.search(r"Total\s*(?:Amount|Sum)?\s*[:#]?\s*(?:SAR|SR)?\s*([\d,\.]+)", text, re.IGNORECASE)
-    if amount_match:
-        amount_str = amount_match.group(1).replace(",", "")
-        try:
-            extracted_data["agency_invoice_total_amount"] = float(amount_str)
-        except ValueError:
-            pass
-    
-    # TODO: Add more regex patterns for other fields
-    
-    return extracted_data
-
-
-def parse_approved_quotation(text: str) -> Dict[str, Any]:
-    """Parse text from an approved quotation document."""
-    # TODO: Implement this function
-    return {}
-
-
-def parse_job_order(text: str) -> Dict[str, Any]:
-    """Parse text from a job order document."""
-    # TODO: Implement this function
-    return {}
-
-
-def parse_timesheet(text: str) -> Dict[str, Any]:
-    """Parse text from a timesheet document."""
-    # TODO: Implement this function
-    return {}
-
-
-def parse_third_party(text: str) -> Dict[str, Any]:
-    """Parse text from a third party document."""
-    # TODO: Implement this function
-    return {}
-
-
-def parse_performance_proof(text: str) -> Dict[str, Any]:
-    """Parse text from a performance proof document."""
-    # TODO: Implement this function
-    return {}
-
-
-def post_process_data(data: Dict[str, Any]) -> None:
-    """
-    Post-process extracted data to ensure consistency and calculate derived fields.
-    
-    Args:
-        data: Dict containing extracted data
-        
-    Returns:
-        None (modifies data in-place)
-    """
-    # TODO: Implement data validation and post-processing
-    # Example: Calculate total amount if components are available
-    if all(key in data for key in ["net_media_cost", "agency_fee", "taxes"]):
-        try:
-            net_media_cost = float(data["net_media_cost"])
-            agency_fee = float(data["agency_fee"])
-            taxes = float(data["taxes"])
-            
-            # If other_third_party_cost is not available, default to 0
-            other_cost = float(data.get("other_third_party_cost", 0))
-            
-            # Calculate total
-            total = net_media_cost + agency_fee + taxes + other_cost
-            
-            # Only set if not already extracted
-            if "agency_invoice_total_amount" not in data:
-                data["agency_invoice_total_amount"] = total
-        except (ValueError, TypeError):
-            pass
+    try:
+        with open(file_path, "rb") as f:
+            image_content = f.read()
+    except OSError as e:
+        logger.error(f"Error reading image {file_path}: {e}")
+        return ""
+    return ocr_image_content(image_content)
 
 
 def validate_job_checklist(job: Dict[str, Any]) -> Dict[str, any]:
@@ -401,112 +298,147 @@ def validate_job_checklist(job: Dict[str, Any]) -> Dict[str, any]:
         "initial_review_outcome": initial_review_outcome,
         "final_review_outcome": final_review_outcome
     }
-def gemini_api_function(prompt: str, schema: dict):
-    import os
-    from dotenv import load_dotenv
-    from google import genai
-    from google.genai import types
-
-    # Load environment variables
-    load_dotenv()
-
-    # Initialize client with API key (GOOGLE_API_KEY or GEMINI_API_KEY in .env)
-    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-    client = genai.Client(api_key=api_key)
-
-    # Use gemini-2.5-flash-lite (same as generativelanguage.googleapis.com/v1/models/gemini-2.5-flash-lite)
-    model = "gemini-2.5-flash-lite"
-
-    # Generate structured output
-    response = client.models.generate_content(
-        model=model,
-        contents=prompt,
-        config=types.GenerateContentConfig(
-            response_mime_type="application/json",  # Force JSON
-            response_schema=schema                  # Apply schema
-        )
+def llm_api_function(prompt: str, schema: dict, timeout: Optional[float] = None):
+    """
+    Send a prompt to the configured LLM provider (LLM_PROVIDER) and return the
+    structured (JSON) response.
+    """
+    return get_llm_provider().generate_json(prompt, schema, timeout=timeout)
+
+
+def cached_llm_api_function(
+    kind: str, source_digest: Optional[str], prompt: str, schema: dict, extra: str = "",
+    is_complete: Optional[Callable[[Any], bool]] = None
+):
+    """
+    Like llm_api_function, but complete results are cached by the source
+    document hash, the prompt version for `kind`, the provider/model and a hash
+    of the prompt, so a change in the text sent (page/char budgets, OCR) is not
+    answered from the cache. Without a digest the call is made uncached. A result is complete when it has the
+    schema's required fields, or when is_complete(result) says so.
+    """
+    if not source_digest:
+        return llm_api_function(prompt, schema)
+
+    if is_complete is None:
+        def is_complete(details: Any) -> bool:
+            return isinstance(details, dict) and all(k in details for k in schema.get("required", []))
+
+    prompt_digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    key = make_cache_key(
+        kind, PROMPT_VERSIONS[kind], get_llm_provider().cache_namespace, schema, source_digest, extra, prompt_digest
     )
+    return llm_cache.get_or_compute(key, lambda: llm_api_function(prompt, schema), should_store=is_complete)
 
-    return response.parsed  # This will be a Python dict (valid JSON)
 
-def extract_agency_details_from_invoices(
-    invoices_text_extracted: List[str], agency_invoices: List[Dict[str, Any]]
-) -> Dict[str, Any]:
-    if len(invoices_text_extracted) < 3:
-        logger.warning("Received fewer than 3 invoices. Returning fallback response.")
-        return {
-            "status": "fallback",
-            "message": "Cannot process AI details with less than three invoices.",
-            "invoices": [],
-            "summary": {}
+async def llm_api_function_async(prompt: str, schema: dict, timeout: Optional[float] = None):
+    """Async variant of llm_api_function for use directly from route handlers."""
+    return await get_llm_provider().agenerate_json(prompt, schema, timeout=timeout)
+
+
+INVOICE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "agency_invoice_number": {"type": "string"},
+        "project_code": {"type": "string", "description": "e.g., PR24|71-30%"},
+        "campaign_name": {"type": "string"},
+        "total_amount": {"type": "number"},
+        "percentage": {
+            "type": "string",
+            "description": "Must be one of: 20%, 30%, 50%",
+            "enum": ["20%", "30%", "50%"]
         }
+    },
+    "required": [
+        "agency_invoice_number",
+        "project_code",
+        "campaign_name",
+        "total_amount"
+    ]
+}
+
+INVOICE_PERCENTAGE_INSTRUCTIONS = (
+    "The 'invoice percentage' MUST be one of: 20%, 30%, or 50%.\n\n"
+    "Search order:\n"
+    "1. Check the file name for 20%, 30%, or 50%.\n"
+    "2. If not in file name, check the invoice text.\n\n"
+    "Return the first valid value found. "
+    "If none are found, do not return a percentage."
+)
+
+# Fewer invoices than this are not processed
+MIN_AGENCY_INVOICES = 3
+
+
+def get_invoice_file_name(agency_invoices: List[Dict[str, Any]], index: int) -> str:
+    """Original file name of the index-th invoice"""
+    invoice_doc = agency_invoices[index] if index < len(agency_invoices) else {}
+    return invoice_doc.get(
+        "original_filename",
+        invoice_doc.get("file_path", f"invoice_{index+1}.pdf")
+    )
 
-    invoice_schema = {
-        "type": "object",
-        "properties": {
-            "agency_invoice_number": {"type": "string"},
-            "project_code": {"type": "string", "description": "e.g., PR24|71-30%"},
-            "campaign_name": {"type": "string"},
-            "total_amount": {"type": "number"},
-            "percentage": {
-                "type": "string",
-                "description": "Must be one of: 20%, 30%, 50%",
-                "enum": ["20%", "30%", "50%"]
-            }
-        },
-        "required": [
-            "agency_invoice_number",
-            "project_code",
-            "campaign_name",
-            "total_amount"
-        ]
+
+def insufficient_invoices_response() -> Dict[str, Any]:
+    logger.warning("Received fewer than 3 invoices. Returning fallback response.")
+    return {
+        "status": "fallback",
+        "message": "Cannot process AI details with less than three invoices.",
+        "invoices": [],
+        "summary": {}
     }
 
+
+def extract_single_invoice(text: str, file_path: Optional[str], original_file_name: str) -> Dict[str, Any]:
+    """Extract one invoice with the regex fast path, or Gemini when it is not confident"""
+    # Skip the LLM when the regex fast path is confident about every required field
+    details = try_invoice_fast_path(text, original_file_name)
+    if details:
+        details["extraction_method"] = "fast_path"
+        return details
+
+    prompt = (
+        f"Extract the following details from the invoice text. "
+        f"The original invoice file name is '{original_file_name}'.\n\n"
+        f"{INVOICE_PERCENTAGE_INSTRUCTIONS}\n\n"
+        "Invoice text:\n---\n"
+        f"{text}\n---"
+    )
+    # The file name is part of the key because the percentage is read from it
+    source_digest = get_file_digest(file_path) if file_path else None
+    details = cached_llm_api_function(
+        "agency_invoice", source_digest, prompt, INVOICE_SCHEMA, extra=original_file_name
+    )
+    if not all(k in details for k in INVOICE_SCHEMA["required"]):
+        raise ValueError(f"Incomplete details returned: {details}")
+    return {**details, "extraction_method": "llm"}
+
+
+def summarize_invoice_details(results: List[Tuple[str, Any]]) -> Dict[str, Any]:
+    """
+    Build the invoice branch output from (file name, details or exception)
+    pairs in the original invoice order.
+    """
     extracted_details_list: List[Dict[str, Any]] = []
     total_amount: float = 0.0
     invoice_details: List[str] = []
     file_names: List[str] = []
 
-    for i, text in enumerate(invoices_text_extracted):
-        invoice_doc = agency_invoices[i] if i < len(agency_invoices) else {}
-        original_file_name = invoice_doc.get(
-            "original_filename",
-            invoice_doc.get("file_path", f"invoice_{i+1}.pdf")
-        )
+    for original_file_name, details in results:
         file_names.append(original_file_name)
-
-        prompt = (
-            f"Extract the following details from the invoice text. "
-            f"The original invoice file name is '{original_file_name}'.\n\n"
-            "The 'invoice percentage' MUST be one of: 20%, 30%, or 50%.\n\n"
-            "Search order:\n"
-            "1. Check the file name for 20%, 30%, or 50%.\n"
-            "2. If not in file name, check the invoice text.\n\n"
-            "Return the first valid value found. "
-            "If none are found, do not return a percentage.\n\n"
-            "Invoice text:\n---\n"
-            f"{text}\n---"
-        )
-
-        try:
-            details = gemini_api_function(prompt, invoice_schema)
-            if not all(k in details for k in invoice_schema["required"]):
-                raise ValueError(f"Incomplete details returned: {details}")
-            details["file_name"] = original_file_name
-            extracted_details_list.append(details)
-            total_amount += float(details.get("total_amount", 0) or 0)
-            if details.get("agency_invoice_number") and details.get("percentage"):
-                invoice_details.append(
-                    f"{details['agency_invoice_number']} - {details['percentage']}"
-                )
-        except Exception as e:
-            logger.exception(
-                f"Error processing invoice '{original_file_name}' with Gemini API."
-            )
+        if isinstance(details, Exception):
             extracted_details_list.append({
                 "file_name": original_file_name,
-                "error": str(e)
+                "error": str(details)
             })
+            continue
+        details["file_name"] = original_file_name
+        extracted_details_list.append(details)
+        total_amount += float(details.get("total_amount", 0) or 0)
+        if details.get("agency_invoice_number") and details.get("percentage"):
+            invoice_details.append(
+                f"{details['agency_invoice_number']} - {details['percentage']}"
+            )
 
     return {
         "status": "success",
@@ -517,9 +449,64 @@ def extract_agency_details_from_invoices(
             "file_names": file_names
         }
     }
-def extract_po_details_from_job_order(job_order_docs: list):
+
+
+def extract_agency_details_from_invoices(
+    invoices_text_extracted: List[str], agency_invoices: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    if len(invoices_text_extracted) < MIN_AGENCY_INVOICES:
+        return insufficient_invoices_response()
+
+    file_names = [get_invoice_file_name(agency_invoices, i) for i in range(len(invoices_text_extracted))]
+    file_paths = [
+        agency_invoices[i].get("file_path") if i < len(agency_invoices) else None
+        for i in range(len(invoices_text_extracted))
+    ]
+
+    # Fan out the Gemini calls, then assemble results in the original invoice order
+    executor = get_invoice_executor()
+    futures = [
+        executor.submit(extract_single_invoice, text, file_path, original_file_name)
+        for text, file_path, original_file_name in zip(invoices_text_extracted, file_paths, file_names)
+    ]
+
+    results: List[Tuple[str, Any]] = []
+    for original_file_name, future in zip(file_names, futures):
+        try:
+            results.append((original_file_name, future.result()))
+        except Exception as e:
+            logger.exception(
+                f"Error processing invoice '{original_file_name}' with Gemini API."
+            )
+            results.append((original_file_name, e))
+
+    return summarize_invoice_details(results)
+
+
+PO_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "po_number": {"type": "string", "description": "The Purchase Order (PO) number, sometimes referred to as Job Order number."},
+        "po_amount": {"type": "number", "description": "The total amount of the Purchase Order."},
+    },
+    "required": ["po_number", "po_amount"]
+}
+
+PO_INSTRUCTIONS = """Your task is to extract the following two key pieces of information:
+    1.  **PO Number:** The unique identifier for the purchase order. It might be labeled as "PO Number", "Job Order #", "PO #", or similar.
+    2.  **PO Amount:** The total financial value of the order. Look for labels like "Total Amount", "Grand Total", or "PO Amount"."""
+
+
+def prepare_po_extraction(job_order_docs: list) -> Dict[str, Any]:
+    """
+    Read the job order text.
+
+    Returns:
+        {"result": details} when there is nothing to send to the LLM, otherwise
+        file_path, file_name and text of the job order
+    """
     if not job_order_docs:
-        return {}
+        return {"result": {}}
 
     # Assuming the first document is the correct one
     job_order_doc = job_order_docs[0]
@@ -527,60 +514,93 @@ def extract_po_details_from_job_order(job_order_docs: list):
     original_file_name = job_order_doc.get("original_filename", file_path)
 
     if not file_path:
-        return {}
+        return {"result": {}}
 
     # Extract text from the PDF using S3
     try:
-        text = read_pdf_from_s3(file_path)
+        text = read_pdf_from_s3(file_path, folder_type="job_order")
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
-        return {"error": f"Failed to read PDF {original_file_name}"}
+        return {"result": {"error": f"Failed to read PDF {original_file_name}"}}
+
+    return {"file_path": file_path, "file_name": original_file_name, "text": text}
 
-    po_schema = {
-        "type": "object",
-        "properties": {
-            "po_number": {"type": "string", "description": "The Purchase Order (PO) number, sometimes referred to as Job Order number."},
-            "po_amount": {"type": "number", "description": "The total amount of the Purchase Order."},
-        },
-        "required": ["po_number", "po_amount"]
-    }
 
+def extract_po_with_llm(prepared: Dict[str, Any]) -> Dict[str, Any]:
+    """Ask Gemini for the PO number and amount of a prepared job order"""
+    original_file_name = prepared["file_name"]
     prompt = f"""
     Please analyze the following text from a Job Order document (which is also a Purchase Order or PO).
     The original file name was '{original_file_name}'.
 
-    Your task is to extract the following two key pieces of information:
-    1.  **PO Number:** The unique identifier for the purchase order. It might be labeled as "PO Number", "Job Order #", "PO #", or similar.
-    2.  **PO Amount:** The total financial value of the order. Look for labels like "Total Amount", "Grand Total", or "PO Amount".
+    {PO_INSTRUCTIONS}
 
     Please provide the extracted information in a structured JSON format.
 
     Document text:
     ---
-    {text}
+    {prepared["text"]}
     ---
     """
 
     try:
-        details = gemini_api_function(prompt, po_schema)
+        details = cached_llm_api_function("job_order", get_file_digest(prepared["file_path"]), prompt, PO_SCHEMA)
         return details
     except Exception as e:
         print(f"Error processing Job Order {original_file_name} with Gemini API: {e}")
         return {"error": f"AI processing failed for {original_file_name}"}
 
-def extract_media_plan_details(approved_quotation_docs: list):
+
+def extract_po_details_from_job_order(job_order_docs: list):
+    prepared = prepare_po_extraction(job_order_docs)
+    if "result" in prepared:
+        return prepared["result"]
+    return extract_po_with_llm(prepared)
+
+
+# Output schema and prompt instruction for each media plan field; only the fields
+# the rule-based extractor could not resolve are requested from the LLM
+MEDIA_PLAN_FIELD_SCHEMAS = {
+    "medium": {"type": "string", "description": "Type of media (comma-separated if multiple)."},
+    "net_media_cost": {"type": "number", "description": "Sum of net media costs."},
+    "agency_fees": {"type": "number", "description": "Sum of agency fees."},
+    "taxes_amount": {"type": "number", "description": "Total taxes amount (Vat Ksa)."},
+    "third_party_cost": {"type": "number", "description": "Third party cost, 0 if not available."},
+    "media_plan_total_amount": {"type": "number", "description": "Total media plan amount including agency fees."},
+    "market_type": {"type": "string", "enum": ["A/E", "APAC", "DOMESTIC", "COE", "MEA"], "description": "Classified market type (BU/Markets from Geo-targeting)."},
+    "period_month": {"type": "string", "description": "The billing period/month, usually at the top of the Excel."}
+}
+
+MEDIA_PLAN_FIELD_INSTRUCTIONS = {
+    "medium": (
+        '- **Medium:** Identify the type(s) of media by matching the following exact English names from the "Total Budget by Platform" section of the Excel sheet:\n'
+        + "\n".join(f'    - "{name}"' for name in MEDIUM_TYPES)
+        + '\n  Only include a type if it has an associated budget or cost greater than zero. If multiple types are present, combine them with commas (e.g., "Digital non biddable, Television, Print"). Use these exact English names as your output values.'
+    ),
+    "net_media_cost": "- **Net Media Cost:** Locate the 'Net Media Cost' column and sum all numerical values found under it.",
+    "agency_fees": "- **Agency Fees:** Locate the 'Agency Fee' column and sum all numerical values found under it.",
+    "taxes_amount": "- **Taxes Amount:** Find the total taxes amount, specifically looking for labels like 'Vat Ksa' or 'KSA VAT'. Extract the exact numerical value.",
+    "third_party_cost": "- **Third Party Cost:** Look for 'Other 3rd Party Fee/Cost' or similar. If a value is available, use it exactly. If not found, output 0.",
+    "media_plan_total_amount": "- **Media Plan Total Amount:** Find the 'Total Payable (including agency fees)' or similar grand total. Extract the exact numerical value.",
+    "market_type": "- **Market Type (BU/Markets):** Classify the market based on the 'Geotargeting' column. It must be one of: 'A/E', 'APAC', 'DOMESTIC' (use 'DOMESTIC' if 'Saudi Arabia' or 'KSA' is explicitly mentioned in Geo-targeting), 'COE', or 'MEA'. Prioritize these exact classifications.",
+    "period_month": "- **Period Month:** Extract the period month from the top section of the Excel sheet, typically a date range or month-year (e.g., \"Sep 2024 - Apr 2025\").",
+}
+
+
+def select_media_plan_document(approved_quotation_docs: list) -> Optional[Dict[str, Any]]:
     """
     Given a list of approved_quotation_docs (each a dict with at least 'original_filename' and 'file_path'),
-    this function identifies the correct media plan Excel file to use for AI extraction.
+    this function identifies the correct media plan Excel file to use for AI extraction
+    and returns its document.
 
     The function will:
     - List all media plan Excel files found, with their names.
-    - Use AI to determine which file is the "after job" (actualized) media plan, and which is the "before job" (approved) media plan,
-      but NOT just by conventional naming, but by asking the AI to reason based on the file names and any available context.
-    - Extract details ONLY from the "after job" (actualized) media plan.
+    - Rank the files locally to find the "after job" (actualized) media plan: after/before-job words in the
+      file name and sheet, the sheet's version and the upload time (see score_media_plan_candidates).
+    - Only if the best scores tie, ask the AI to reason based on the file names and any available context.
+    - Details are extracted ONLY from the "after job" (actualized) media plan.
     - If only one media plan is found, use that.
-    - If none are found, return {}.
-    - The input/output signature remains unchanged.
+    - If none are found, return None.
     """
 
     # Step 1: Find all media plan Excel files in approved_quotation_docs
@@ -597,19 +617,38 @@ def extract_media_plan_details(approved_quotation_docs: list):
 
     if not media_plan_files:
         print("Media plan Excel file not found in approved_quotation.")
-        return {}
+        return None
 
     # If only one media plan, use it
     if len(media_plan_files) == 1:
-        selected_doc = media_plan_files[0]["doc"]
-        selected_filename = media_plan_files[0]["original_filename"]
-    else:
-        # Step 2: Use AI to determine which file is the "after job" (actualized) media plan
-        # Prepare a list of filenames for the prompt
-        filenames_list = [f"{i+1}: {f['original_filename']}" for i, f in enumerate(media_plan_files)]
-        filenames_text = "\n".join(filenames_list)
-
-        ai_selection_prompt = f"""
+        return media_plan_files[0]["doc"]
+
+    # Step 2: Rank the files locally (file name, sheet content, version, upload time)
+    scores = score_media_plan_candidates([
+        {
+            "file_name": f["original_filename"],
+            "uploaded_at": f["doc"].get("uploaded_at"),
+            "rows": read_excel_from_s3(f["file_path"]) if f["file_path"] else None
+        }
+        for f in media_plan_files
+    ])
+    best_score = max(scores)
+    if scores.count(best_score) == 1:
+        selected_index = scores.index(best_score)
+        logger.info(f"Selected media plan file #{selected_index+1}: {media_plan_files[selected_index]['original_filename']} (scores {scores})")
+        return media_plan_files[selected_index]["doc"]
+
+    # Identical files: any of them will do
+    candidate_digests = [get_file_digest(f["file_path"]) if f["file_path"] else None for f in media_plan_files]
+    if candidate_digests[0] and len(set(candidate_digests)) == 1:
+        return media_plan_files[-1]["doc"]
+
+    # Step 3: The scores tie; use AI to determine which file is the "after job" (actualized) media plan
+    # Prepare a list of filenames for the prompt
+    filenames_list = [f"{i+1}: {f['original_filename']}" for i, f in enumerate(media_plan_files)]
+    filenames_text = "\n".join(filenames_list)
+
+    ai_selection_prompt = f"""
 You are given a list of media plan Excel files related to a job. The files may include:
 - A media plan that was approved before the job started ("approved" or "pre-job" media plan)
 - A media plan that was filled after the job was completed ("actualized" or "post-job" media plan)
@@ -628,122 +667,160 @@ Your task:
 }}
 """
 
-        try:
-            # Use Gemini or other LLM to select the correct file index (1-based) and provide reasoning
-            ai_response = gemini_api_function(ai_selection_prompt, {
-                "type": "object",
-                "properties": {
-                    "after_job_media_plan_number": {
-                        "type": "integer",
-                        "description": "The number (1-based) of the file that is the after-job (actualized) media plan."
-                    },
-                    "explanation": {
-                        "type": "string",
-                        "description": "A brief explanation of the reasoning for the selection."
-                    }
+    # Cache the selection on the content of every candidate plus their names
+    selection_digest = make_cache_key(*candidate_digests) if all(candidate_digests) else None
+
+    try:
+        # Use Gemini or other LLM to select the correct file index (1-based) and provide reasoning
+        ai_response = cached_llm_api_function("media_plan_selection", selection_digest, ai_selection_prompt, {
+            "type": "object",
+            "properties": {
+                "after_job_media_plan_number": {
+                    "type": "integer",
+                    "description": "The number (1-based) of the file that is the after-job (actualized) media plan."
                 },
-                "required": ["after_job_media_plan_number", "explanation"]
-            })
-            # Parse the response to get the index
-            selected_index = None
-            if isinstance(ai_response, dict) and "after_job_media_plan_number" in ai_response:
-                try:
-                    selected_index = int(ai_response["after_job_media_plan_number"]) - 1
-                except Exception:
-                    selected_index = 0
-            else:
-                selected_index = 0  # fallback
-
-            if selected_index is None or not (0 <= selected_index < len(media_plan_files)):
-                selected_index = 0  # fallback
-
-            selected_doc = media_plan_files[selected_index]["doc"]
-            selected_filename = media_plan_files[selected_index]["original_filename"]
-
-            # Optionally, print or log the AI's explanation for audit
-            explanation = ai_response.get("explanation", "")
-            print(f"AI selected media plan file #{selected_index+1}: {selected_filename}. Reason: {explanation}")
+                "explanation": {
+                    "type": "string",
+                    "description": "A brief explanation of the reasoning for the selection."
+                }
+            },
+            "required": ["after_job_media_plan_number", "explanation"]
+        }, extra=filenames_text)
+        # Parse the response to get the index
+        selected_index = None
+        if isinstance(ai_response, dict) and "after_job_media_plan_number" in ai_response:
+            try:
+                selected_index = int(ai_response["after_job_media_plan_number"]) - 1
+            except Exception:
+                selected_index = 0
+        else:
+            selected_index = 0  # fallback
+
+        if selected_index is None or not (0 <= selected_index < len(media_plan_files)):
+            selected_index = 0  # fallback
+
+        selected_doc = media_plan_files[selected_index]["doc"]
+        selected_filename = media_plan_files[selected_index]["original_filename"]
+
+        # Optionally, print or log the AI's explanation for audit
+        explanation = ai_response.get("explanation", "")
+        print(f"AI selected media plan file #{selected_index+1}: {selected_filename}. Reason: {explanation}")
+
+    except Exception as e:
+        print(f"Error selecting after-job media plan with AI: {e}")
+        # Fallback: use the last file (often actualized/final)
+        selected_doc = media_plan_files[-1]["doc"]
+        selected_filename = media_plan_files[-1]["original_filename"]
+
+    return selected_doc
 
-        except Exception as e:
-            print(f"Error selecting after-job media plan with AI: {e}")
-            # Fallback: use the last file (often actualized/final)
-            selected_doc = media_plan_files[-1]["doc"]
-            selected_filename = media_plan_files[-1]["original_filename"]
+
+def prepare_media_plan_extraction(approved_quotation_docs: list) -> Dict[str, Any]:
+    """
+    Select and read the media plan and resolve what the rule-based extractor can.
+
+    Returns:
+        {"result": details} when no LLM call is needed, otherwise the request
+        for the remaining fields: file_path, file_name, excel_text,
+        local_details and missing_fields
+    """
+    selected_doc = select_media_plan_document(approved_quotation_docs)
+    if not selected_doc:
+        return {"result": {}}
 
     file_path = selected_doc.get("file_path")
     original_file_name = selected_doc.get("original_filename", file_path)
 
     excel_data = read_excel_from_s3(file_path)
     if not excel_data:
-        return {"error": f"Failed to read Excel file {original_file_name}"}
-
-    # Convert excel_data to a string format suitable for the prompt
-    excel_text = ""
-    for row in excel_data:
-        excel_text += "\t".join([str(cell) if cell is not None else "" for cell in row]) + "\n"
-    # Save the excel_text to a text file for inspection
-    with open("media_plan_excel_text.txt", "w", encoding="utf-8") as f:
-        f.write(excel_text)
-    media_plan_schema = {
-        "type": "object",
-        "properties": {
-            "medium": {"type": "string", "description": "Type of media (comma-separated if multiple)."},
-            "net_media_cost": {"type": "number", "description": "Sum of net media costs."},
-            "agency_fees": {"type": "number", "description": "Sum of agency fees."},
-            "taxes_amount": {"type": "number", "description": "Total taxes amount (Vat Ksa)."},
-            "third_party_cost": {"type": "number", "description": "Third party cost, 0 if not available."},
-            "media_plan_total_amount": {"type": "number", "description": "Total media plan amount including agency fees."},
-            "market_type": {"type": "string", "enum": ["A/E", "APAC", "DOMESTIC", "COE", "MEA"], "description": "Classified market type (BU/Markets from Geo-targeting)."},
-            "period_month": {"type": "string", "description": "The billing period/month, usually at the top of the Excel."}
-        },
-        "required": [
-            "medium", "net_media_cost", "agency_fees", "taxes_amount",
-            "third_party_cost", "media_plan_total_amount", "market_type", "period_month"
-        ]
+        return {"result": {"error": f"Failed to read Excel file {original_file_name}"}}
+
+    # Sums and lookups are computed from the sheet; the LLM only fills in the rest
+    local_details = extract_media_plan_locally(excel_data) if MEDIA_PLAN_LOCAL_EXTRACTION else {}
+    missing_fields = [field for field in MEDIA_PLAN_FIELDS if field not in local_details]
+    if not missing_fields:
+        logger.info(f"Media plan {original_file_name} fully extracted from the sheet")
+        return {"result": {field: local_details[field] for field in MEDIA_PLAN_FIELDS}}
+
+    return {
+        "file_path": file_path,
+        "file_name": original_file_name,
+        # Keep only the regions needed for extraction, within the prompt token budget
+        "excel_text": compact_media_plan_rows(excel_data),
+        "local_details": local_details,
+        "missing_fields": missing_fields,
     }
 
-    prompt = f"""
-You are an extremely precise financial analyst extracting data from an Excel-based Media Plan.
-The original file name is '{original_file_name}'.
 
-The content of the Excel sheet is provided below. Each row is separated by a newline, and columns by a tab.
+def build_media_plan_schema(missing_fields: List[str]) -> Dict[str, Any]:
+    """Response schema for the media plan fields the LLM has to extract"""
+    return {
+        "type": "object",
+        "properties": {field: MEDIA_PLAN_FIELD_SCHEMAS[field] for field in missing_fields},
+        "required": list(missing_fields)
+    }
 
-{excel_text}
 
-**CRITICAL INSTRUCTIONS FOR EXTRACTION:**
+def build_media_plan_instructions(missing_fields: List[str]) -> str:
+    """Extraction rules for the media plan fields the LLM has to extract"""
+    return f"""**CRITICAL INSTRUCTIONS FOR EXTRACTION:**
 - **ALL NUMERICAL VALUES MUST BE EXTRACTED EXACTLY AS THEY APPEAR OR AS THEIR PRECISE SUM.** Do not round or approximate any numbers.
 - If a field is not explicitly found, leave it out of the JSON response if it's not marked as required in the schema.
 
 Extract the following details:
-- **Medium:** Identify the type(s) of media by matching the following exact English names from the "Total Budget by Platform" section of the Excel sheet:
-    - "Television"
-    - "Radio"
-    - "Print"
-    - "Out of home – Indoor – In malls"
-    - "Inflight"
-    - "Cinema"
-    - "Digital non biddable"
-    - "Digital-Social/biddable Platforms"
-    - "Digital-programmatic"
-  Only include a type if it has an associated budget or cost greater than zero. If multiple types are present, combine them with commas (e.g., "Digital non biddable, Television, Print"). Use these exact English names as your output values.
-- **Net Media Cost:** Locate the 'Net Media Cost' column and sum all numerical values found under it.
-- **Agency Fees:** Locate the 'Agency Fee' column and sum all numerical values found under it.
-- **Taxes Amount:** Find the total taxes amount, specifically looking for labels like 'Vat Ksa' or 'KSA VAT'. Extract the exact numerical value.
-- **Third Party Cost:** Look for 'Other 3rd Party Fee/Cost' or similar. If a value is available, use it exactly. If not found, output 0.
-- **Media Plan Total Amount:** Find the 'Total Payable (including agency fees)' or similar grand total. Extract the exact numerical value.
-- **Market Type (BU/Markets):** Classify the market based on the 'Geotargeting' column. It must be one of: 'A/E', 'APAC', 'DOMESTIC' (use 'DOMESTIC' if 'Saudi Arabia' or 'KSA' is explicitly mentioned in Geo-targeting), 'COE', or 'MEA'. Prioritize these exact classifications.
-- **Period Month:** Extract the period month from the top section of the Excel sheet, typically a date range or month-year (e.g., "Sep 2024 - Apr 2025").
+{chr(10).join(MEDIA_PLAN_FIELD_INSTRUCTIONS[field] for field in missing_fields)}"""
+
+
+def complete_media_plan_details(prepared: Dict[str, Any], details: Any) -> Any:
+    """Merge LLM output with the locally computed values (which are exact and win)"""
+    if not isinstance(details, dict):
+        return details
+    details = {**details, **prepared["local_details"]}
+    return {field: details[field] for field in MEDIA_PLAN_FIELDS if field in details}
+
+
+def extract_media_plan_with_llm(prepared: Dict[str, Any]) -> Dict[str, Any]:
+    """Ask Gemini for the media plan fields that could not be resolved locally"""
+    original_file_name = prepared["file_name"]
+    missing_fields = prepared["missing_fields"]
+
+    prompt = f"""
+You are an extremely precise financial analyst extracting data from an Excel-based Media Plan.
+The original file name is '{original_file_name}'.
+
+The relevant regions of the Excel sheet are provided below. Each row is separated by a newline, and columns by a tab; empty cells, rows and columns have been removed and regions are separated by a blank line.
+
+{prepared["excel_text"]}
+
+{build_media_plan_instructions(missing_fields)}
 
 Provide the extracted information in a structured JSON format matching the schema. Adhere strictly to the data types defined in the schema.
 """
 
     try:
-        details = gemini_api_function(prompt, media_plan_schema)
-        return details
+        details = cached_llm_api_function(
+            "media_plan", get_file_digest(prepared["file_path"]), prompt,
+            build_media_plan_schema(missing_fields), extra=",".join(missing_fields)
+        )
     except Exception as e:
         print(f"Error processing Media Plan {original_file_name} with Gemini API: {e}")
+        if prepared["local_details"]:
+            return {**prepared["local_details"], "error": f"AI processing failed for {original_file_name}"}
         return {"error": f"AI processing failed for {original_file_name}"}
 
+    return complete_media_plan_details(prepared, details)
+
+
+def extract_media_plan_details(approved_quotation_docs: list):
+    """
+    Extract the media plan details from the after-job (actualized) media plan
+    among approved_quotation_docs. Returns {} if there is no media plan.
+    """
+    prepared = prepare_media_plan_extraction(approved_quotation_docs)
+    if "result" in prepared:
+        return prepared["result"]
+    return extract_media_plan_with_llm(prepared)
+
 
 def extract_invoices_text(invoices: List[Dict]) -> List[str]:
     """
@@ -761,24 +838,25 @@ def extract_invoices_text(invoices: List[Dict]) -> List[str]:
         logger.warning("Invalid input provided to extract_invoices_text. Returning empty list.")
         return extracted_texts
 
-    for invoice in invoices:
+    def extract_single_text(invoice: Dict) -> str:
         file_path = invoice.get("file_path")
 
         if not file_path or not isinstance(file_path, str):
             logger.warning(f"Skipping invoice with invalid file_path: {invoice}")
-            extracted_texts.append("")  # preserve alignment
-            continue
+            return ""  # preserve alignment
 
         try:
-            # Use S3 to read the PDF file
-            text = read_pdf_from_s3(file_path)
-            extracted_texts.append(text)
+            # Parsing happens in the parser process pool
+            text = read_pdf_from_s3(file_path, folder_type="agency_invoice")
             if not text:
-                logger.warning(f"No text extracted from {file_path} (possibly scanned image).")
+                logger.warning(f"No text extracted from {file_path} (scanned pages could not be OCR'd).")
+            return text
         except Exception as e:
             logger.exception(f"Error processing {file_path}")
-            extracted_texts.append("")
-    
+            return ""
+
+    # Parse the invoices in parallel; map() keeps the input order
+    extracted_texts.extend(get_invoice_executor().map(extract_single_text, invoices))
     return extracted_texts
 def read_excel_file(file_path: str) -> Optional[List[List[Any]]]:
     """
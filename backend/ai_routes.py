@@ -0,0 +1,53 @@
+from fastapi import APIRouter, HTTPException
+from bson import ObjectId
+
+from db import ai_tasks_collection
+from models import AITask
+from ai_tasks import task_to_model
+from extraction_cache import llm_cache, text_cache, ocr_cache
+from invoice_fast_path import invoice_fast_path_stats
+from llm_scheduler import get_llm_scheduler
+from llm_providers import get_llm_provider
+
+router = APIRouter()
+
+
+@router.get("/ai_tasks/{task_id}", response_model=AITask)
+async def get_ai_task(task_id: str):
+    """Get the status of a background AI task"""
+    try:
+        object_id = ObjectId(task_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid task ID format")
+
+    task = await ai_tasks_collection.find_one({"_id": object_id})
+    if not task:
+        raise HTTPException(status_code=404, detail="AI task not found")
+    return task_to_model(task)
+
+
+@router.get("/ai/cache/stats")
+async def get_ai_cache_stats():
+    """Get hit/miss counters and size of the AI extraction caches"""
+    return {
+        "llm": llm_cache.stats(),
+        "text": text_cache.stats(),
+        "ocr": ocr_cache.stats()
+    }
+
+
+@router.get("/ai/fast_path/stats")
+async def get_ai_fast_path_stats():
+    """Get how many invoices were extracted without calling the LLM"""
+    return {
+        "invoice": invoice_fast_path_stats.stats()
+    }
+
+
+@router.get("/ai/llm/stats")
+async def get_ai_llm_stats():
+    """Get the LLM provider and the rate limiter, retry and circuit breaker counters of the call scheduler"""
+    return {
+        "provider": get_llm_provider().cache_namespace,
+        **get_llm_scheduler().stats()
+    }
@@ -0,0 +1,201 @@
+"""
+Background AI Task Queue
+
+In-process asyncio work queue for AI processing. Every task is persisted in the
+Mongo ai_tasks collection, so clients can poll its status and tasks that were
+queued or running when the process stopped are picked up again on startup.
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from db import ai_tasks_collection
+from models import AITask, AITaskStatus
+from ai_pipeline import run_job_ai_process, process_job_documents_and_update_status
+
+logger = logging.getLogger(__name__)
+
+# Number of worker coroutines consuming the queue
+AI_TASK_WORKERS = int(os.getenv("AI_TASK_WORKERS", "2"))
+
+# Task types
+TASK_RUN_AI_PROCESS = "run_ai_process"
+TASK_PROCESS_DOCUMENTS = "process_documents"
+
+
+async def _run_ai_process_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    params = task.get("params", {})
+    updated_job = await run_job_ai_process(task["job_id"], params.get("mode"), params.get("force", False))
+    if not updated_job:
+        raise ValueError("Job not found")
+    return {"job_status": updated_job.get("status")}
+
+
+async def _process_documents_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    await process_job_documents_and_update_status(task["job_id"])
+    return {}
+
+
+TASK_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = {
+    TASK_RUN_AI_PROCESS: _run_ai_process_task,
+    TASK_PROCESS_DOCUMENTS: _process_documents_task,
+}
+
+
+def task_to_model(task: Dict[str, Any]) -> AITask:
+    """Convert an ai_tasks document to the API model"""
+    return AITask(
+        id=str(task["_id"]),
+        task_type=task["task_type"],
+        job_id=task["job_id"],
+        status=task["status"],
+        params=task.get("params", {}),
+        result=task.get("result"),
+        error=task.get("error"),
+        attempts=task.get("attempts", 0),
+        created_at=task["created_at"],
+        started_at=task.get("started_at"),
+        finished_at=task.get("finished_at")
+    )
+
+
+class AITaskQueue:
+    def __init__(self, workers: int = AI_TASK_WORKERS):
+        self.workers = max(1, workers)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Start the workers and re-queue unfinished tasks from the database"""
+        if self._worker_tasks:
+            return
+        self._queue = asyncio.Queue()
+
+        # Tasks left running by a previous process were interrupted; run them again
+        await ai_tasks_collection.update_many(
+            {"status": AITaskStatus.RUNNING},
+            {"$set": {"status": AITaskStatus.QUEUED}}
+        )
+        recovered = 0
+        async for task in ai_tasks_collection.find({"status": AITaskStatus.QUEUED}).sort("created_at", 1):
+            self._queue.put_nowait(str(task["_id"]))
+            recovered += 1
+        if recovered:
+            logger.info(f"Re-queued {recovered} unfinished AI tasks")
+
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Cancel the workers; unfinished tasks stay in the database for the next start"""
+        for worker in self._worker_tasks:
+            worker.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def enqueue(
+        self,
+        task_type: str,
+        job_id: str,
+        params: Optional[Dict[str, Any]] = None,
+        coalesce: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Persist a new task and queue it for the workers.
+
+        With coalesce=True an already queued task of the same type for the
+        same job is returned instead of creating another one.
+        """
+        if task_type not in TASK_HANDLERS:
+            raise ValueError(f"Unknown AI task type: {task_type}")
+
+        task = {
+            "task_type": task_type,
+            "job_id": job_id,
+            "status": AITaskStatus.QUEUED,
+            "params": params or {},
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "created_at": datetime.utcnow(),
+            "started_at": None,
+            "finished_at": None
+        }
+        if coalesce:
+            # One atomic upsert; the partial unique index on queued coalesced
+            # tasks (see init_db) stops concurrent enqueues from both inserting
+            task["_id"] = ObjectId()
+            query = {"task_type": task_type, "job_id": job_id, "status": AITaskStatus.QUEUED, "coalesced": True}
+            try:
+                existing = await ai_tasks_collection.find_one_and_update(
+                    query,
+                    {"$setOnInsert": {k: v for k, v in task.items() if k not in query}},
+                    upsert=True,
+                    return_document=True
+                )
+            except DuplicateKeyError:
+                # A concurrent enqueue inserted the task first
+                return await self.enqueue(task_type, job_id, params, coalesce=True)
+            if existing["_id"] != task["_id"]:
+                return existing
+            task = existing
+        else:
+            result = await ai_tasks_collection.insert_one(task)
+            task["_id"] = result.inserted_id
+
+        # If the workers are not running yet, start() will pick the task up from the database
+        if self._queue is not None:
+            self._queue.put_nowait(str(task["_id"]))
+        return task
+
+    async def _worker(self, index: int):
+        while True:
+            task_id = await self._queue.get()
+            try:
+                await self._run(task_id)
+            except Exception:
+                logger.exception(f"AI task worker {index} failed on task {task_id}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, task_id: str):
+        # Claim the task atomically so it only runs once
+        task = await ai_tasks_collection.find_one_and_update(
+            {"_id": ObjectId(task_id), "status": AITaskStatus.QUEUED},
+            {
+                "$set": {"status": AITaskStatus.RUNNING, "started_at": datetime.utcnow()},
+                "$unset": {"coalesced": ""},
+                "$inc": {"attempts": 1}
+            },
+            return_document=True
+        )
+        if not task:
+            return
+
+        handler = TASK_HANDLERS[task["task_type"]]
+        try:
+            result = await handler(task)
+            update = {"status": AITaskStatus.COMPLETED, "result": result, "error": None}
+        except Exception as e:
+            logger.exception(f"AI task {task_id} ({task['task_type']}) failed for job {task['job_id']}")
+            update = {"status": AITaskStatus.FAILED, "error": str(e)}
+
+        update["finished_at"] = datetime.utcnow()
+        await ai_tasks_collection.update_one({"_id": task["_id"]}, {"$set": update})
+
+# Global AI task queue instance
+ai_task_queue = None
+
+def get_ai_task_queue() -> AITaskQueue:
+    """Get or create the AI task queue instance"""
+    global ai_task_queue
+    if ai_task_queue is None:
+        ai_task_queue = AITaskQueue()
+    return ai_task_queue
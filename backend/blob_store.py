@@ -0,0 +1,218 @@
+"""
+Content-Addressed Blob Store
+
+Job and folder documents are stored once per unique content under
+uploads/blobs/<first two hex chars>/<sha256>, however many jobs they are
+uploaded to. The Mongo blobs collection keeps a reference count per hash:
+uploads increment it, deletes decrement it and the file is removed when the
+last reference goes away.
+
+Several API processes (uvicorn workers) can share the store: the process that
+drops the last reference marks the record as deleting before it removes the
+file, and an upload that finds the mark waits for the delete to finish before
+it puts the file back.
+
+Because documents share one path per content, the text and LLM caches and the
+extraction fingerprints also line up across jobs, so a media plan uploaded to
+ten jobs is parsed and extracted once.
+"""
+
+import os
+import uuid
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Optional
+
+from db import blobs_collection
+from storage import get_storage, get_storage_executor
+
+logger = logging.getLogger(__name__)
+
+BLOB_ROOT = "uploads/blobs"
+_STAGING_DIR = f"{BLOB_ROOT}/tmp"
+
+# Reference count changes and file moves for one hash are serialized in this
+# process (other processes are handled by the deleting mark); hashes are spread
+# over a fixed set of locks
+_LOCK_STRIPES = 64
+_locks = [asyncio.Lock() for _ in range(_LOCK_STRIPES)]
+
+# How long an upload waits for another process to finish deleting the same
+# blob before taking it over (the deleting process may have died)
+_DELETE_WAIT_SECONDS = 30
+_DELETE_POLL_SECONDS = 0.05
+
+
+def _lock_for(content_hash: str) -> asyncio.Lock:
+    return _locks[int(content_hash[:8], 16) % _LOCK_STRIPES]
+
+
+def blob_path(content_hash: str) -> str:
+    """Relative path of the blob with this SHA-256"""
+    return f"{BLOB_ROOT}/{content_hash[:2]}/{content_hash}"
+
+
+def is_blob_path(file_path: Optional[str]) -> bool:
+    return bool(file_path) and str(file_path).startswith(f"{BLOB_ROOT}/")
+
+
+async def _drop_reference(content_hash: str) -> bool:
+    """
+    Decrement the reference count of a blob (the caller holds its lock).
+    Returns True if that removed the last reference and marked the blob as
+    deleting; the caller then deletes it with _delete_blob.
+    """
+    blob = await blobs_collection.find_one_and_update(
+        {"_id": content_hash},
+        {"$inc": {"refcount": -1}},
+        return_document=True,
+    )
+    if blob is None:
+        logger.warning(f"Released unknown blob {content_hash}")
+        return False
+    if blob["refcount"] > 0:
+        return False
+    # Another process may have added a reference since the decrement
+    claimed = await blobs_collection.find_one_and_update(
+        {"_id": content_hash, "refcount": {"$lte": 0}, "deleting": {"$ne": True}},
+        {"$set": {"deleting": True}},
+    )
+    return claimed is not None
+
+
+async def _finish_delete(content_hash: str) -> bool:
+    """
+    Remove the record of a blob whose file was deleted, or clear the deleting
+    mark if an upload added a reference meanwhile. Returns True if removed.
+    """
+    result = await blobs_collection.delete_one({"_id": content_hash, "refcount": {"$lte": 0}, "deleting": True})
+    if result.deleted_count == 1:
+        return True
+    await blobs_collection.update_one({"_id": content_hash}, {"$unset": {"deleting": ""}})
+    return False
+
+
+async def _delete_blob(content_hash: str) -> bool:
+    """Delete the file of a blob marked as deleting, then its record"""
+    try:
+        await get_storage().adelete_file(blob_path(content_hash))
+    finally:
+        deleted = await _finish_delete(content_hash)
+    return deleted
+
+
+async def _wait_for_delete(content_hash: str) -> bool:
+    """
+    Wait while another process deletes this blob's file. Returns False if the
+    mark is still there after _DELETE_WAIT_SECONDS; the upload then takes over.
+    """
+    deadline = time.monotonic() + _DELETE_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        await asyncio.sleep(_DELETE_POLL_SECONDS)
+        blob = await blobs_collection.find_one({"_id": content_hash}, {"deleting": 1})
+        if not blob or not blob.get("deleting"):
+            return True
+    logger.warning(f"Blob {content_hash} is still marked as deleting; storing it again")
+    return False
+
+
+async def _discard_staging(staging_path: str) -> None:
+    try:
+        await get_storage().adelete_file(staging_path, invalidate_cache=False)
+    except Exception as e:
+        logger.warning(f"Could not delete staged upload {staging_path}: {e}")
+
+
+async def store_blob(stream: BinaryIO, content_type: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Stream an upload into the blob store and add a reference to it.
+
+    Returns:
+        Dict with file_path (the blob path), s3_key, file_url, size,
+        content_hash and deduplicated (True if the content was already stored)
+    """
+    storage = get_storage()
+    staging_path = f"{_STAGING_DIR}/{uuid.uuid4().hex}"
+    saved = await storage.asave_file_stream(staging_path, stream, content_type)
+    content_hash = saved["sha256"]
+    path = blob_path(content_hash)
+
+    async with _lock_for(content_hash):
+        try:
+            blob = await blobs_collection.find_one_and_update(
+                {"_id": content_hash},
+                {
+                    "$inc": {"refcount": 1},
+                    "$set": {"last_referenced_at": datetime.utcnow()},
+                    "$setOnInsert": {
+                        "size": saved["size"],
+                        "content_type": content_type,
+                        "created_at": datetime.utcnow(),
+                    },
+                },
+                upsert=True,
+                return_document=True,
+            )
+        except Exception:
+            await _discard_staging(staging_path)
+            raise
+
+        try:
+            # Another process is deleting the file: our reference keeps the
+            # record, and the file is put back once the delete is done
+            deleting = bool(blob.get("deleting"))
+            taken_over = deleting and not await _wait_for_delete(content_hash)
+            deduplicated = not deleting and blob["refcount"] > 1 and await storage.afile_exists(path)
+            if not deduplicated:
+                await storage.amove_file(staging_path, path)
+            if taken_over:
+                await blobs_collection.update_one({"_id": content_hash}, {"$unset": {"deleting": ""}})
+        except Exception:
+            # The file is not in place: take the reference back
+            if await _drop_reference(content_hash):
+                await _delete_blob(content_hash)
+            await _discard_staging(staging_path)
+            raise
+        if deduplicated:
+            await _discard_staging(staging_path)
+
+    return {
+        "s3_key": path,
+        "file_path": path,
+        "file_url": f"/api/files/serve/{path}",
+        "size": saved["size"],
+        "content_hash": content_hash,
+        "deduplicated": deduplicated,
+    }
+
+
+async def release_blob(content_hash: str) -> bool:
+    """
+    Drop one reference to a blob; the file is deleted with the last one.
+    Returns True if the blob was deleted.
+    """
+    async with _lock_for(content_hash):
+        if not await _drop_reference(content_hash):
+            return False
+        return await _delete_blob(content_hash)
+
+
+async def release_document_file(document: Dict[str, Any]) -> None:
+    """
+    Release the file of a job/folder document: blob references are decremented,
+    files from before the blob store are deleted directly. Errors are logged,
+    not raised, so the document itself can always be removed.
+    """
+    file_path = document.get("file_path")
+    content_hash = document.get("content_hash")
+    try:
+        if content_hash and is_blob_path(file_path):
+            await release_blob(content_hash)
+        elif file_path and str(file_path).startswith("uploads/"):
+            await get_storage().adelete_file(file_path)
+        elif file_path and os.path.isabs(file_path) and os.path.isfile(file_path):
+            await asyncio.get_running_loop().run_in_executor(get_storage_executor(), os.remove, file_path)
+    except Exception as e:
+        logger.error(f"Could not release file {file_path}: {e}")
@@ -0,0 +1,278 @@
+"""
+Combined Job Extraction
+
+"combined" execution mode: instead of one LLM call per invoice plus calls
+for the job order and the media plan, everything a job still needs from the
+LLM (after the regex / rule-based fast paths) is requested in a single call
+with a composite response schema. Each section of the response is validated on
+its own; a section that is missing or incomplete falls back to the regular
+per-document extraction, so a bad combined response never loses data.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from extraction_cache import make_cache_key
+from ai_processor import (
+    INVOICE_SCHEMA,
+    INVOICE_PERCENTAGE_INSTRUCTIONS,
+    MIN_AGENCY_INVOICES,
+    PO_SCHEMA,
+    PO_INSTRUCTIONS,
+    build_media_plan_instructions,
+    build_media_plan_schema,
+    cached_llm_api_function,
+    complete_media_plan_details,
+    extract_invoices_text,
+    extract_media_plan_with_llm,
+    extract_po_with_llm,
+    extract_single_invoice,
+    get_file_digest,
+    get_invoice_executor,
+    get_invoice_file_name,
+    insufficient_invoices_response,
+    prepare_media_plan_extraction,
+    prepare_po_extraction,
+    summarize_invoice_details,
+)
+from invoice_fast_path import try_invoice_fast_path
+
+logger = logging.getLogger(__name__)
+
+
+def _has_required(details: Any, schema: Dict[str, Any]) -> bool:
+    return isinstance(details, dict) and all(k in details for k in schema.get("required", []))
+
+
+def _invoice_items(response: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+    """Invoice entries of a combined response by their section number"""
+    items: Dict[int, Dict[str, Any]] = {}
+    for item in response.get("invoices") or []:
+        if isinstance(item, dict) and isinstance(item.get("invoice_number_in_prompt"), int):
+            items[item["invoice_number_in_prompt"]] = item
+    return items
+
+
+def _is_complete(
+    response: Any,
+    pending_invoices: List[Dict[str, Any]],
+    po_request: Optional[Dict[str, Any]],
+    media_plan_request: Optional[Dict[str, Any]],
+) -> bool:
+    """True if every requested section of a combined response is usable (only those are cached)"""
+    if not isinstance(response, dict):
+        return False
+    items = _invoice_items(response)
+    if not all(_has_required(items.get(number), INVOICE_SCHEMA) for number in range(1, len(pending_invoices) + 1)):
+        return False
+    if po_request and not _has_required(response.get("job_order"), PO_SCHEMA):
+        return False
+    if media_plan_request and not _has_required(
+        response.get("media_plan"), build_media_plan_schema(media_plan_request["missing_fields"])
+    ):
+        return False
+    return True
+
+
+def _build_schema(
+    pending_invoices: List[Dict[str, Any]],
+    po_request: Optional[Dict[str, Any]],
+    media_plan_request: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    properties: Dict[str, Any] = {}
+    if pending_invoices:
+        invoice_item = {
+            "type": "object",
+            "properties": {
+                "invoice_number_in_prompt": {"type": "integer", "description": "The number of the invoice section (1-based)."},
+                **INVOICE_SCHEMA["properties"]
+            },
+            "required": ["invoice_number_in_prompt"] + INVOICE_SCHEMA["required"]
+        }
+        properties["invoices"] = {"type": "array", "items": invoice_item}
+    if po_request:
+        properties["job_order"] = PO_SCHEMA
+    if media_plan_request:
+        properties["media_plan"] = build_media_plan_schema(media_plan_request["missing_fields"])
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+
+def _build_prompt(
+    pending_invoices: List[Dict[str, Any]],
+    po_request: Optional[Dict[str, Any]],
+    media_plan_request: Optional[Dict[str, Any]],
+) -> str:
+    sections = [
+        "You are an extremely precise financial analyst reviewing the documents of one advertising job.\n"
+        "Extract the details of every document section below and return them in one JSON object "
+        "matching the schema: 'invoices' for the agency invoices, 'job_order' for the job order (PO) "
+        "and 'media_plan' for the media plan. Only use the text of a section for that section."
+    ]
+
+    if pending_invoices:
+        invoice_parts = [
+            "## Agency invoices\n"
+            "For each invoice return one entry in 'invoices' with 'invoice_number_in_prompt' set to the "
+            "number of its section.\n"
+            f"{INVOICE_PERCENTAGE_INSTRUCTIONS}"
+        ]
+        for number, invoice in enumerate(pending_invoices, start=1):
+            invoice_parts.append(
+                f"### Invoice {number}\n"
+                f"The original invoice file name is '{invoice['file_name']}'.\n"
+                f"Invoice text:\n---\n{invoice['text']}\n---"
+            )
+        sections.append("\n\n".join(invoice_parts))
+
+    if po_request:
+        sections.append(
+            "## Job order (Purchase Order)\n"
+            f"The original file name was '{po_request['file_name']}'.\n"
+            f"{PO_INSTRUCTIONS}\n"
+            f"Document text:\n---\n{po_request['text']}\n---"
+        )
+
+    if media_plan_request:
+        sections.append(
+            "## Media plan\n"
+            f"The original file name is '{media_plan_request['file_name']}'.\n"
+            "The relevant regions of the Excel sheet are provided below. Each row is separated by a newline, "
+            "and columns by a tab; empty cells, rows and columns have been removed and regions are separated "
+            "by a blank line.\n"
+            f"---\n{media_plan_request['excel_text']}\n---\n"
+            f"{build_media_plan_instructions(media_plan_request['missing_fields'])}"
+        )
+
+    sections.append(
+        "Provide the extracted information in a structured JSON format matching the schema. "
+        "Adhere strictly to the data types defined in the schema."
+    )
+    return "\n\n".join(sections)
+
+
+def _source_digest(
+    pending_invoices: List[Dict[str, Any]],
+    po_request: Optional[Dict[str, Any]],
+    media_plan_request: Optional[Dict[str, Any]],
+) -> Optional[str]:
+    """Cache digest over every document in the request; None if one cannot be hashed"""
+    parts: List[Any] = []
+    for invoice in pending_invoices:
+        parts.append((get_file_digest(invoice["file_path"]) if invoice["file_path"] else None, invoice["file_name"]))
+    if po_request:
+        parts.append((get_file_digest(po_request["file_path"]), "job_order"))
+    if media_plan_request:
+        parts.append((get_file_digest(media_plan_request["file_path"]), media_plan_request["missing_fields"]))
+    if any(digest is None for digest, _ in parts):
+        return None
+    return make_cache_key(*parts)
+
+
+def extract_job_details_combined(
+    checklist: Dict[str, List[Dict[str, Any]]],
+    branches: Tuple[str, ...] = ("invoice", "po", "media_plan"),
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Extract the invoice, job order (PO) and media plan details of a job with at
+    most one LLM call (plus per-section fallbacks).
+
+    Args:
+        checklist: The job's document checklist
+        branches: The sections to extract; the others are returned as None
+
+    Returns:
+        Tuple of (invoice_details, po_details, media_plan_details), shaped like
+        the outputs of the per-document extraction functions
+    """
+    agency_invoices = (checklist.get("agency_invoice", []) or []) if "invoice" in branches else []
+    po_request = (
+        prepare_po_extraction(checklist.get("job_order", []) or [])
+        if "po" in branches else {"result": None}
+    )
+    media_plan_request = (
+        prepare_media_plan_extraction(checklist.get("approved_quotation", []) or [])
+        if "media_plan" in branches else {"result": None}
+    )
+
+    # Invoices the regex fast path resolves never reach the LLM
+    invoice_results: List[Tuple[str, Any]] = []
+    pending_invoices: List[Dict[str, Any]] = []
+    invoices_text = extract_invoices_text(agency_invoices) if agency_invoices else []
+    if len(invoices_text) >= MIN_AGENCY_INVOICES:
+        for index, text in enumerate(invoices_text):
+            file_name = get_invoice_file_name(agency_invoices, index)
+            file_path = agency_invoices[index].get("file_path") if index < len(agency_invoices) else None
+            details = try_invoice_fast_path(text, file_name)
+            if details:
+                details["extraction_method"] = "fast_path"
+            else:
+                pending_invoices.append({"index": index, "text": text, "file_name": file_name, "file_path": file_path})
+            invoice_results.append((file_name, details))
+
+    po_pending = None if "result" in po_request else po_request
+    media_plan_pending = None if "result" in media_plan_request else media_plan_request
+
+    response: Dict[str, Any] = {}
+    if pending_invoices or po_pending or media_plan_pending:
+        schema = _build_schema(pending_invoices, po_pending, media_plan_pending)
+        prompt = _build_prompt(pending_invoices, po_pending, media_plan_pending)
+        try:
+            # Incomplete responses are not cached; their sections are cached by the fallback calls
+            response = cached_llm_api_function(
+                "combined", _source_digest(pending_invoices, po_pending, media_plan_pending), prompt, schema,
+                is_complete=lambda details: _is_complete(details, pending_invoices, po_pending, media_plan_pending)
+            )
+        except Exception as e:
+            logger.error(f"Combined extraction call failed, falling back to per-document calls: {e}")
+        if not isinstance(response, dict):
+            response = {}
+
+    # Invoices: take valid entries from the combined response, re-extract the rest one by one
+    combined_invoices = _invoice_items(response)
+
+    fallback_futures = {}
+    for number, invoice in enumerate(pending_invoices, start=1):
+        item = combined_invoices.get(number)
+        if _has_required(item, INVOICE_SCHEMA):
+            details = {k: v for k, v in item.items() if k != "invoice_number_in_prompt"}
+            details["extraction_method"] = "combined"
+            invoice_results[invoice["index"]] = (invoice["file_name"], details)
+        else:
+            logger.warning(f"Invoice '{invoice['file_name']}' missing from combined response; extracting it separately")
+            fallback_futures[invoice["index"]] = get_invoice_executor().submit(
+                extract_single_invoice, invoice["text"], invoice["file_path"], invoice["file_name"]
+            )
+    for index, future in fallback_futures.items():
+        file_name = invoice_results[index][0]
+        try:
+            invoice_results[index] = (file_name, future.result())
+        except Exception as e:
+            logger.exception(f"Error processing invoice '{file_name}' with Gemini API.")
+            invoice_results[index] = (file_name, e)
+
+    if "invoice" not in branches:
+        invoice_details = None
+    elif len(invoices_text) >= MIN_AGENCY_INVOICES:
+        invoice_details = summarize_invoice_details(invoice_results)
+    else:
+        invoice_details = insufficient_invoices_response()
+
+    # Job order
+    if po_pending is None:
+        po_details = po_request["result"]
+    elif _has_required(response.get("job_order"), PO_SCHEMA):
+        po_details = response["job_order"]
+    else:
+        logger.warning("Job order missing from combined response; extracting it separately")
+        po_details = extract_po_with_llm(po_pending)
+
+    # Media plan
+    if media_plan_pending is None:
+        media_plan_details = media_plan_request["result"]
+    elif _has_required(response.get("media_plan"), build_media_plan_schema(media_plan_pending["missing_fields"])):
+        media_plan_details = complete_media_plan_details(media_plan_pending, response["media_plan"])
+    else:
+        logger.warning("Media plan missing from combined response; extracting it separately")
+        media_plan_details = extract_media_plan_with_llm(media_plan_pending)
+
+    return invoice_details, po_details, media_plan_details
@@ -22,6 +22,8 @@ jobs_collection = database.jobs
 invoices_collection = database.invoices
 folders_collection = database.folders
 files_collection = database.files
+ai_tasks_collection = database.ai_tasks
+blobs_collection = database.blobs
 
 async def init_db():
     """Initialize database with indexes"""
@@ -52,5 +54,13 @@ async def init_db():
     await rate_cards_collection.create_index([("client_id", 1)])
     await folders_collection.create_index([("invoice_id", 1)])
     await files_collection.create_index([("folder_id", 1)])
+    await ai_tasks_collection.create_index([("status", 1), ("created_at", 1)])
+    await ai_tasks_collection.create_index([("job_id", 1)])
+    # At most one queued coalesced task per job and task type (see AITaskQueue.enqueue)
+    await ai_tasks_collection.create_index(
+        [("task_type", 1), ("job_id", 1)],
+        unique=True,
+        partialFilterExpression={"status": "queued", "coalesced": True}
+    )
     
     print("Database indexes initialized successfully")
\ No newline at end of file
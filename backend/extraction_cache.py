@@ -0,0 +1,267 @@
+"""
+Extraction Cache
+
+Persistent, content-addressed caches for AI extraction. Entries are JSON files
+stored under backend/cache/<namespace>/:
+
+- llm: LLM results keyed by the SHA-256 of the source document bytes plus the
+  prompt/schema version, so re-running the AI process on an unchanged job (or
+  on another job that shares the same document) does not call the LLM again.
+- text: text and table rows parsed from PDF/Excel files, keyed by content hash
+  and invalidated when the file is deleted through the storage backend.
+- ocr: OCR text of scanned PDF pages and images, keyed by the SHA-256 of the
+  page image, so the same page is never OCR'd twice.
+
+The extraction functions run in worker threads, so the cache is file based and
+thread safe rather than going through the async Mongo driver.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+BACKEND_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
+
+# Cache settings
+EXTRACTION_CACHE_DIR = Path(os.getenv("EXTRACTION_CACHE_DIR", str(BACKEND_DIR / "cache")))
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Entries older than this many seconds are treated as misses (default 30 days)
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", str(30 * 24 * 3600)))
+# Least recently used entries are evicted above this many entries per namespace
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "5000"))
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Build a SHA-256 cache key from the given parts (strings, numbers or JSON-able objects)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, (str, bytes)):
+            part = json.dumps(part, sort_keys=True, default=str)
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(part)
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class DiskCache:
+    def __init__(
+        self,
+        namespace: str,
+        ttl: int = EXTRACTION_CACHE_TTL,
+        max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES,
+        enabled: bool = EXTRACTION_CACHE_ENABLED,
+    ):
+        """JSON file cache with TTL expiry, LRU eviction and hit/miss counters"""
+        self.namespace = namespace
+        self.directory = EXTRACTION_CACHE_DIR / namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entry_count: Optional[int] = None
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        """Entries are sharded by the first two hex characters of the key"""
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss or expired entry"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if self.ttl and time.time() - entry.get("created_at", 0) > self.ttl:
+            self.delete(key)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Touch the entry so LRU eviction keeps recently used results
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry.get("value")
+
+    def set(self, key: str, value: Any) -> None:
+        """Store value under key (written atomically)"""
+        if not self.enabled:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        is_new = not path.exists()
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_text(
+            json.dumps({"created_at": time.time(), "value": value}, default=str),
+            encoding="utf-8"
+        )
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._entry_count is None:
+                self._entry_count = self._count_entries()
+            elif is_new:
+                self._entry_count += 1
+            if self.max_entries and self._entry_count > self.max_entries:
+                self._evict()
+
+    def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Any],
+        should_store: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """
+        Return the cached value for key, or compute and store it. Concurrent
+        callers asking for the same missing key wait for the first one instead
+        of computing it again (e.g. one media plan shared by a batch of jobs).
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            event = self._inflight.get(key)
+            is_leader = event is None
+            if is_leader:
+                event = threading.Event()
+                self._inflight[key] = event
+
+        if not is_leader:
+            event.wait()
+            value = self.get(key)
+            if value is not None:
+                return value
+            # The first caller failed or its result was not cacheable
+            return compute()
+
+        try:
+            value = compute()
+            if should_store is None or should_store(value):
+                self.set(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def delete(self, key: str) -> bool:
+        """Remove an entry. Returns True if it existed."""
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if self._entry_count:
+                self._entry_count -= 1
+        return True
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Remove every entry whose key starts with prefix (at least 2 characters). Returns the count."""
+        removed = 0
+        for path in (self.directory / prefix[:2]).glob(f"{prefix}*.json"):
+            try:
+                path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            if self._entry_count:
+                self._entry_count = max(0, self._entry_count - removed)
+        return removed
+
+    def clear(self) -> None:
+        """Remove every entry in this namespace"""
+        for path in self.directory.glob("*/*.json"):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._entry_count = 0
+
+    def _count_entries(self) -> int:
+        if not self.directory.is_dir():
+            return 0
+        return sum(1 for _ in self.directory.glob("*/*.json"))
+
+    def _evict(self) -> None:
+        """Drop least recently used entries down to 90% of max_entries (caller holds the lock)"""
+        entries = []
+        for path in self.directory.glob("*/*.json"):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+        target = int(self.max_entries * 0.9)
+        excess = len(entries) - target
+        for _, path in entries[:max(0, excess)]:
+            try:
+                path.unlink()
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+        self._entry_count = min(len(entries), target)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and size information for monitoring"""
+        with self._lock:
+            if self._entry_count is None:
+                self._entry_count = self._count_entries()
+            lookups = self.hits + self.misses
+            return {
+                "namespace": self.namespace,
+                "enabled": self.enabled,
+                "entries": self._entry_count,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def document_cache_key(digest: str, *parts: Any) -> str:
+    """
+    Key for data derived from one document. Keys start with the document's
+    SHA-256 so every variant can be dropped with invalidate_document().
+    """
+    return f"{digest}-{make_cache_key(*parts)[:16]}"
+
+
+def invalidate_document(digest: str) -> int:
+    """Drop all cached text extracted from the document with this SHA-256"""
+    return text_cache.delete_prefix(f"{digest}-")
+
+
+# Cache of LLM extraction results
+llm_cache = DiskCache("llm")
+# Cache of text and table rows parsed from uploaded PDF/Excel files
+text_cache = DiskCache("text")
+# Cache of OCR text per scanned page image
+ocr_cache = DiskCache("ocr")
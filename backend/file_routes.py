@@ -1,36 +1,90 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
 import os
-from pathlib import Path
 import re
+from typing import Optional, Tuple
+from urllib.parse import quote
 
-from local_storage import (
-    get_local_path,
-    read_file,
-    file_exists,
-    delete_file as local_delete_file,
-    list_files as local_list_files,
-)
+from storage import get_storage
+from blob_store import blob_path
 
 router = APIRouter()
 
 
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=" range into [start, end) offsets. Returns None to
+    serve the whole file (no header, or several ranges); raises 416 if the
+    range cannot be satisfied.
+    """
+    if not range_header:
+        return None
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", range_header)
+    if not match:
+        if "," in range_header:
+            return None
+        raise HTTPException(status_code=416, detail="Invalid range", headers={"Content-Range": f"bytes */{size}"})
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    elif last:
+        # Suffix range: the last N bytes
+        start = max(0, size - int(last))
+        end = size
+    else:
+        start, end = size, size
+    if start >= end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+async def storage_file_response(request: Request, relative_path: str, filename: Optional[str]):
+    """
+    Response for a stored file. Local files are sent with FileResponse; files in
+    other backends are streamed in chunks, honouring a single byte range.
+    """
+    storage = get_storage()
+    info = await storage.afile_info(relative_path)
+    if info is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    local_path = storage.local_path(relative_path)
+    if local_path is not None:
+        return FileResponse(
+            path=str(local_path),
+            filename=filename,
+            media_type="application/octet-stream",
+        )
+
+    size = info["size"]
+    byte_range = parse_range_header(request.headers.get("range"), size)
+    start, end = byte_range or (0, size)
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(end - start)}
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    if filename:
+        quoted = quote(filename)
+        if quoted != filename:
+            headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quoted}"
+        else:
+            headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return StreamingResponse(
+        storage.aiter_file(relative_path, start, end),
+        status_code=206 if byte_range else 200,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
+
+
 @router.get("/files/serve/{file_path:path}")
-async def serve_file(file_path: str, download: bool = False, as_name: str | None = None):
+async def serve_file(request: Request, file_path: str, download: bool = False, as_name: str | None = None):
     """
     Serve a file by its relative path (e.g. uploads/jobs/.../file.pdf).
     Used when file_url is /api/files/serve/uploads/...
     """
     try:
-        full_path = get_local_path(file_path)
-        if not full_path.is_file():
-            raise HTTPException(status_code=404, detail="File not found")
-        filename = as_name or full_path.name
-        return FileResponse(
-            path=str(full_path),
-            filename=filename if download else None,
-            media_type="application/octet-stream",
-        )
+        filename = as_name or os.path.basename(file_path)
+        return await storage_file_response(request, file_path, filename if download else None)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except HTTPException:
@@ -40,20 +94,26 @@ async def serve_file(file_path: str, download: bool = False, as_name: str | None
 
 
 @router.get("/files/{filename}")
-async def get_file(filename: str, download: bool = False, as_name: str | None = None):
+async def get_file(request: Request, filename: str, download: bool = False, as_name: str | None = None):
     """
     Get a file by filename. Files are stored under backend/uploads/.
     """
     try:
+        storage = get_storage()
         relative_path = None
         if "/" in filename:
             relative_path = f"uploads/{filename}"
-            if not file_exists(relative_path):
+            if not await storage.afile_exists(relative_path):
                 relative_path = None
+        if not relative_path and re.fullmatch(r"[0-9a-f]{64}", filename):
+            # Documents in the blob store are named by their SHA-256
+            candidate = blob_path(filename)
+            if await storage.afile_exists(candidate):
+                relative_path = candidate
         if not relative_path:
             uuid_pattern = r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.[a-zA-Z0-9]+$'
             if re.match(uuid_pattern, filename):
-                all_job_files = local_list_files("uploads/jobs/")
+                all_job_files = await storage.alist_files("uploads/jobs/")
                 for fi in all_job_files:
                     if fi["filename"] == filename:
                         relative_path = fi["key"]
@@ -67,17 +127,12 @@ async def get_file(filename: str, download: bool = False, as_name: str | None =
                 ]
                 for doc_type in document_types:
                     candidate = f"uploads/{doc_type}/{filename}"
-                    if file_exists(candidate):
+                    if await storage.afile_exists(candidate):
                         relative_path = candidate
                         break
         if not relative_path:
             raise HTTPException(status_code=404, detail="File not found")
-        full_path = get_local_path(relative_path)
-        return FileResponse(
-            path=str(full_path),
-            filename=(as_name or filename) if download else None,
-            media_type="application/octet-stream",
-        )
+        return await storage_file_response(request, relative_path, (as_name or filename) if download else None)
     except HTTPException:
         raise
     except Exception as e:
@@ -85,10 +140,10 @@ async def get_file(filename: str, download: bool = False, as_name: str | None =
 
 
 @router.get("/files/job/{job_id}/{filename}")
-async def get_job_file(job_id: str, filename: str, download: bool = False, as_name: str | None = None):
+async def get_job_file(request: Request, job_id: str, filename: str, download: bool = False, as_name: str | None = None):
     """Get a job document file by job ID and filename."""
     try:
-        job_files = local_list_files(f"uploads/jobs/{job_id}/")
+        job_files = await get_storage().alist_files(f"uploads/jobs/{job_id}/")
         relative_path = None
         for fi in job_files:
             if fi["filename"] == filename:
@@ -96,12 +151,7 @@ async def get_job_file(job_id: str, filename: str, download: bool = False, as_na
                 break
         if not relative_path:
             raise HTTPException(status_code=404, detail="File not found")
-        full_path = get_local_path(relative_path)
-        return FileResponse(
-            path=str(full_path),
-            filename=(as_name or filename) if download else None,
-            media_type="application/octet-stream",
-        )
+        return await storage_file_response(request, relative_path, (as_name or filename) if download else None)
     except HTTPException:
         raise
     except Exception as e:
@@ -120,7 +170,7 @@ async def check_files(document_type: str, entity_id: str):
         raise HTTPException(status_code=400, detail="Invalid document type")
     try:
         prefix = f"uploads/{document_type}/"
-        all_files = local_list_files(prefix)
+        all_files = await get_storage().alist_files(prefix)
         pattern = f"{entity_id}_{document_type}_"
         matching_files = [f for f in all_files if f["filename"].startswith(pattern)]
         file_details = []
@@ -158,10 +208,11 @@ async def delete_file(document_type: str, entity_id: str, filename: str):
     if not filename.startswith(expected_pattern):
         raise HTTPException(status_code=403, detail="Access denied: File does not belong to this entity")
     relative_path = f"uploads/{document_type}/{filename}"
-    if not file_exists(relative_path):
+    storage = get_storage()
+    if not await storage.afile_exists(relative_path):
         raise HTTPException(status_code=404, detail="File not found")
     try:
-        local_delete_file(relative_path)
+        await storage.adelete_file(relative_path)
         return {"message": f"File {filename} deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete file: {str(e)}")
@@ -4,8 +4,6 @@ from bson import ObjectId
 from datetime import datetime
 import shutil
 import os
-from pathlib import Path
-import secrets
 
 from models import (
     User, Folder, FolderCreate, FolderInDB, FolderType,
@@ -13,16 +11,10 @@ from models import (
 )
 from db import folders_collection, files_collection, invoices_collection
 from auth import get_current_user, get_current_admin
+from blob_store import store_blob, release_document_file
 
 router = APIRouter()
 
-# Helper function for creating upload directory
-def ensure_upload_dir(path: str) -> Path:
-    """Ensure the upload directory exists"""
-    directory = Path(path)
-    directory.mkdir(parents=True, exist_ok=True)
-    return directory
-
 # Folder endpoints
 @router.post("/invoices/{invoice_id}/folders", response_model=Folder)
 async def create_folder(
@@ -222,16 +214,9 @@ async def upload_file(
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
     
-    # Save to local project dir (backend/uploads/)
-    from local_storage import save_file as local_save
-    file_content = await file.read()
-    timestamp = int(datetime.utcnow().timestamp())
-    random_suffix = secrets.token_hex(4)
-    filename = f"{folder_id}_{timestamp}_{random_suffix}_{file.filename}"
-    folder_type = folder["type"]
-    relative_path = f"uploads/{folder_type}/{filename}"
-    upload_result = local_save(relative_path, file_content, content_type=file.content_type)
-    file_path = relative_path
+    # Stream the upload into the content-addressed blob store (backend/uploads/blobs/)
+    upload_result = await store_blob(file.file, file.content_type)
+    file_path = upload_result["file_path"]
     file_size = upload_result["size"]
     
     # Create file document
@@ -241,6 +226,7 @@ async def upload_file(
         original_filename=file.filename,
         file_size=file_size,
         mime_type=file.content_type,
+        content_hash=upload_result["content_hash"],
         uploaded_by=current_user.id
     )
     
@@ -257,6 +243,7 @@ async def upload_file(
         original_filename=created_file["original_filename"],
         file_size=created_file["file_size"],
         mime_type=created_file.get("mime_type"),
+        content_hash=created_file.get("content_hash"),
         metadata=created_file.get("metadata"),
         uploaded_by=created_file["uploaded_by"],
         uploaded_at=created_file["uploaded_at"]
@@ -287,6 +274,7 @@ async def read_files(
             original_filename=file["original_filename"],
             file_size=file["file_size"],
             mime_type=file.get("mime_type"),
+            content_hash=file.get("content_hash"),
             metadata=file.get("metadata"),
             uploaded_by=file["uploaded_by"],
             uploaded_at=file["uploaded_at"]
@@ -309,19 +297,8 @@ async def delete_file(
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
     
-    # Delete file from local storage
-    file_path = file.get("file_path")
-    if file_path and str(file_path).startswith("uploads/"):
-        try:
-            from local_storage import delete_file as local_delete
-            local_delete(file_path)
-        except Exception:
-            pass
-    elif file_path and os.path.isabs(file_path) and os.path.isfile(file_path):
-        try:
-            os.remove(file_path)
-        except Exception:
-            pass
+    # Release the stored file (shared blobs stay until their last reference is gone)
+    await release_document_file(file)
     
     # Delete file from database
     await files_collection.delete_one({"_id": file_obj_id})
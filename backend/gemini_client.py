@@ -0,0 +1,124 @@
+"""
+Gemini Client Manager
+
+Keeps a single process-wide google-genai client so that HTTP connections (and
+their TLS sessions) are reused across extraction calls instead of being
+rebuilt for every request. Settings are read from the environment once.
+"""
+
+import os
+import asyncio
+import threading
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+from google import genai
+from google.genai import types
+
+from llm_scheduler import get_llm_scheduler
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Gemini settings
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
+GEMINI_TEMPERATURE = os.getenv("GEMINI_TEMPERATURE")
+# Maximum number of Gemini requests in flight (shared by sync and async callers)
+GEMINI_MAX_CONCURRENT_CALLS = int(os.getenv("GEMINI_MAX_CONCURRENT_CALLS", "4"))
+# Timeout in seconds for a single Gemini request (retries are handled by llm_scheduler)
+GEMINI_CALL_TIMEOUT = float(os.getenv("GEMINI_CALL_TIMEOUT", "60"))
+
+
+class GeminiClientManager:
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = GEMINI_MODEL,
+        temperature: Optional[float] = None,
+        timeout: float = GEMINI_CALL_TIMEOUT,
+        max_concurrent_calls: int = GEMINI_MAX_CONCURRENT_CALLS,
+    ):
+        """Store settings; the underlying client is created on first use"""
+        # API key from GEMINI_API_KEY or GOOGLE_API_KEY in .env
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+        self.model = model
+        if temperature is None and GEMINI_TEMPERATURE:
+            temperature = float(GEMINI_TEMPERATURE)
+        self.temperature = temperature
+        self.timeout = timeout
+        self.max_concurrent_calls = max(1, max_concurrent_calls)
+
+        self._client: Optional[genai.Client] = None
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrent_calls)
+
+    @property
+    def client(self) -> genai.Client:
+        """Lazily create the shared genai client"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = genai.Client(api_key=self.api_key)
+        return self._client
+
+    def build_config(self, schema: dict, timeout: Optional[float] = None) -> types.GenerateContentConfig:
+        """Build the structured-output request config"""
+        timeout = self.timeout if timeout is None else timeout
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",  # Force JSON
+            response_schema=schema,                 # Apply schema
+            temperature=self.temperature,
+            # Per-request timeout (the SDK expects milliseconds)
+            http_options=types.HttpOptions(timeout=int(timeout * 1000))
+        )
+
+    def _generate(self, prompt: str, schema: dict, timeout: float, model: Optional[str]) -> Any:
+        """One request, counted against the concurrency limit shared by sync and async callers"""
+        config = self.build_config(schema, timeout)
+        with self._semaphore:
+            response = self.client.models.generate_content(
+                model=model or self.model,
+                contents=prompt,
+                config=config
+            )
+        return response.parsed
+
+    def generate_json(
+        self, prompt: str, schema: dict, timeout: Optional[float] = None, model: Optional[str] = None
+    ) -> Any:
+        """Generate structured output and return the parsed JSON (rate limited, with retries)"""
+        timeout = self.timeout if timeout is None else timeout
+
+        def attempt(remaining: float) -> Any:
+            return self._generate(prompt, schema, min(timeout, remaining), model)
+
+        return get_llm_scheduler().call(attempt)
+
+    async def agenerate_json(
+        self, prompt: str, schema: dict, timeout: Optional[float] = None, model: Optional[str] = None
+    ) -> Any:
+        """
+        Async variant of generate_json. The request runs in a worker thread under
+        the same semaphore as sync calls, so both together stay within
+        max_concurrent_calls; a cancelled caller keeps its slot until the
+        request has actually finished.
+        """
+        timeout = self.timeout if timeout is None else timeout
+
+        async def attempt(remaining: float) -> Any:
+            return await asyncio.to_thread(self._generate, prompt, schema, min(timeout, remaining), model)
+
+        return await get_llm_scheduler().acall(attempt)
+
+# Global Gemini client manager instance (extraction threads may race to create it)
+gemini_client_manager = None
+_manager_lock = threading.Lock()
+
+def get_gemini_client_manager() -> GeminiClientManager:
+    """Get or create the Gemini client manager instance"""
+    global gemini_client_manager
+    if gemini_client_manager is None:
+        with _manager_lock:
+            if gemini_client_manager is None:
+                gemini_client_manager = GeminiClientManager()
+    return gemini_client_manager
@@ -0,0 +1,227 @@
+"""
+Invoice Fast Path
+
+Regex/heuristic extraction of agency invoice fields from the PDF text and file
+name. Every field gets a confidence score; when all required fields are found
+with enough confidence the invoice is not sent to the LLM at all.
+
+Hit/miss counters are kept per process and exposed through
+GET /api/ai/fast_path/stats.
+"""
+
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Turn the fast path off to send every invoice to the LLM
+INVOICE_FAST_PATH_ENABLED = os.getenv("INVOICE_FAST_PATH", "true").lower() in ("1", "true", "yes")
+# Minimum confidence (0-1) every required field needs to skip the LLM
+INVOICE_FAST_PATH_MIN_CONFIDENCE = float(os.getenv("INVOICE_FAST_PATH_MIN_CONFIDENCE", "0.8"))
+
+REQUIRED_FIELDS = ("agency_invoice_number", "project_code", "campaign_name", "total_amount")
+
+# Invoice percentages are 20%, 30% or 50%
+_PERCENTAGE = re.compile(r"(?<!\d)(20|30|50)\s*%")
+_INVOICE_NUMBER = re.compile(
+    r"invoice\s*(?:no\.?|number|num\.?|#)\s*[:#.]?\s*([A-Za-z0-9][A-Za-z0-9/|_-]*\d[A-Za-z0-9/|_-]*)",
+    re.IGNORECASE
+)
+_PROJECT_CODE = re.compile(r"\b(PR\s?\d{2}\s?\|\s?\d+(?:\s?-\s?\d{2}\s?%)?)", re.IGNORECASE)
+_PROJECT_CODE_LABEL = re.compile(r"project\s*(?:code|no\.?|number)\s*[:#]?\s*([A-Za-z0-9][A-Za-z0-9|/_%-]*)", re.IGNORECASE)
+_CAMPAIGN = re.compile(r"campaign(?:\s*name)?\s*[:\-]\s*([^\n]+)", re.IGNORECASE)
+# Dates and "N days" style terms on a label line are never amounts
+_DATE = re.compile(
+    r"\b\d{4}[-/.]\d{1,2}[-/.]\d{1,2}\b|\b\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}\b"
+    r"|\b\d{1,2}[-\s](?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?[-\s,]*\d{2,4}\b",
+    re.IGNORECASE
+)
+_AMOUNT_TOKEN = re.compile(
+    r"(?<![\w.,/])(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)(?![\w,]|\.\d)"
+    r"(?!\s*%)(?!\s*(?:days?|weeks?|months?|years?)\b)",
+    re.IGNORECASE
+)
+_CURRENCY = r"(?:SAR|SR|AED|USD|EUR|GBP|QAR|KWD|BHD|OMR|\$|€|£|ريال|ر\.س)"
+_CURRENCY_BEFORE = re.compile(_CURRENCY + r"\.?\s*$", re.IGNORECASE)
+_CURRENCY_AFTER = re.compile(r"^\s*" + _CURRENCY + r"(?![A-Za-z])", re.IGNORECASE)
+# The rest of the line after a label
+_REST = r"([^\n]*)"
+
+# Total labels from most to least specific, with the confidence of each
+_TOTAL_LABELS: List[Tuple[re.Pattern, float]] = [
+    (re.compile(r"(?:grand\s*total|total\s*amount\s*due|total\s*payable|amount\s*due|net\s*payable)" + _REST, re.IGNORECASE), 0.9),
+    (re.compile(r"total\s*(?:amount)?\s*\(?\s*(?:incl\.?|including|inclusive\s*of|with)\s*vat\)?" + _REST, re.IGNORECASE), 0.9),
+    (re.compile(r"total\s*amount" + _REST, re.IGNORECASE), 0.8),
+    (re.compile(r"(?<!sub)(?<!sub\s)(?<!sub-)total" + _REST, re.IGNORECASE), 0.6),
+]
+_SUBTOTAL = re.compile(r"sub\s*-?\s*total" + _REST, re.IGNORECASE)
+# VAT amount on its own line (not a "Total incl. VAT" line)
+_VAT = re.compile(r"^(?![^\n]*total)[^\n]*?\bvat\b" + _REST, re.IGNORECASE | re.MULTILINE)
+# Without a matching subtotal + VAT a total stays below the fast path threshold
+_UNCONFIRMED_TOTAL_CONFIDENCE = 0.7
+
+
+def _parse_amount(value: str) -> Optional[float]:
+    try:
+        return float(value.replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _line_amount(rest: str) -> Optional[float]:
+    """
+    Last currency-formatted amount in the rest of a label line: it has
+    thousands separators or decimals, or a currency code next to it. Dates,
+    percentages and "N days" terms are skipped.
+    """
+    rest = _DATE.sub(" ", rest)
+    amount = None
+    for match in _AMOUNT_TOKEN.finditer(rest):
+        token = match.group(1)
+        formatted = (
+            "," in token or "." in token
+            or _CURRENCY_BEFORE.search(rest[:match.start()])
+            or _CURRENCY_AFTER.match(rest[match.end():])
+        )
+        if formatted:
+            amount = _parse_amount(token)
+    return amount
+
+
+def _labelled_amounts(pattern: re.Pattern, text: str) -> List[float]:
+    return [amount for amount in (_line_amount(rest) for rest in pattern.findall(text)) if amount]
+
+
+def _percentage(text: str, file_name: str) -> Tuple[Optional[str], float]:
+    """Invoice percentage from the file name first, then the text"""
+    for source, confidence in ((file_name, 1.0), (text, 0.8)):
+        found = {f"{match}%" for match in _PERCENTAGE.findall(source or "")}
+        if len(found) == 1:
+            return found.pop(), confidence
+        if len(found) > 1:
+            return None, 0.0
+    return None, 0.0
+
+
+def _invoice_number(text: str) -> Tuple[Optional[str], float]:
+    found = list(dict.fromkeys(match.strip("-_|/") for match in _INVOICE_NUMBER.findall(text)))
+    if not found:
+        return None, 0.0
+    # Several different numbers (e.g. a referenced invoice) make the first one less certain
+    return found[0], 0.9 if len(found) == 1 else 0.5
+
+
+def _project_code(text: str, file_name: str) -> Tuple[Optional[str], float]:
+    for source in (text, file_name or ""):
+        match = _PROJECT_CODE.search(source)
+        if match:
+            return re.sub(r"\s+", "", match.group(1)).upper(), 0.9
+    match = _PROJECT_CODE_LABEL.search(text)
+    if match:
+        return match.group(1), 0.8
+    return None, 0.0
+
+
+def _campaign_name(text: str) -> Tuple[Optional[str], float]:
+    match = _CAMPAIGN.search(text)
+    if not match:
+        return None, 0.0
+    name = match.group(1).strip(" :-\t")
+    return (name, 0.8) if name else (None, 0.0)
+
+
+def _total_amount(text: str) -> Tuple[Optional[float], float]:
+    """
+    Invoice total. It is only trusted enough to skip the LLM when the invoice's
+    subtotal + VAT add up to it.
+    """
+    total, confidence = None, 0.0
+    for pattern, label_confidence in _TOTAL_LABELS:
+        amounts = _labelled_amounts(pattern, text)
+        if amounts:
+            # The last labelled total on the invoice is normally the grand total
+            total, confidence = amounts[-1], label_confidence
+            break
+    if total is None:
+        return None, 0.0
+
+    subtotals = _labelled_amounts(_SUBTOTAL, text)
+    vats = _labelled_amounts(_VAT, text)
+    if subtotals and vats:
+        difference = abs(subtotals[-1] + vats[-1] - total)
+        if difference <= 0.01:
+            return total, 1.0
+        if difference > 1:
+            return total, min(confidence, 0.5)
+    return total, min(confidence, _UNCONFIRMED_TOTAL_CONFIDENCE)
+
+
+def extract_invoice_locally(text: str, file_name: str = "") -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Extract invoice fields with regular expressions.
+
+    Returns:
+        Tuple of (found fields, confidence per field)
+    """
+    extractors = {
+        "agency_invoice_number": lambda: _invoice_number(text),
+        "project_code": lambda: _project_code(text, file_name),
+        "campaign_name": lambda: _campaign_name(text),
+        "total_amount": lambda: _total_amount(text),
+        "percentage": lambda: _percentage(text, file_name),
+    }
+    details: Dict[str, Any] = {}
+    confidence: Dict[str, float] = {}
+    for field, extractor in extractors.items():
+        value, score = extractor() if text or field == "percentage" else (None, 0.0)
+        confidence[field] = score
+        if value is not None:
+            details[field] = value
+    return details, confidence
+
+
+class FastPathStats:
+    def __init__(self):
+        """Counts documents resolved locally vs sent to the LLM"""
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": INVOICE_FAST_PATH_ENABLED,
+                "min_confidence": INVOICE_FAST_PATH_MIN_CONFIDENCE,
+                "hits": self.hits,
+                "llm_fallbacks": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+invoice_fast_path_stats = FastPathStats()
+
+
+def try_invoice_fast_path(text: str, file_name: str = "") -> Optional[Dict[str, Any]]:
+    """
+    Return the invoice details if every required field was found with enough
+    confidence, otherwise None (the caller falls back to the LLM).
+    """
+    if not INVOICE_FAST_PATH_ENABLED:
+        return None
+    details, confidence = extract_invoice_locally(text, file_name)
+    hit = all(confidence[field] >= INVOICE_FAST_PATH_MIN_CONFIDENCE for field in REQUIRED_FIELDS)
+    invoice_fast_path_stats.record(hit)
+    if not hit:
+        return None
+    if confidence["percentage"] < INVOICE_FAST_PATH_MIN_CONFIDENCE:
+        details.pop("percentage", None)
+    details["confidence"] = round(min(confidence[field] for field in REQUIRED_FIELDS), 2)
+    return details
@@ -11,6 +11,7 @@ from models import (
 )
 from db import invoices_collection, agencies_collection, clients_collection, jobs_collection, files_collection, folders_collection
 from auth import get_current_user
+from storage import get_storage
 
 router = APIRouter()
 
@@ -239,6 +240,19 @@ async def delete_invoice(
     
     return {"message": "Invoice deleted successfully"}
 
+async def add_stored_file_to_zip(zip_file: zipfile.ZipFile, file_path: Optional[str], arcname: str) -> None:
+    """Stream a stored file into a ZIP archive; missing files are skipped"""
+    storage = get_storage()
+    try:
+        if not file_path or not await storage.afile_exists(file_path):
+            return
+    except ValueError:
+        # Not a storage key (e.g. an absolute path from before uploads/ was used)
+        return
+    with zip_file.open(arcname, "w") as entry:
+        async for chunk in storage.aiter_file(file_path):
+            entry.write(chunk)
+
 @router.get("/invoices/{invoice_id}/download")
 async def download_invoice_files(
     invoice_id: str,
@@ -269,13 +283,9 @@ async def download_invoice_files(
             
             # Get all files in this folder
             async for file in files_collection.find({"folder_id": folder_id}):
-                file_path = file["file_path"]
-                if not file_path or not os.path.exists(file_path):
-                    continue
-                
                 # Add file to ZIP with folder structure
                 arcname = f"{folder_name}/{file['original_filename']}"
-                zip_file.write(file_path, arcname=arcname)
+                await add_stored_file_to_zip(zip_file, file["file_path"], arcname)
     
     # Reset buffer position
     zip_buffer.seek(0)
@@ -312,12 +322,8 @@ async def download_folder_files(
     with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
         # Get all files in this folder
         async for file in files_collection.find({"folder_id": folder_id}):
-            file_path = file["file_path"]
-            if not file_path or not os.path.exists(file_path):
-                continue
-            
             # Add file to ZIP
-            zip_file.write(file_path, arcname=file["original_filename"])
+            await add_stored_file_to_zip(zip_file, file["file_path"], file["original_filename"])
     
     # Reset buffer position
     zip_buffer.seek(0)
@@ -1,5 +1,7 @@
-from fastapi import APIRouter, HTTPException, Depends, Body, File, UploadFile, Form
-from typing import List, Optional, Dict
+from fastapi import APIRouter, HTTPException, Depends, Body, File, UploadFile, Form, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Optional, Dict, Union
 from bson import ObjectId
 from datetime import datetime
 import os
@@ -9,10 +11,12 @@ import asyncio
 
 from models import (
     Job, JobCreate, JobInDB, JobStatus, JobReview, JobChecklist, Document,
-    User
+    User, AITask, BatchAIProcessRequest
 )
 from db import jobs_collection, agencies_collection
-from ai_processor import process_job_documents, validate_job_checklist, extract_invoices_text, extract_agency_details_from_invoices, extract_po_details_from_job_order, extract_media_plan_details
+from ai_pipeline import EXECUTION_MODES, run_job_ai_process, run_jobs_ai_process
+from blob_store import store_blob, release_document_file
+from ai_tasks import get_ai_task_queue, task_to_model, TASK_RUN_AI_PROCESS, TASK_PROCESS_DOCUMENTS
 
 router = APIRouter()
 
@@ -20,6 +24,54 @@ router = APIRouter()
 UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
 
 # Job endpoints
+@router.post("/agencies/{agency_code}/jobs/run_ai_process")
+async def run_ai_process_batch(
+    agency_code: str,
+    request: BatchAIProcessRequest,
+    stream_format: str = Query("ndjson", alias="format"),
+):
+    """
+    Run the AI process for many jobs of an agency at once.
+
+    Jobs are selected by `job_ids` and/or `status`. Progress is streamed as one
+    JSON event per line (`format=ndjson`, default) or as server-sent events
+    (`format=sse`): a "started" event, one "job_completed"/"job_failed" event
+    per job and a final "finished" event with the totals.
+    """
+    if stream_format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="Invalid format. Must be one of: ndjson, sse")
+    if request.mode and request.mode.lower() not in EXECUTION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid mode. Must be one of: {', '.join(EXECUTION_MODES)}"
+        )
+    if not request.job_ids and not request.status:
+        raise HTTPException(status_code=400, detail="Provide job_ids and/or status to select jobs")
+
+    # Check if agency exists
+    if not await agencies_collection.find_one({"agency_code": agency_code}):
+        raise HTTPException(status_code=404, detail="Agency not found")
+
+    # Build query
+    query = {"agency_id": agency_code}
+    if request.job_ids:
+        try:
+            query["_id"] = {"$in": [ObjectId(job_id) for job_id in request.job_ids]}
+        except:
+            raise HTTPException(status_code=400, detail="Invalid job ID format")
+    if request.status:
+        query["status"] = request.status
+
+    job_ids = [str(job["_id"]) async for job in jobs_collection.find(query, {"_id": 1})]
+
+    async def event_stream():
+        async for event in run_jobs_ai_process(job_ids, request.mode):
+            payload = json.dumps(event, default=str)
+            yield f"data: {payload}\n\n" if stream_format == "sse" else f"{payload}\n"
+
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(event_stream(), media_type=media_type)
+
 @router.post("/agencies/{agency_code}/jobs", response_model=Job)
 async def create_job(
     agency_code: str,
@@ -270,12 +322,18 @@ async def delete_job(
         raise HTTPException(status_code=400, detail="Invalid job ID format")
     
     # Check if job exists
-    if not await jobs_collection.find_one({"_id": object_id}):
+    job = await jobs_collection.find_one({"_id": object_id})
+    if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
     # Delete job
     await jobs_collection.delete_one({"_id": object_id})
     
+    # Release the job's documents (shared blobs stay until their last reference is gone)
+    for documents in (job.get("checklist") or {}).values():
+        for document in documents or []:
+            await release_document_file(document)
+    
     return {"message": "Job deleted successfully"}
 
 
@@ -309,13 +367,10 @@ async def upload_document_to_job(
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    # Save to local project dir (backend/uploads/)
-    from local_storage import save_file as local_save, generate_job_file_path as gen_path
-    file_content = await file.read()
-    relative_path = gen_path(job_id, folder_type, file.filename)
-    upload_result = local_save(relative_path, file_content, content_type=file.content_type)
-    unique_filename = os.path.basename(relative_path)
-    file_path = relative_path
+    # Stream the upload into the content-addressed blob store (backend/uploads/blobs/);
+    # a document already uploaded to another job is stored only once
+    upload_result = await store_blob(file.file, file.content_type)
+    file_path = upload_result["file_path"]
     
     # Parse metadata
     try:
@@ -327,6 +382,7 @@ async def upload_document_to_job(
     document = Document(
         file_path=file_path,  # Use S3 key as file path
         original_filename=file.filename,
+        content_hash=upload_result["content_hash"],
         metadata=parsed_metadata,
         # uploaded_by=current_user.id
     )
@@ -358,8 +414,9 @@ async def upload_document_to_job(
         }}
     )
     
-    # Automatically process documents and update job status
-    await process_job_documents_and_update_status(job_id)
+    # Process documents and update job status in the background;
+    # uploads in quick succession share one queued task
+    await get_ai_task_queue().enqueue(TASK_PROCESS_DOCUMENTS, job_id, coalesce=True)
     
     return document
 
@@ -434,18 +491,7 @@ async def delete_job_document(
     
     # Get document to delete
     document = job["checklist"][folder_type][document_index]
-    file_path = document.get("file_path")
-    if file_path and str(file_path).startswith("uploads/"):
-        try:
-            from local_storage import delete_file as local_delete
-            local_delete(file_path)
-        except Exception:
-            pass
-    elif file_path and os.path.isabs(file_path) and os.path.isfile(file_path):
-        try:
-            os.remove(file_path)
-        except Exception:
-            pass
+    await release_document_file(document)
     
     # Remove document from checklist
     job["checklist"][folder_type].pop(document_index)
@@ -464,157 +510,50 @@ async def delete_job_document(
 
 
 
-@router.post("/jobs/{job_id}/run_ai_process", response_model=Job)
-async def run_ai_process(job_id: str):
+@router.post("/jobs/{job_id}/run_ai_process", response_model=Union[Job, AITask])
+async def run_ai_process(
+    job_id: str,
+    mode: Optional[str] = None,
+    force: bool = False,
+    run_async: bool = Query(False, alias="async"),
+):
     """
     Run AI process for a given job ID.
     This endpoint processes all documents in the job's checklist,
     extracts relevant information, and updates the job's review field.
+
+    The invoice, job order and media plan extractions run off the event loop.
+    `mode` selects "concurrent" (default, see AI_EXECUTION_MODE), "sequential" or "combined".
+    Folders whose documents have not changed since the last run are not extracted
+    again; `force=true` re-extracts every folder.
+    With `async=true` the work is queued and an AI task is returned immediately
+    (HTTP 202); poll GET /ai_tasks/{task_id} for its status.
     """
     try:
         object_id = ObjectId(job_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid job ID format")
-    
-    # Step 1: Get the job details
-    job = await jobs_collection.find_one({"_id": object_id})
-    
- 
-    # Process agency invoices
-    agency_invoices = job.get("checklist", {}).get("agency_invoice", [])
-    invoices_text_extracted = extract_invoices_text(agency_invoices)
-    invoice_details = extract_agency_details_from_invoices(invoices_text_extracted, agency_invoices)
-    
 
+    if mode and mode.lower() not in EXECUTION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid mode. Must be one of: {', '.join(EXECUTION_MODES)}"
+        )
 
+    if run_async:
+        if not await jobs_collection.find_one({"_id": object_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Job not found")
+        params = {"mode": mode} if mode else {}
+        if force:
+            params["force"] = True
+        task = await get_ai_task_queue().enqueue(TASK_RUN_AI_PROCESS, job_id, params=params)
+        return JSONResponse(status_code=202, content=jsonable_encoder(task_to_model(task)))
 
-    
-    # Process job order (PO)
-    job_order_docs = job.get("checklist", {}).get("job_order", [])
-    po_details = extract_po_details_from_job_order(job_order_docs)
-    
-    # For debugging
-    print("INVOICE DETAILS:", json.dumps(invoice_details, indent=4))
-    print("PO DETAILS:", json.dumps(po_details, indent=4))
-
-    # Process approved quotation for media plan details
-    approved_quotation_docs = job.get("checklist", {}).get("approved_quotation", [])
-    media_plan_details = extract_media_plan_details(approved_quotation_docs)
-    print("MEDIA PLAN DETAILS:", json.dumps(media_plan_details, indent=4))
-
-    # --- Step 4: Validate Job Checklist ---
-    validation_result = validate_job_checklist(job)
-    
-    # --- Step 5: Combine Results and Update Job ---
-    final_review_data = {
-        # Header / identifiers
-        "market_bu": media_plan_details.get("market_type"),
-        "agency_invoice_number": invoice_details.get("summary", {}).get("agency_invoice_details"),
-        "po_number": po_details.get("po_number"),
-        "period_month": media_plan_details.get("period_month"),
-
-        # Timeline (dates) - Currently not extracted by AI, so set to None
-        "date_invoice_sent_to_medpush": None,
-        "date_medpush_shared_feedback": None,
-        "date_agency_responded_to_feedback": None,
-        "date_medpush_approved_invoice": None,
-
-        # Campaign / medium
-        "medium": media_plan_details.get("medium"),
-        "campaign_name": (
-            invoice_details.get("invoices", [{}])[0].get("campaign_name")
-            if invoice_details.get("invoices") and len(invoice_details.get("invoices", [])) > 0
-            else None
-        ),
-
-        # Financials
-        "net_media_cost": media_plan_details.get("net_media_cost"),
-        "agency_fee": media_plan_details.get("agency_fees"),
-        "taxes": media_plan_details.get("taxes_amount"),
-        "other_third_party_cost": media_plan_details.get("third_party_cost"),
-        "agency_invoice_total_amount": invoice_details.get("summary", {}).get("total_amount"),
-        "media_plan_total_amount": media_plan_details.get("media_plan_total_amount"),
-        "po_amount_with_af": po_details.get("po_amount"),
-
-        # Review text - Now set based on validation results
-        "initial_review_outcome": validation_result["initial_review_outcome"],
-        "agency_feedback_action": None,
-        "final_review_outcome": validation_result["final_review_outcome"],
-        "status_of_received_invoices": None,
-
-        # Month tag
-        "month_medpush_received_invoice": None,
-
-        # Durations (# of days)
-        "days_medpush_to_review_and_share_feedback": None,
-        "days_agency_to_revert_to_medpush": None,
-        "days_medpush_to_approve_after_revision": None,
-
-        # Raw AI Output
-        "raw_ai_invoice_output": invoice_details,
-        "raw_ai_po_output": po_details,
-        "raw_ai_media_plan_output": media_plan_details
-    }
-    
-    # Update the job with the extracted details
-    update_data = {"review": final_review_data}
-    
-    # Also update the status based on validation result
-    new_status = "Compliant" if validation_result["is_compliant"] else "Not Compliant"
-    update_data["status"] = new_status
-    update_data["updated_at"] = datetime.utcnow()
-    
-    updated_job = await jobs_collection.find_one_and_update(
-        {"_id": object_id},
-        {"$set": update_data},
-        return_document=True
-    )
-
+    updated_job = await run_job_ai_process(job_id, mode, force)
     if not updated_job:
-        raise HTTPException(status_code=404, detail="Job not found after update")
+        raise HTTPException(status_code=404, detail="Job not found")
 
     # Convert _id to string for the response model
     updated_job["id"] = str(updated_job["_id"])
     
     return Job(**updated_job)
-
-
-async def process_job_documents_and_update_status(job_id: str):
-    """
-    Automatically process job documents and update compliance status
-    """
-    try:
-        # Get the job
-        job = await jobs_collection.find_one({"_id": ObjectId(job_id)})
-        if not job:
-            return
-        
-        # Run AI processing to extract data
-        process_job_documents(job)
-        
-        # Get updated job with new review data
-        updated_job = await jobs_collection.find_one({"_id": ObjectId(job_id)})
-        if not updated_job:
-            return
-        
-        # Validate compliance based on documents
-        from ai_processor import validate_job_checklist
-        validation_result = validate_job_checklist(updated_job)
-        
-        # Determine new status
-        new_status = "Compliant" if validation_result["is_compliant"] else "Not Compliant"
-        
-        # Update job status if it changed
-        if updated_job.get("status") != new_status:
-            await jobs_collection.update_one(
-                {"_id": ObjectId(job_id)},
-                {"$set": {
-                    "status": new_status,
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-            print(f"Job {job_id} status updated to: {new_status}")
-        
-    except Exception as e:
-        print(f"Error processing job {job_id}: {str(e)}")
-        # Don't raise error to avoid breaking document upload
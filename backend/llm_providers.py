@@ -0,0 +1,183 @@
+"""
+LLM Providers
+
+Every extraction call goes through an LLMProvider, selected with LLM_PROVIDER:
+
+- "gemini" (default): Google Gemini through the shared GeminiClientManager
+- "stub": a local deterministic provider that returns schema-valid JSON after a
+  simulated latency, so the AI pipeline can be load-tested and its concurrency
+  settings tuned without network access or API quota
+
+Both providers go through the LLM call scheduler (rate limit, retries, circuit
+breaker), so a stub run exercises the same admission control as production.
+"""
+
+import os
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from gemini_client import GEMINI_MAX_CONCURRENT_CALLS, get_gemini_client_manager
+from llm_scheduler import get_llm_scheduler
+
+# Load environment variables from .env file
+load_dotenv()
+
+# gemini | stub
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()
+# Simulated seconds per stub call, plus up to LLM_STUB_LATENCY_JITTER extra seconds
+LLM_STUB_LATENCY = float(os.getenv("LLM_STUB_LATENCY", "0.5"))
+LLM_STUB_LATENCY_JITTER = float(os.getenv("LLM_STUB_LATENCY_JITTER", "0"))
+# Items returned for every array in a stub response
+LLM_STUB_ARRAY_ITEMS = int(os.getenv("LLM_STUB_ARRAY_ITEMS", "3"))
+# Fraction (0-1) of stub calls failing with a retryable error, to exercise retries
+LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", "0"))
+
+
+class LLMProvider(ABC):
+    """Base class for structured-output (JSON) LLM providers"""
+
+    name = "base"
+
+    @property
+    def cache_namespace(self) -> str:
+        """Identifies the provider and model in extraction cache keys"""
+        return self.name
+
+    @abstractmethod
+    def generate_json(self, prompt: str, schema: dict, timeout: Optional[float] = None) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def agenerate_json(self, prompt: str, schema: dict, timeout: Optional[float] = None) -> Any:
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    @property
+    def cache_namespace(self) -> str:
+        return f"gemini:{get_gemini_client_manager().model}"
+
+    def generate_json(self, prompt: str, schema: dict, timeout: Optional[float] = None) -> Any:
+        return get_gemini_client_manager().generate_json(prompt, schema, timeout=timeout)
+
+    async def agenerate_json(self, prompt: str, schema: dict, timeout: Optional[float] = None) -> Any:
+        return await get_gemini_client_manager().agenerate_json(prompt, schema, timeout=timeout)
+
+
+class StubProviderError(Exception):
+    """Simulated provider failure; code 503 makes the scheduler retry it"""
+
+    code = 503
+
+
+class StubProvider(LLMProvider):
+    name = "stub"
+
+    def __init__(
+        self,
+        latency: float = LLM_STUB_LATENCY,
+        jitter: float = LLM_STUB_LATENCY_JITTER,
+        array_items: int = LLM_STUB_ARRAY_ITEMS,
+        error_rate: float = LLM_STUB_ERROR_RATE,
+        max_concurrent_calls: int = GEMINI_MAX_CONCURRENT_CALLS,
+    ):
+        """Deterministic responses; only the simulated latency and errors are random"""
+        self.latency = max(0.0, latency)
+        self.jitter = max(0.0, jitter)
+        self.array_items = max(0, array_items)
+        self.error_rate = error_rate
+        self.max_concurrent_calls = max(1, max_concurrent_calls)
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrent_calls)
+
+    def _delay(self) -> float:
+        return self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _maybe_fail(self) -> None:
+        if self.error_rate and random.random() < self.error_rate:
+            raise StubProviderError("Simulated LLM provider error")
+
+    def build_response(self, prompt: str, schema: dict) -> Any:
+        """A response matching schema, derived only from the prompt"""
+        seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return self._value(schema, seed, "value", None)
+
+    def _value(self, schema: Dict[str, Any], seed: str, path: str, index: Optional[int]) -> Any:
+        enum = schema.get("enum")
+        if enum:
+            return enum[0]
+        kind = str(schema.get("type", "string")).lower()
+        if kind == "object":
+            return {
+                key: self._value(prop, seed, f"{path}.{key}", index)
+                for key, prop in (schema.get("properties") or {}).items()
+            }
+        if kind == "array":
+            return [
+                self._value(schema.get("items") or {}, seed, f"{path}[{i}]", i)
+                for i in range(self.array_items)
+            ]
+        if kind == "integer":
+            # Items are numbered 1..n so index references (invoice sections) resolve
+            return index + 1 if index is not None else 1
+        if kind == "number":
+            digest = hashlib.sha256(f"{seed}:{path}".encode("utf-8")).digest()
+            return round(int.from_bytes(digest[:4], "big") % 10_000_000 / 100, 2)
+        if kind == "boolean":
+            return True
+        return f"stub-{path.rsplit('.', 1)[-1]}"
+
+    def _generate(self, prompt: str, schema: dict, timeout: Optional[float], remaining: float) -> Any:
+        """One simulated request, counted against the limit shared by sync and async callers"""
+        with self._semaphore:
+            delay = self._delay()
+            if timeout is not None and delay > min(timeout, remaining):
+                time.sleep(min(timeout, remaining))
+                raise TimeoutError("Simulated LLM call timed out")
+            time.sleep(delay)
+            self._maybe_fail()
+        return self.build_response(prompt, schema)
+
+    def generate_json(self, prompt: str, schema: dict, timeout: Optional[float] = None) -> Any:
+        def attempt(remaining: float) -> Any:
+            return self._generate(prompt, schema, timeout, remaining)
+
+        return get_llm_scheduler().call(attempt)
+
+    async def agenerate_json(self, prompt: str, schema: dict, timeout: Optional[float] = None) -> Any:
+        # Same worker-thread path as GeminiClientManager.agenerate_json
+        async def attempt(remaining: float) -> Any:
+            return await asyncio.to_thread(self._generate, prompt, schema, timeout, remaining)
+
+        return await get_llm_scheduler().acall(attempt)
+
+
+LLM_PROVIDERS = {
+    "gemini": GeminiProvider,
+    "stub": StubProvider,
+}
+
+# Global LLM provider instance (extraction threads may race to create it)
+llm_provider = None
+_provider_lock = threading.Lock()
+
+def get_llm_provider() -> LLMProvider:
+    """Get or create the configured LLM provider instance"""
+    global llm_provider
+    if llm_provider is None:
+        with _provider_lock:
+            if llm_provider is None:
+                if LLM_PROVIDER not in LLM_PROVIDERS:
+                    raise ValueError(
+                        f"Unknown LLM_PROVIDER '{LLM_PROVIDER}'; expected one of {', '.join(LLM_PROVIDERS)}"
+                    )
+                llm_provider = LLM_PROVIDERS[LLM_PROVIDER]()
+    return llm_provider
@@ -0,0 +1,390 @@
+"""
+LLM Call Scheduler
+
+Shared admission control for every LLM request made by the extraction code:
+
+- a token bucket limits the request rate to the provider quota
+- failed calls with a retryable error (429, 5xx, timeouts, dropped
+  connections) are retried with jittered exponential backoff, honouring the
+  provider's retry delay when it sends one
+- every call has an overall deadline covering waits and retries
+- a circuit breaker fails calls fast while the provider keeps failing, and lets
+  a single trial call through after a cool-down
+
+The same scheduler serves the sync (worker thread) and async call paths.
+Counters are exposed through GET /api/ai/llm/stats.
+"""
+
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Sustained requests per minute and burst size of the token bucket
+LLM_RATE_LIMIT_PER_MINUTE = float(os.getenv("LLM_RATE_LIMIT_PER_MINUTE", "60"))
+LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", "10"))
+# Attempts per call (first try included) and backoff settings in seconds
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+# Overall deadline in seconds for one call, including rate-limit waits and retries
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "180"))
+# Consecutive failed attempts that open the circuit, and seconds it stays open
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+LLM_CIRCUIT_RESET_TIMEOUT = float(os.getenv("LLM_CIRCUIT_RESET_TIMEOUT", "60"))
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+_RETRY_DELAY = re.compile(r"^(\d+(?:\.\d+)?)s$")
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the provider while the circuit breaker is open"""
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Raised when a call cannot finish within its deadline"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Rate limits, server errors, timeouts and connection errors are worth retrying"""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError, TimeoutError, ConnectionError))
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Delay requested by the provider (Retry-After header or RetryInfo detail), if any"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in (details.get("error", {}) or {}).get("details", []) or []:
+            match = _RETRY_DELAY.match(str(detail.get("retryDelay", ""))) if isinstance(detail, dict) else None
+            if match:
+                return float(match.group(1))
+    return None
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, burst: int):
+        """Rate limiter refilled continuously at rate_per_minute, holding up to burst tokens"""
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token and return how many seconds the caller must wait before
+        using it (0 if one was available). Reservations are served in order.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self) -> None:
+        """Give back a reserved token that was not used (the call was rejected)"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+    def available(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            return round(min(self.capacity, self.tokens + (now - self.updated_at) * self.rate), 2)
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        """Opens after failure_threshold consecutive failures; one trial call after reset_timeout"""
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[str]:
+        """
+        Admit a call to the provider: returns the state it was admitted in
+        (HALF_OPEN for the single trial call), or None if it must be rejected
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return self.CLOSED
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return self.HALF_OPEN
+            return None
+
+    def allow(self) -> bool:
+        """Whether a call may go to the provider now"""
+        return self.acquire() is not None
+
+    def release(self, admitted_as: Optional[str]) -> None:
+        """
+        Give up an admitted call without an outcome (cancelled or interrupted);
+        if it was the half-open trial, the next call may make the trial instead
+        """
+        if admitted_as != self.HALF_OPEN:
+            return
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    logger.warning(f"LLM circuit breaker opened after {self.consecutive_failures} consecutive failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = 0.0
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "retry_in_seconds": round(retry_in, 1),
+            }
+
+
+class LLMCallScheduler:
+    def __init__(
+        self,
+        rate_per_minute: float = LLM_RATE_LIMIT_PER_MINUTE,
+        burst: int = LLM_RATE_LIMIT_BURST,
+        max_attempts: int = LLM_MAX_ATTEMPTS,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX,
+        deadline: float = LLM_CALL_DEADLINE,
+        failure_threshold: int = LLM_CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = LLM_CIRCUIT_RESET_TIMEOUT,
+    ):
+        """Rate limiting, retries, deadlines and circuit breaking for LLM calls"""
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "attempts": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "deadline_exceeded": 0,
+            "rejected_by_circuit": 0,
+        }
+        self._throttle_wait_seconds = 0.0
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        """Full-jitter exponential backoff, or the provider's retry delay if longer"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        hinted = retry_after(error)
+        return max(delay, hinted) if hinted is not None else delay
+
+    def _before_attempt(self, started: float, deadline: float) -> Tuple[float, str]:
+        """
+        Take a rate-limit token and check the deadline and the breaker; returns
+        the wait before calling and the breaker state the call was admitted in.
+        A rejected call returns its token, and the breaker is only asked once
+        the call will go ahead, so a rejection never holds on to a half-open trial.
+        """
+        wait = self.bucket.reserve()
+        if time.monotonic() + wait - started >= deadline:
+            self.bucket.refund()
+            self._count("deadline_exceeded")
+            raise LLMDeadlineExceeded(f"LLM call could not start within its {deadline:g}s deadline")
+        admitted_as = self.breaker.acquire()
+        if admitted_as is None:
+            self.bucket.refund()
+            self._count("rejected_by_circuit")
+            raise CircuitOpenError("LLM provider circuit is open; try again later")
+        if wait:
+            with self._lock:
+                self._throttle_wait_seconds += wait
+        return wait, admitted_as
+
+    def _after_failure(self, error: BaseException, attempt: int, started: float, deadline: float) -> Optional[float]:
+        """Record a failed attempt; returns the delay before the next one, or None to give up"""
+        if getattr(error, "code", None) == 429:
+            self._count("rate_limited")
+        if not is_retryable(error):
+            # The provider answered (e.g. a bad request); that doesn't count against the breaker
+            self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        if attempt + 1 >= self.max_attempts:
+            return None
+        delay = self._backoff(attempt, error)
+        if time.monotonic() + delay - started >= deadline:
+            self._count("deadline_exceeded")
+            return None
+        self._count("retries")
+        logger.warning(f"LLM call failed ({error}); retry {attempt + 1} in {delay:.1f}s")
+        return delay
+
+    def call(self, func: Callable[[float], Any], deadline: Optional[float] = None) -> Any:
+        """
+        Run func(timeout) with rate limiting and retries. func receives the
+        seconds left before the deadline, to use as its request timeout.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        started = time.monotonic()
+        self._count("calls")
+        attempt = 0
+        while True:
+            try:
+                wait, admitted_as = self._before_attempt(started, deadline)
+            except Exception:
+                self._count("failed")
+                raise
+            try:
+                if wait:
+                    time.sleep(wait)
+                self._count("attempts")
+                result = func(deadline - (time.monotonic() - started))
+            except Exception as e:
+                delay = self._after_failure(e, attempt, started, deadline)
+                if delay is None:
+                    self._count("failed")
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # Interrupted before the provider answered; no outcome to record
+                self.breaker.release(admitted_as)
+                self._count("failed")
+                raise
+            self.breaker.record_success()
+            self._count("succeeded")
+            return result
+
+    async def acall(self, func: Callable[[float], Awaitable[Any]], deadline: Optional[float] = None) -> Any:
+        """Async variant of call; func(timeout) returns an awaitable"""
+        deadline = self.deadline if deadline is None else deadline
+        started = time.monotonic()
+        self._count("calls")
+        attempt = 0
+        while True:
+            try:
+                wait, admitted_as = self._before_attempt(started, deadline)
+            except Exception:
+                self._count("failed")
+                raise
+            try:
+                if wait:
+                    await asyncio.sleep(wait)
+                self._count("attempts")
+                result = await func(deadline - (time.monotonic() - started))
+            except Exception as e:
+                delay = self._after_failure(e, attempt, started, deadline)
+                if delay is None:
+                    self._count("failed")
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled before the provider answered; no outcome to record
+                self.breaker.release(admitted_as)
+                self._count("failed")
+                raise
+            self.breaker.record_success()
+            self._count("succeeded")
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and limiter state for monitoring"""
+        with self._lock:
+            counters = dict(self._counters)
+            throttle_wait = round(self._throttle_wait_seconds, 2)
+        return {
+            **counters,
+            "throttle_wait_seconds": throttle_wait,
+            "rate_limit": {
+                "per_minute": self.bucket.rate * 60,
+                "burst": self.bucket.capacity,
+                "tokens_available": self.bucket.available(),
+            },
+            "retry": {
+                "max_attempts": self.max_attempts,
+                "backoff_base_seconds": self.backoff_base,
+                "backoff_max_seconds": self.backoff_max,
+                "deadline_seconds": self.deadline,
+            },
+            "circuit_breaker": self.breaker.stats(),
+        }
+
+# Global LLM call scheduler instance (extraction threads may race to create it)
+llm_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_llm_scheduler() -> LLMCallScheduler:
+    """Get or create the LLM call scheduler instance"""
+    global llm_scheduler
+    if llm_scheduler is None:
+        with _scheduler_lock:
+            if llm_scheduler is None:
+                llm_scheduler = LLMCallScheduler()
+    return llm_scheduler
@@ -1,15 +1,28 @@
 """
 Local file storage for uploads. All files are stored under backend/uploads/
 using the same path convention as before (e.g. uploads/jobs/{job_id}/{folder_type}/...).
+
+Files are written in chunks to a temporary file next to the target, fsynced and
+renamed into place, so a file is either complete or absent and large uploads
+are never held in memory. Size and SHA-256 are computed while writing.
+
+The functions below are blocking. Routes do not call them directly but go
+through the storage backend (storage.LocalStorageBackend), whose async API runs
+them on the storage thread pool.
 """
+import io
 import os
 import uuid
+import hashlib
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import BinaryIO, List, Dict, Any, Optional
 
 # Base directory: backend folder. Paths like "uploads/jobs/..." resolve to backend/uploads/jobs/...
 BACKEND_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
 
+# Bytes read per chunk when streaming an upload to disk
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
 
 def get_local_path(relative_path: str) -> Path:
     """Convert a relative path (e.g. uploads/jobs/.../file.pdf) to absolute path under backend."""
@@ -26,19 +39,62 @@ def ensure_upload_dir(relative_path: str) -> Path:
     return full
 
 
-def save_file(relative_path: str, content: bytes, content_type: Optional[str] = None) -> Dict[str, Any]:
-    """Save file to local uploads. relative_path e.g. uploads/jobs/{job_id}/{folder_type}/{filename}."""
+def save_file_stream(
+    relative_path: str,
+    stream: BinaryIO,
+    content_type: Optional[str] = None,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> Dict[str, Any]:
+    """
+    Stream a file object to local uploads chunk by chunk (blocking; call from a
+    worker thread). The file is written atomically and its size and SHA-256
+    are returned along with the paths.
+    """
     full_path = ensure_upload_dir(relative_path)
-    full_path.write_bytes(content)
-    size = len(content)
+    tmp_path = full_path.with_name(f".{full_path.name}.{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    _fsync_directory(full_path.parent)
     return {
         "s3_key": relative_path,
         "file_path": relative_path,
         "file_url": f"/api/files/serve/{relative_path}",
         "size": size,
+        "sha256": digest.hexdigest(),
     }
 
 
+def _fsync_directory(directory: Path) -> None:
+    """Persist a rename in directory (not supported on Windows)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def save_file(relative_path: str, content: bytes, content_type: Optional[str] = None) -> Dict[str, Any]:
+    """Save file to local uploads. relative_path e.g. uploads/jobs/{job_id}/{folder_type}/{filename}."""
+    return save_file_stream(relative_path, io.BytesIO(content), content_type=content_type)
+
+
 def read_file(relative_path: str) -> bytes:
     """Read file content from local uploads."""
     full_path = get_local_path(relative_path)
@@ -47,21 +103,51 @@ def read_file(relative_path: str) -> bytes:
     return full_path.read_bytes()
 
 
+def file_sha256(relative_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 hex digest of a stored file's content."""
+    full_path = get_local_path(relative_path)
+    if not full_path.is_file():
+        raise FileNotFoundError(f"File not found: {relative_path}")
+    digest = hashlib.sha256()
+    with open(full_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def file_exists(relative_path: str) -> bool:
     """Check if a file exists at the given relative path."""
     full_path = get_local_path(relative_path)
     return full_path.is_file()
 
 
-def delete_file(relative_path: str) -> bool:
+def delete_file(relative_path: str, invalidate_cache: bool = True) -> bool:
     """Delete a file. Returns True if deleted or didn't exist."""
     full_path = get_local_path(relative_path)
     if full_path.is_file():
+        if invalidate_cache:
+            invalidate_cached_text(relative_path)
         full_path.unlink()
         return True
     return False
 
 
+def move_file(source_path: str, target_path: str) -> None:
+    """Atomically move a stored file to another relative path (replacing any file there)."""
+    target = ensure_upload_dir(target_path)
+    os.replace(get_local_path(source_path), target)
+    _fsync_directory(target.parent)
+
+
+def invalidate_cached_text(relative_path: str) -> None:
+    """Drop text/rows cached for this file by the AI processor (see extraction_cache)."""
+    try:
+        from extraction_cache import invalidate_document
+        invalidate_document(file_sha256(relative_path))
+    except Exception as e:
+        print(f"Could not invalidate cached text for {relative_path}: {e}")
+
+
 def list_files(prefix: str) -> List[Dict[str, Any]]:
     """List files under a prefix (e.g. uploads/jobs/). Returns list of {key, filename, size, last_modified}."""
     dir_path = get_local_path(prefix.rstrip("/"))
@@ -69,6 +155,9 @@ def list_files(prefix: str) -> List[Dict[str, Any]]:
         return []
     result = []
     for f in dir_path.rglob("*"):
+        # Skip uploads still being written (see save_file_stream)
+        if f.name.startswith(".") and f.name.endswith(".tmp"):
+            continue
         if f.is_file():
             rel = f.relative_to(BACKEND_DIR)
             key = str(rel).replace("\\", "/")
@@ -100,3 +189,4 @@ def generate_document_file_path(document_type: str, entity_id: str, filename: st
     from datetime import datetime, timezone
     ts = int(datetime.now(timezone.utc).timestamp())
     return f"uploads/{document_type}/{entity_id}_{document_type}_{ts}_{filename}"
+
@@ -1,4 +1,5 @@
 import os
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -13,7 +14,10 @@ from folder_routes import router as folder_router
 from invoice_routes import router as invoice_router
 from report_routes import router as report_router
 from admin_routes import router as admin_router
+from ai_routes import router as ai_router
 from models import Role
+from ai_tasks import get_ai_task_queue
+from parsing_service import warm_up_parse_pool, shutdown_parse_pool
 
 # Create FastAPI app
 app = FastAPI(title="Documents Verification API")
@@ -42,6 +46,7 @@ app.include_router(folder_router, prefix="/api")
 app.include_router(invoice_router, prefix="/api")
 app.include_router(report_router, prefix="/api")
 app.include_router(admin_router, prefix="/api")
+app.include_router(ai_router, prefix="/api")
 
 # Note: File uploads are now handled via S3, no local uploads directory needed
 # The /uploads mount has been removed as files are served directly from S3
@@ -62,10 +67,17 @@ async def startup_db_client():
         await users_collection.insert_one(default_admin)
         print("Created default admin user: admin@example.com / adminpassword")
 
+    # Start the document parser processes ahead of the first AI run
+    await asyncio.get_running_loop().run_in_executor(None, warm_up_parse_pool)
+
+    # Start background AI workers (re-queues tasks left unfinished by a previous run)
+    await get_ai_task_queue().start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     """Close database connection on shutdown"""
-    pass
+    await get_ai_task_queue().stop()
+    shutdown_parse_pool()
 
 @app.get("/")
 async def root():
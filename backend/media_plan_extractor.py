@@ -0,0 +1,357 @@
+"""
+Rule-Based Media Plan Extractor
+
+Computes the media plan fields that are plain lookups or sums directly from the
+sheet rows with pandas/NumPy, so the numbers are exact and the LLM is only
+asked for what cannot be resolved locally (usually the market type).
+
+Supported layouts:
+- a "Total Budget by Platform" table with a net amount column ("Total"), a fee
+  amount column ("Fee SAR") and VAT / "Total Payable" rows below it
+- "Net Media Cost" / "Agency Fee" amount columns, summed (or their total row)
+
+Financial fields are only returned when they add up
+(net + fees + taxes + third party == total payable); otherwise they are left
+for the LLM.
+"""
+
+import re
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from media_plan_text import normalize_rows, find_blocks
+
+logger = logging.getLogger(__name__)
+
+MEDIA_PLAN_FIELDS = (
+    "medium", "net_media_cost", "agency_fees", "taxes_amount",
+    "third_party_cost", "media_plan_total_amount", "market_type", "period_month"
+)
+FINANCIAL_FIELDS = ("net_media_cost", "agency_fees", "taxes_amount", "third_party_cost", "media_plan_total_amount")
+
+# Media types as listed in the "Total Budget by Platform" section
+MEDIUM_TYPES = (
+    "Television",
+    "Radio",
+    "Print",
+    "Out of home – Indoor – In malls",
+    "Inflight",
+    "Cinema",
+    "Digital non biddable",
+    "Digital-Social/biddable Platforms",
+    "Digital-programmatic",
+)
+
+PLATFORM_TABLE_KEYWORDS = ("total budget by platform",)
+NET_MEDIA_COST_KEYWORDS = ("net media cost",)
+AGENCY_FEE_KEYWORDS = ("agency fee",)
+VAT_KEYWORDS = ("vat",)
+TOTAL_PAYABLE_KEYWORDS = ("total payable",)
+THIRD_PARTY_KEYWORDS = ("3rd party", "third party")
+GEOTARGETING_KEYWORDS = ("geotargeting", "geo-targeting", "geo targeting")
+# Geotargeting mentioning these is classified as DOMESTIC
+DOMESTIC_KEYWORDS = ("saudi arabia", "ksa")
+
+# Tolerance when checking that the financial fields add up
+TOTAL_TOLERANCE = 1.0
+
+_NUMBER = re.compile(r"^-?\d+(\.\d+)?$")
+_MEDIUM_KEY = re.compile(r"[^a-z]")
+
+
+def _to_number(cell: Any) -> float:
+    """Numeric value of a cell, NaN for text, empty cells and percentages"""
+    if isinstance(cell, bool) or cell is None:
+        return np.nan
+    if isinstance(cell, (int, float, np.number)):
+        return float(cell)
+    text = str(cell).strip().replace(",", "")
+    for prefix in ("SAR", "USD"):
+        text = text.removeprefix(prefix).strip()
+    return float(text) if _NUMBER.match(text) else np.nan
+
+
+def _round(value: float) -> float:
+    """Drop floating point noise from sums (amounts keep their decimals)"""
+    return round(float(value), 8)
+
+
+def _medium_key(label: str) -> str:
+    return _MEDIUM_KEY.sub("", label.lower())
+
+
+_MEDIUM_BY_KEY = {_medium_key(name): name for name in MEDIUM_TYPES}
+
+
+class MediaPlanSheet:
+    def __init__(self, rows: List[List[Any]]):
+        """Text and numeric views of the sheet with the same shape"""
+        width = max((len(row) for row in rows), default=0)
+        padded = [list(row) + [None] * (width - len(row)) for row in rows]
+        self.text = pd.DataFrame(normalize_rows(padded), dtype=object)
+        self.lower = self.text.apply(lambda column: column.str.lower())
+        self.values = pd.DataFrame(padded, dtype=object).map(_to_number).astype(float)
+        self.blocks = find_blocks(self.text.values.tolist())
+
+    def find(self, keywords: Tuple[str, ...]) -> List[Tuple[int, int]]:
+        """(row, column) of every cell containing one of the keywords, in sheet order"""
+        mask = np.zeros(self.lower.shape, dtype=bool)
+        for keyword in keywords:
+            mask |= self.lower.apply(lambda column: column.str.contains(keyword, regex=False)).to_numpy()
+        return [(int(row), int(col)) for row, col in zip(*np.nonzero(mask))]
+
+    def block_end(self, row: int) -> int:
+        """End (exclusive) of the block of non-empty rows containing row"""
+        for start, end in self.blocks:
+            if start <= row < end:
+                return end
+        return row + 1
+
+    def label(self, row: int) -> str:
+        """First non-empty text cell of a row, lower case"""
+        return next((cell for cell in self.lower.iloc[row] if cell), "")
+
+    def value_after(self, row: int, col: int) -> str:
+        """First non-empty cell to the right of (row, col)"""
+        return next((cell for cell in self.text.iloc[row, col + 1:] if cell), "")
+
+
+def _amount_column(sheet: MediaPlanSheet, header_row: int, keywords: Tuple[str, ...]) -> Optional[int]:
+    """
+    Column of an amount header in header_row, preferring SAR amounts; columns that
+    only hold rates (all values <= 1) are skipped.
+    """
+    headers = sheet.lower.iloc[header_row]
+    candidates = [col for col, header in enumerate(headers) if any(keyword in header for keyword in keywords)]
+    candidates.sort(key=lambda col: ("sar" not in headers[col], "usd" in headers[col]))
+    end = sheet.block_end(header_row)
+    for col in candidates:
+        values = sheet.values.iloc[header_row + 1:end, col].to_numpy()
+        values = values[~np.isnan(values)]
+        if values.size and np.abs(values).max() > 1:
+            return col
+    return None
+
+
+def _platform_table(sheet: MediaPlanSheet) -> Dict[str, Any]:
+    """Fields from the "Total Budget by Platform" table and the VAT / total rows under it"""
+    found = sheet.find(PLATFORM_TABLE_KEYWORDS)
+    if not found:
+        return {}
+    header_row, label_col = found[0]
+    end = sheet.block_end(header_row)
+    headers = sheet.lower.iloc[header_row]
+
+    net_col = next(
+        (col for col in range(label_col + 1, len(headers))
+         if headers[col] and "fee" not in headers[col] and ("total" in headers[col] or "net" in headers[col])),
+        None
+    )
+    fee_col = _amount_column(sheet, header_row, ("fee",))
+
+    # Platform rows run until the first VAT / total row
+    platform_rows = []
+    for row in range(header_row + 1, end):
+        label = sheet.lower.iloc[row, label_col]
+        if any(keyword in label for keyword in VAT_KEYWORDS + TOTAL_PAYABLE_KEYWORDS + THIRD_PARTY_KEYWORDS):
+            break
+        if label:
+            platform_rows.append(row)
+
+    fields: Dict[str, Any] = {}
+    if net_col is not None and platform_rows:
+        net = sheet.values.iloc[platform_rows, net_col].to_numpy()
+        fields["net_media_cost"] = _round(np.nansum(net))
+
+        mediums = []
+        for row, amount in zip(platform_rows, net):
+            name = _MEDIUM_BY_KEY.get(_medium_key(sheet.text.iloc[row, label_col]))
+            if name and amount > 0:
+                mediums.append(name)
+        fields["medium"] = ", ".join(mediums)
+
+    if fee_col is not None and platform_rows:
+        fields["agency_fees"] = _round(np.nansum(sheet.values.iloc[platform_rows, fee_col].to_numpy()))
+
+    # VAT, third party and grand total amounts are in the fee amount column
+    if fee_col is not None:
+        for row in range(header_row + 1, end):
+            label = sheet.lower.iloc[row, label_col]
+            amount = sheet.values.iloc[row, fee_col]
+            if np.isnan(amount):
+                continue
+            if "taxes_amount" not in fields and any(keyword in label for keyword in VAT_KEYWORDS):
+                fields["taxes_amount"] = _round(amount)
+            elif "third_party_cost" not in fields and any(keyword in label for keyword in THIRD_PARTY_KEYWORDS):
+                fields["third_party_cost"] = _round(amount)
+            elif "media_plan_total_amount" not in fields and any(keyword in label for keyword in TOTAL_PAYABLE_KEYWORDS):
+                fields["media_plan_total_amount"] = _round(amount)
+    return fields
+
+
+def _column_total(sheet: MediaPlanSheet, keywords: Tuple[str, ...]) -> Optional[float]:
+    """
+    Total of the first amount column whose header matches keywords: the value on
+    its "total" row if there is one, otherwise the sum of the column.
+    """
+    for header_row, _ in sheet.find(keywords):
+        col = _amount_column(sheet, header_row, keywords)
+        if col is None:
+            continue
+        rows = range(header_row + 1, sheet.block_end(header_row))
+        for row in rows:
+            if "total" in sheet.label(row) and not np.isnan(sheet.values.iloc[row, col]):
+                return _round(sheet.values.iloc[row, col])
+        return _round(np.nansum(sheet.values.iloc[list(rows), col].to_numpy()))
+    return None
+
+
+def _geotargeting(sheet: MediaPlanSheet) -> str:
+    """Distinct Geotargeting values listed under the Geotargeting header"""
+    targets: List[str] = []
+    for header_row, col in sheet.find(GEOTARGETING_KEYWORDS):
+        for row in range(header_row + 1, sheet.block_end(header_row)):
+            value = sheet.text.iloc[row, col]
+            if value and value not in targets and "total" not in value.lower():
+                targets.append(value)
+    return ", ".join(targets)
+
+
+def _period_month(sheet: MediaPlanSheet) -> Optional[str]:
+    """Value next to the "Period:" label in the header block"""
+    for row, col in sheet.find(("period",)):
+        if sheet.lower.iloc[row, col].startswith("period"):
+            value = sheet.value_after(row, col)
+            if value:
+                return value
+    return None
+
+
+def extract_media_plan_locally(rows: List[List[Any]]) -> Dict[str, Any]:
+    """
+    Resolve as many media plan fields as possible from the sheet rows.
+
+    Returns:
+        Dict with the resolved subset of MEDIA_PLAN_FIELDS
+    """
+    if not rows:
+        return {}
+    sheet = MediaPlanSheet(rows)
+    fields = _platform_table(sheet)
+
+    # Explicit Net Media Cost / Agency Fee columns take precedence over the platform table
+    net_media_cost = _column_total(sheet, NET_MEDIA_COST_KEYWORDS)
+    if net_media_cost is not None:
+        fields["net_media_cost"] = net_media_cost
+    agency_fees = _column_total(sheet, AGENCY_FEE_KEYWORDS)
+    if agency_fees is not None:
+        fields["agency_fees"] = agency_fees
+
+    if "media_plan_total_amount" in fields:
+        fields.setdefault("third_party_cost", 0.0)
+        parts = [fields.get(field) for field in FINANCIAL_FIELDS[:4]]
+        if None in parts or abs(sum(parts) - fields["media_plan_total_amount"]) > TOTAL_TOLERANCE:
+            logger.info(f"Media plan amounts do not add up ({parts} vs {fields['media_plan_total_amount']}); leaving them to the LLM")
+            for field in FINANCIAL_FIELDS:
+                fields.pop(field, None)
+    else:
+        # Without a grand total the sums cannot be cross-checked
+        for field in FINANCIAL_FIELDS:
+            fields.pop(field, None)
+
+    period_month = _period_month(sheet)
+    if period_month:
+        fields["period_month"] = period_month
+
+    geotargeting = _geotargeting(sheet).lower()
+    if any(keyword in geotargeting for keyword in DOMESTIC_KEYWORDS):
+        fields["market_type"] = "DOMESTIC"
+
+    if not fields.get("medium"):
+        fields.pop("medium", None)
+    return fields
+
+
+# Words in file names / sheets that mark the after-job (actualized) plan or the pre-job (approved) plan
+AFTER_JOB_KEYWORDS = ("actualized", "actualised", "actual", "final", "post", "after", "executed", "delivered", "recon")
+BEFORE_JOB_KEYWORDS = ("approved", "pre", "before", "proposed", "draft", "initial", "estimate")
+
+# Weights of the media plan selection signals
+FILE_NAME_WEIGHT = 4
+CONTENT_WEIGHT = 2
+VERSION_WEIGHT = 1
+UPLOAD_ORDER_WEIGHT = 1
+
+_WORD = re.compile(r"[a-z]+")
+_VERSION = re.compile(r"(\d+(?:\.\d+)?)")
+
+
+def _keyword_score(text: str) -> int:
+    """+1 for each after-job word, -1 for each before-job word"""
+    words = set(_WORD.findall(text.lower()))
+    return len(words & set(AFTER_JOB_KEYWORDS)) - len(words & set(BEFORE_JOB_KEYWORDS))
+
+
+def _sheet_version(sheet: MediaPlanSheet) -> Optional[float]:
+    """Number after the "Version:" label, e.g. 2 for "V2" """
+    for row, col in sheet.find(("version",)):
+        if sheet.lower.iloc[row, col].startswith("version"):
+            match = _VERSION.search(sheet.value_after(row, col))
+            if match:
+                return float(match.group(1))
+    return None
+
+
+def _timestamp(value: Any) -> Optional[float]:
+    if isinstance(value, str):
+        try:
+            value = pd.Timestamp(value)
+        except ValueError:
+            return None
+    if not hasattr(value, "timestamp"):
+        return None
+    if getattr(value, "tzinfo", None) is None:
+        # Mongo returns naive UTC datetimes
+        value = pd.Timestamp(value).tz_localize("UTC")
+    return value.timestamp()
+
+
+def _rank(values: List[Optional[float]]) -> List[int]:
+    """1 for the candidates holding the highest value, 0 otherwise (all 0 when they are equal)"""
+    known = [value for value in values if value is not None]
+    if len(set(known)) < 2:
+        return [0] * len(values)
+    highest = max(known)
+    return [1 if value == highest else 0 for value in values]
+
+
+def score_media_plan_candidates(candidates: List[Dict[str, Any]]) -> List[int]:
+    """
+    Score how likely each media plan is the after-job (actualized) one.
+
+    Each candidate has "file_name", optional "uploaded_at" and optional "rows"
+    (the sheet). Signals: after/before-job words in the file name and in the
+    sheet, the sheet's "Version:" number and which file was uploaded last.
+    Sheet words only count when the sheets differ.
+    """
+    sheets = [MediaPlanSheet(candidate["rows"]) if candidate.get("rows") else None for candidate in candidates]
+    sheet_texts = [
+        " ".join(cell for cell in sheet.lower.to_numpy().ravel() if cell) if sheet is not None else ""
+        for sheet in sheets
+    ]
+    content_differs = len(set(sheet_texts)) > 1
+
+    versions = _rank([_sheet_version(sheet) if sheet is not None else None for sheet in sheets])
+    upload_order = _rank([_timestamp(candidate.get("uploaded_at")) for candidate in candidates])
+
+    scores = []
+    for index, candidate in enumerate(candidates):
+        score = FILE_NAME_WEIGHT * _keyword_score(candidate.get("file_name") or "")
+        if content_differs:
+            score += CONTENT_WEIGHT * _keyword_score(sheet_texts[index])
+        score += VERSION_WEIGHT * versions[index] + UPLOAD_ORDER_WEIGHT * upload_order[index]
+        scores.append(score)
+    return scores
@@ -0,0 +1,190 @@
+"""
+Media Plan Text Compaction
+
+Turns the rows of a media plan sheet into compact tab-separated text for the
+LLM prompt. Media plan sheets are mostly empty cells, bilingual labels and
+notes; only a few regions matter for extraction:
+
+- the header block (Client / Period / Market / Date)
+- the "Total Budget by Platform" summary table
+- tables with Net Media Cost, Agency Fee or Geotargeting columns
+- grand-total rows (totals, VAT, total payable, third party costs)
+
+Regions are added in that order of priority until the token budget is spent
+and are then written out in sheet order.
+"""
+
+import os
+import re
+import math
+from datetime import datetime, date
+from typing import Any, List, Optional, Tuple
+
+# Approximate prompt budget for the sheet text (1 token ~ 4 characters)
+MEDIA_PLAN_TOKEN_BUDGET = int(os.getenv("MEDIA_PLAN_TOKEN_BUDGET", "3000"))
+CHARS_PER_TOKEN = 4
+
+# Tables with at least this many columns are reduced to their relevant columns
+WIDE_TABLE_COLUMNS = 8
+
+HEADER_KEYWORDS = ("client", "period", "market", "date", "version", "campaign")
+PLATFORM_KEYWORDS = ("total budget by platform",)
+TABLE_KEYWORDS = ("net media cost", "agency fee", "geotargeting", "geo-targeting", "geo targeting")
+TOTAL_KEYWORDS = ("total", "vat", "payable", "3rd party", "third party")
+# Columns kept from wide tables (the first non-empty column is always kept as the row label)
+COLUMN_KEYWORDS = ("net media cost", "agency fee", "geo", "platform", "medium", "channel", "total", "budget", "vat")
+
+_LATIN = re.compile(r"[A-Za-z0-9]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_cell(cell: Any) -> str:
+    """
+    Render a cell as short text: empty/NaN cells become "", whole numbers lose
+    their ".0", midnight timestamps are shown as dates. For bilingual labels
+    (Arabic line + English line) only the lines with Latin text are kept.
+    """
+    if cell is None:
+        return ""
+    if isinstance(cell, float):
+        if math.isnan(cell):
+            return ""
+        return str(int(cell)) if cell.is_integer() else repr(cell)
+    if isinstance(cell, datetime):
+        return cell.strftime("%Y-%m-%d") if cell.time() == datetime.min.time() else cell.isoformat(sep=" ")
+    if isinstance(cell, date):
+        return cell.isoformat()
+
+    text = str(cell).strip()
+    if text.lower() == "nan":
+        return ""
+    if text.endswith(" 00:00:00"):
+        text = text[:-len(" 00:00:00")]
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) > 1:
+        latin_lines = [line for line in lines if _LATIN.search(line)]
+        lines = latin_lines or lines
+    return _WHITESPACE.sub(" ", " ".join(lines))
+
+
+def normalize_rows(rows: List[List[Any]]) -> List[List[str]]:
+    """Normalize every cell of the sheet"""
+    return [[normalize_cell(cell) for cell in row] for row in rows or []]
+
+
+def find_blocks(rows: List[List[str]]) -> List[Tuple[int, int]]:
+    """Split the sheet into blocks of consecutive non-empty rows, as (start, end) row ranges"""
+    blocks = []
+    start = None
+    for index, row in enumerate(rows):
+        if any(row):
+            if start is None:
+                start = index
+        elif start is not None:
+            blocks.append((start, index))
+            start = None
+    if start is not None:
+        blocks.append((start, len(rows)))
+    return blocks
+
+
+def _row_text(row: List[str]) -> str:
+    return " ".join(cell for cell in row if cell).lower()
+
+
+def _matches(text: str, keywords: Tuple[str, ...]) -> bool:
+    return any(keyword in text for keyword in keywords)
+
+
+def _is_header_row(row: List[str]) -> bool:
+    """Header rows start with a label such as "Client:" or "Period:" """
+    label = next((cell for cell in row if cell), "").lower()
+    return any(label.startswith(keyword) for keyword in HEADER_KEYWORDS)
+
+
+def _row_columns(row: List[str], cols: Optional[List[int]]) -> Optional[List[int]]:
+    """Columns kept for one row of a table; total labels in dropped columns are kept too"""
+    if cols is None:
+        return None
+    extra = [col for col, cell in enumerate(row) if col not in cols and _matches(cell.lower(), TOTAL_KEYWORDS)]
+    return cols + extra if extra else cols
+
+
+def _block_columns(rows: List[List[str]], start: int, end: int) -> Optional[List[int]]:
+    """Columns to keep for a wide table block, or None to keep all of them"""
+    for index in range(start, end):
+        header = rows[index]
+        filled = [col for col, cell in enumerate(header) if cell]
+        if len(filled) < WIDE_TABLE_COLUMNS:
+            continue
+        keep = [filled[0]] + [col for col in filled[1:] if _matches(header[col].lower(), COLUMN_KEYWORDS)]
+        if len(keep) > 1:
+            return keep
+    return None
+
+
+def _render(rows: List[List[str]], selections: List[Tuple[int, Optional[List[int]]]]) -> str:
+    """Write the selected rows in sheet order, dropping columns that are empty in all of them"""
+    selections = sorted(selections)
+    width = max((len(rows[index]) for index, _ in selections), default=0)
+    used = [
+        col for col in range(width)
+        if any(col < len(rows[index]) and rows[index][col] and (cols is None or col in cols)
+               for index, cols in selections)
+    ]
+
+    lines = []
+    previous = None
+    for index, cols in selections:
+        if previous is not None and index != previous + 1:
+            lines.append("")  # keep regions visually separate
+        row = rows[index]
+        cells = [row[col] if col < len(row) and (cols is None or col in cols) else "" for col in used]
+        while cells and not cells[-1]:
+            cells.pop()
+        lines.append("\t".join(cells))
+        previous = index
+    return "\n".join(lines)
+
+
+def compact_media_plan_rows(rows: List[List[Any]], token_budget: int = MEDIA_PLAN_TOKEN_BUDGET) -> str:
+    """
+    Build the prompt text for a media plan sheet from its raw rows, keeping the
+    relevant regions within token_budget (0 = no limit).
+    """
+    rows = normalize_rows(rows)
+    blocks = find_blocks(rows)
+    if not blocks:
+        return ""
+
+    # (priority, start, end, columns); lower priority values are added first
+    candidates = []
+    for block_index, (start, end) in enumerate(blocks):
+        texts = [_row_text(rows[index]) for index in range(start, end)]
+        block_text = " ".join(texts)
+        if _matches(block_text, PLATFORM_KEYWORDS):
+            candidates.append((1, start, end, None))
+        elif _matches(block_text, TABLE_KEYWORDS):
+            candidates.append((2, start, end, _block_columns(rows, start, end)))
+        elif block_index == 0 or any(_is_header_row(rows[index]) for index in range(start, end)):
+            candidates.append((0, start, end, None))
+        else:
+            # Outside the main regions only the grand-total rows are kept
+            for offset, text in enumerate(texts):
+                if _matches(text, TOTAL_KEYWORDS):
+                    candidates.append((3, start + offset, start + offset + 1, None))
+    candidates.sort(key=lambda candidate: (candidate[0], candidate[1]))
+
+    max_chars = token_budget * CHARS_PER_TOKEN if token_budget else 0
+    selections: List[Tuple[int, Optional[List[int]]]] = []
+    text = ""
+    for _, start, end, cols in candidates:
+        attempt = selections + [(index, _row_columns(rows[index], cols)) for index in range(start, end)]
+        attempt_text = _render(rows, attempt)
+        if max_chars and len(attempt_text) > max_chars:
+            if not selections:
+                # Even the most important region is over budget; cut it off
+                return attempt_text[:max_chars]
+            continue
+        selections, text = attempt, attempt_text
+    return text
@@ -9,6 +9,9 @@ import asyncio
 from pathlib import Path
 from s3_service import get_s3_service
 
+# Folders listed in parallel when verifying
+VERIFY_LIST_CONCURRENCY = 8
+
 async def migrate_files_to_s3():
     """Migrate all existing files from local uploads directory to S3"""
     uploads_dir = Path("uploads")
@@ -78,15 +81,18 @@ async def verify_migration():
         s3_service = get_s3_service()
         print(f"Verifying files in S3 bucket: {s3_service.bucket_name}")
         
-        # List all files in S3
-        files = await s3_service.list_files("uploads/")
-        print(f"Found {len(files)} files in S3")
-        
-        for file_info in files[:10]:  # Show first 10 files
-            print(f"  - {file_info['key']} ({file_info['size']} bytes)")
+        # Stream the listing (every page, listed in parallel per folder) instead of loading it
+        file_count = 0
+        total_size = 0
+        async for file_info in s3_service.iter_files("uploads/", concurrency=VERIFY_LIST_CONCURRENCY):
+            file_count += 1
+            total_size += file_info['size']
+            if file_count <= 10:  # Show first 10 files
+                print(f"  - {file_info['key']} ({file_info['size']} bytes)")
         
-        if len(files) > 10:
-            print(f"  ... and {len(files) - 10} more files")
+        if file_count > 10:
+            print(f"  ... and {file_count - 10} more files")
+        print(f"Found {file_count} files in S3 ({total_size / 1024 / 1024:.1f} MB)")
             
     except Exception as e:
         print(f"Failed to verify migration: {e}")
@@ -171,6 +171,7 @@ class JobReview(BaseModel):
     # Raw AI Output
     raw_ai_invoice_output: Optional[Dict] = None
     raw_ai_po_output: Optional[Dict] = None
+    raw_ai_media_plan_output: Optional[Dict] = None
 
 
 # Document checklist for jobs
@@ -227,6 +228,8 @@ class Document(BaseModel):
     """Represents a single uploaded file"""
     file_path: str
     original_filename: Optional[str] = None
+    # SHA-256 of the content when the file lives in the blob store
+    content_hash: Optional[str] = None
     metadata: Optional[Dict[str, str]] = None
     uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     uploaded_by: Optional[str] = None
@@ -315,6 +318,7 @@ class FileBase(BaseModel):
     original_filename: str
     file_size: int
     mime_type: Optional[str] = None
+    content_hash: Optional[str] = None
     metadata: Optional[Dict[str, str]] = None
 
 
@@ -331,4 +335,36 @@ class FileInDB(FileBase):
 class File(FileBase):
     id: str
     uploaded_by: str
-    uploaded_at: datetime
\ No newline at end of file
+    uploaded_at: datetime
+
+
+# ==============================
+# AI Task Models
+# ==============================
+class AITaskStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class BatchAIProcessRequest(BaseModel):
+    """Select jobs of an agency for batch AI processing by ID and/or status"""
+    job_ids: Optional[List[str]] = None
+    status: Optional[JobStatus] = None
+    mode: Optional[str] = None
+
+
+class AITask(BaseModel):
+    """Background AI processing task (see ai_tasks.py)"""
+    id: str
+    task_type: str
+    job_id: str
+    status: AITaskStatus = AITaskStatus.QUEUED
+    params: Dict = Field(default_factory=dict)
+    result: Optional[Dict] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
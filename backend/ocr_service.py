@@ -0,0 +1,122 @@
+"""
+OCR Service
+
+Scanned agency invoices and job orders have PDF pages without a text layer.
+Those pages (and only those) are rendered to images and read with Tesseract:
+
+- rendering and OCR run in the parser process pool (parsing_service)
+- results are cached per page, keyed by the SHA-256 of the rendered page image,
+  so a page is never OCR'd twice, even when it shows up in another document
+
+OCR is optional: without pytesseract or the tesseract binary installed the
+pages simply stay empty, as before.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from extraction_cache import make_cache_key, ocr_cache
+from parsing_service import map_parse, ocr_image, render_pdf_pages, run_parse
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OCR_ENABLED = os.getenv("OCR_ENABLED", "true").lower() in ("1", "true", "yes")
+# Render resolution for scanned pages; Tesseract works best at about 300 DPI
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+# Tesseract language codes, e.g. "eng" or "eng+ara"
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "eng")
+# Extra Tesseract options, e.g. "--psm 6"
+OCR_TESSERACT_CONFIG = os.getenv("OCR_TESSERACT_CONFIG", "")
+
+# Bump when the OCR pipeline changes so cached page text is not reused
+OCR_VERSION = "1"
+
+_available: Optional[bool] = None
+_available_lock = threading.Lock()
+
+
+def ocr_available() -> bool:
+    """Whether OCR is enabled and Tesseract can be used (checked once per process)"""
+    global _available
+    if not OCR_ENABLED:
+        return False
+    if _available is None:
+        with _available_lock:
+            if _available is None:
+                try:
+                    import pytesseract
+                    if os.getenv("TESSERACT_CMD"):
+                        pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD")
+                    version = pytesseract.get_tesseract_version()
+                    logger.info(f"OCR enabled with Tesseract {version} ({OCR_LANGUAGES})")
+                    _available = True
+                except Exception as e:
+                    logger.warning(f"OCR disabled, Tesseract is not available: {e}")
+                    _available = False
+    return _available
+
+
+def ocr_signature() -> str:
+    """Identifies the OCR settings in cache keys of text that may include OCR output"""
+    if not ocr_available():
+        return "no-ocr"
+    return f"ocr:{OCR_VERSION}:{OCR_LANGUAGES}:{OCR_DPI}:{OCR_TESSERACT_CONFIG}"
+
+
+def _page_cache_key(image_digest: str) -> str:
+    return make_cache_key("ocr_page", OCR_VERSION, OCR_LANGUAGES, OCR_TESSERACT_CONFIG, image_digest)
+
+
+def _ocr_images(images: List[tuple]) -> List[str]:
+    """OCR (digest, image bytes) pairs, reusing cached page text; failed pages come back empty"""
+    texts: List[Optional[str]] = [ocr_cache.get(_page_cache_key(digest)) for digest, _ in images]
+    # Identical pages (e.g. a repeated terms page) are OCR'd once
+    missing: Dict[str, bytes] = {}
+    for (digest, content), text in zip(images, texts):
+        if text is None:
+            missing.setdefault(digest, content)
+    if missing:
+        try:
+            results = map_parse(
+                ocr_image,
+                [(content, OCR_LANGUAGES, OCR_TESSERACT_CONFIG) for content in missing.values()]
+            )
+        except Exception as e:
+            logger.error(f"OCR failed: {e}")
+            results = [None] * len(missing)
+        found = dict(zip(missing, results))
+        for digest, text in found.items():
+            if text is not None:
+                ocr_cache.set(_page_cache_key(digest), text)
+        texts = [found.get(digest) or "" if text is None else text for (digest, _), text in zip(images, texts)]
+    return texts
+
+
+def ocr_pdf_pages(file_content: bytes, page_indexes: List[int]) -> Dict[int, str]:
+    """
+    OCR the given (0-based) pages of a PDF. Returns {page index: text}; empty
+    when OCR is not available.
+    """
+    if not page_indexes or not ocr_available():
+        return {}
+    try:
+        images = run_parse(render_pdf_pages, file_content, page_indexes, OCR_DPI)
+    except Exception as e:
+        logger.error(f"Could not render PDF pages {page_indexes} for OCR: {e}")
+        return {}
+    return dict(zip(page_indexes, _ocr_images(images)))
+
+
+def ocr_image_content(image_content: bytes) -> str:
+    """OCR an image file (PNG/JPEG); empty when OCR is not available"""
+    if not image_content or not ocr_available():
+        return ""
+    return _ocr_images([(hashlib.sha256(image_content).hexdigest(), image_content)])[0]
@@ -0,0 +1,208 @@
+"""
+Document Parsing Service
+
+CPU-bound PDF and Excel parsing runs in a shared process pool so that it scales
+across cores and does not hold the GIL of the API worker process. The parse
+functions below are top-level so they can be sent to the pool workers; this
+module only imports the parsing libraries to keep worker start-up light (the
+optional OCR engine is imported on first use).
+"""
+
+import os
+import io
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+import pdfplumber
+import pypdfium2 as pdfium
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Number of parser processes; 0 parses in the calling thread instead
+PARSE_POOL_WORKERS = int(os.getenv("PARSE_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+# PDFium is not thread safe; matters when parsing in-process
+_pdfium_lock = threading.Lock()
+
+
+def iter_pdf_page_text(file_content: bytes, max_pages: int = 0) -> Iterator[str]:
+    """
+    Yield the text of each PDF page lazily, stopping after max_pages (0 = all pages).
+    Pages are released as soon as their text has been extracted.
+    """
+    with pdfplumber.open(io.BytesIO(file_content)) as pdf:
+        for index, page in enumerate(pdf.pages):
+            if max_pages and index >= max_pages:
+                break
+            try:
+                yield page.extract_text() or ""
+            finally:
+                page.close()
+
+
+def extract_pdf_page_texts(file_content: bytes, max_pages: int = 0, max_chars: int = 0) -> List[str]:
+    """
+    Extract the text layer of each PDF page, stopping early once the page or
+    character budget is reached (0 = no limit). Pages without a text layer
+    (e.g. scans) come back as empty strings.
+    """
+    parts: List[str] = []
+    length = 0
+    pages = iter_pdf_page_text(file_content, max_pages)
+    try:
+        for page_text in pages:
+            parts.append(page_text)
+            length += len(page_text) + 1
+            if max_chars and length >= max_chars:
+                break
+    finally:
+        pages.close()
+    return parts
+
+
+def join_page_texts(parts: List[str], max_chars: int = 0) -> str:
+    """Join page texts into the document text, cut to max_chars (0 = no limit)"""
+    text = "\n".join(parts).strip()
+    return text[:max_chars] if max_chars else text
+
+
+def extract_pdf_text(file_content: bytes, max_pages: int = 0, max_chars: int = 0) -> str:
+    """
+    Extract text from PDF bytes page by page, stopping early once the page or
+    character budget is reached (0 = no limit).
+    """
+    return join_page_texts(extract_pdf_page_texts(file_content, max_pages, max_chars), max_chars)
+
+
+def render_pdf_pages(file_content: bytes, page_indexes: List[int], dpi: int) -> List[Tuple[str, bytes]]:
+    """
+    Render PDF pages to grayscale PNG images for OCR. Returns (SHA-256 of the
+    image, PNG bytes) per page, so OCR results can be cached by page content.
+    """
+    images = []
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(file_content)
+        try:
+            for index in page_indexes:
+                page = pdf[index]
+                try:
+                    image = page.render(scale=dpi / 72, grayscale=True).to_pil()
+                finally:
+                    page.close()
+                buffer = io.BytesIO()
+                image.save(buffer, format="PNG")
+                png = buffer.getvalue()
+                images.append((hashlib.sha256(png).hexdigest(), png))
+        finally:
+            pdf.close()
+    return images
+
+
+def ocr_image(image_content: bytes, languages: str, config: str = "") -> str:
+    """OCR an image with Tesseract (pytesseract is imported on first use)"""
+    import pytesseract
+    from PIL import Image
+
+    if os.getenv("TESSERACT_CMD"):
+        pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD")
+    with Image.open(io.BytesIO(image_content)) as image:
+        return pytesseract.image_to_string(image, lang=languages, config=config).strip()
+
+
+def extract_excel_rows(file_content: bytes) -> List[List[Any]]:
+    """Read the first sheet of an Excel file as a list of rows"""
+    df = pd.read_excel(io.BytesIO(file_content), sheet_name=0, header=None)
+    return df.values.tolist()
+
+
+def _worker_ready() -> int:
+    """Warm-up task: the imports above have run once the worker answers"""
+    return os.getpid()
+
+
+def get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    """Get or create the shared parser process pool (None when disabled)"""
+    global _pool
+    if PARSE_POOL_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: the API process has running threads, which fork does not copy safely
+                _pool = ProcessPoolExecutor(
+                    max_workers=PARSE_POOL_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pool
+
+
+def warm_up_parse_pool() -> None:
+    """Start every parser process ahead of the first request"""
+    pool = get_parse_pool()
+    if pool is None:
+        return
+    try:
+        pids = {f.result() for f in [pool.submit(_worker_ready) for _ in range(PARSE_POOL_WORKERS)]}
+        logger.info(f"Parser pool ready with {len(pids)} worker process(es)")
+    except Exception as e:
+        # Parsing still works (in-process fallback); don't block start-up
+        logger.error(f"Could not warm up parser pool: {e}")
+
+
+def shutdown_parse_pool() -> None:
+    """Stop the parser processes"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def run_parse(func: Callable, *args) -> Any:
+    """
+    Run a parse function in the process pool and wait for its result.
+    Call from worker threads, not from the event loop. Falls back to parsing
+    in the calling thread if the pool is disabled or has broken.
+    """
+    pool = get_parse_pool()
+    if pool is None:
+        return func(*args)
+    try:
+        return pool.submit(func, *args).result()
+    except BrokenProcessPool:
+        _discard_broken_pool(pool)
+        return func(*args)
+
+
+def map_parse(func: Callable, arg_tuples: Iterable[Tuple]) -> List[Any]:
+    """
+    Like run_parse for several calls at once: they run in parallel in the pool
+    and the results are returned in input order.
+    """
+    arg_tuples = list(arg_tuples)
+    pool = get_parse_pool()
+    if pool is None:
+        return [func(*args) for args in arg_tuples]
+    try:
+        futures = [pool.submit(func, *args) for args in arg_tuples]
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        _discard_broken_pool(pool)
+        return [func(*args) for args in arg_tuples]
+
+
+def _discard_broken_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next call starts a new one"""
+    global _pool
+    logger.error("Parser pool broke (a worker died); parsing in-process and restarting the pool")
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
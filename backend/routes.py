@@ -3,7 +3,6 @@ from typing import List, Optional
 from bson import ObjectId
 import os
 import shutil
-from pathlib import Path
 import secrets
 import re
 from datetime import datetime
@@ -18,16 +17,10 @@ from models import (
     Invoice, InvoiceCreate, InvoiceInDB,
 )
 from db import users_collection, clients_collection, agencies_collection, invoices_collection, jobs_collection
+from storage import get_storage
 
 router = APIRouter()
 
-# Helper function for creating upload directory
-def ensure_upload_dir(path: str) -> Path:
-    """Ensure the upload directory exists"""
-    directory = Path(path)
-    directory.mkdir(parents=True, exist_ok=True)
-    return directory
-
 # Code generation helpers
 async def generate_unique_code(prefix: str, collection, field_name: str, attempts: int = 10) -> str:
     for _ in range(attempts):
@@ -438,10 +431,10 @@ async def upload_file(
         raise HTTPException(status_code=400, detail=f"Invalid document type. Must be one of: {', '.join(valid_document_types)}")
     
     try:
-        from local_storage import save_file as local_save, generate_document_file_path as gen_path
-        file_content = await file.read()
+        from local_storage import generate_document_file_path as gen_path
         relative_path = gen_path(document_type, entity_id, file.filename)
-        upload_result = local_save(relative_path, file_content, content_type=file.content_type)
+        # Stream the upload to storage in chunks instead of reading it into memory
+        upload_result = await get_storage().asave_file_stream(relative_path, file.file, file.content_type)
         filename = os.path.basename(relative_path)
         file_path = relative_path
         s3_key = relative_path
@@ -503,16 +496,13 @@ async def get_agency_folder_status(agency_code: str):
         folder_type = folder["type"]
         
         # Check if files exist for this folder type
-        upload_dir = Path(f"uploads/{folder_type}")
-        if upload_dir.exists():
-            # Find files that match the agency code pattern
-            pattern = f"{agency_code}_{folder_type}_*"
-            files = list(upload_dir.glob(pattern))
-            file_count = len(files)
-            file_names = [f.name for f in files]
-        else:
-            file_count = 0
-            file_names = []
+        # Find files that match the agency code pattern
+        pattern = f"{agency_code}_{folder_type}_"
+        file_names = [
+            f["filename"] for f in await get_storage().alist_files(f"uploads/{folder_type}/")
+            if f["filename"].startswith(pattern)
+        ]
+        file_count = len(file_names)
         
         folder_status.append({
             **folder,
@@ -594,12 +584,10 @@ async def delete_custom_folder(agency_code: str, folder_type: str):
         raise HTTPException(status_code=404, detail="Custom folder not found")
     
     # Check if folder has files (cannot delete if it has files)
-    upload_dir = Path(f"uploads/{folder_type}")
-    if upload_dir.exists():
-        pattern = f"{agency_code}_{folder_type}_*"
-        files = list(upload_dir.glob(pattern))
-        if files:
-            raise HTTPException(status_code=400, detail="Cannot delete folder that contains files")
+    pattern = f"{agency_code}_{folder_type}_"
+    files = await get_storage().alist_files(f"uploads/{folder_type}/")
+    if any(f["filename"].startswith(pattern) for f in files):
+        raise HTTPException(status_code=400, detail="Cannot delete folder that contains files")
     
     # Remove from agency document
     await agencies_collection.update_one(
@@ -1,12 +1,17 @@
+import io
 import os
-import boto3
+import asyncio
+from functools import partial
 from botocore.exceptions import ClientError, NoCredentialsError
 from fastapi import HTTPException
-from typing import Optional, Dict, Any
+from typing import AsyncIterator, Optional, Dict, Any
 import mimetypes
 from datetime import datetime, timezone
 import uuid
 
+from s3_storage import S3_ENDPOINT_URL, create_s3_client, create_transfer_config, get_s3_executor, iter_object_pages
+from storage import aiter_listing
+
 class S3Service:
     def __init__(self):
         """Initialize S3 service with environment variables"""
@@ -18,14 +23,10 @@ class S3Service:
         if not all([self.aws_access_key_id, self.aws_secret_access_key, self.bucket_name]):
             raise ValueError("Missing required AWS environment variables: AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, S3_BUCKET_NAME")
         
-        # Initialize S3 client
+        # Initialize S3 client (pooled connections, shared with the S3 storage backend settings)
         try:
-            self.s3_client = boto3.client(
-                's3',
-                aws_access_key_id=self.aws_access_key_id,
-                aws_secret_access_key=self.aws_secret_access_key,
-                region_name=self.aws_region
-            )
+            self.s3_client = create_s3_client()
+            self.transfer_config = create_transfer_config()
             
             # Test connection by checking if bucket exists
             self.s3_client.head_bucket(Bucket=self.bucket_name)
@@ -42,6 +43,12 @@ class S3Service:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to initialize S3 service: {str(e)}")
 
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking boto3 call on the S3 thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(
+            get_s3_executor(), partial(func, *args, **kwargs)
+        )
+
     def generate_s3_key(self, document_type: str, entity_id: str, filename: str) -> str:
         """Generate a unique S3 key for the file"""
         timestamp = int(datetime.now(timezone.utc).timestamp())
@@ -64,17 +71,21 @@ class S3Service:
                 if not content_type:
                     content_type = 'application/octet-stream'
             
-            # Upload to S3
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=s3_key,
-                Body=file_content,
-                ContentType=content_type,
-                ServerSideEncryption='AES256'
+            # Upload to S3 (multipart with parallel parts for large files)
+            await self._run(
+                self.s3_client.upload_fileobj,
+                io.BytesIO(file_content),
+                self.bucket_name,
+                s3_key,
+                ExtraArgs={'ContentType': content_type, 'ServerSideEncryption': 'AES256'},
+                Config=self.transfer_config
             )
             
             # Generate public URL
-            file_url = f"https://{self.bucket_name}.s3.{self.aws_region}.amazonaws.com/{s3_key}"
+            if S3_ENDPOINT_URL:
+                file_url = f"{S3_ENDPOINT_URL.rstrip('/')}/{self.bucket_name}/{s3_key}"
+            else:
+                file_url = f"https://{self.bucket_name}.s3.{self.aws_region}.amazonaws.com/{s3_key}"
             
             return {
                 "s3_key": s3_key,
@@ -92,7 +103,7 @@ class S3Service:
     async def delete_file(self, s3_key: str) -> bool:
         """Delete file from S3"""
         try:
-            self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_key)
+            await self._run(self.s3_client.delete_object, Bucket=self.bucket_name, Key=s3_key)
             return True
         except ClientError as e:
             if e.response['Error']['Code'] == 'NoSuchKey':
@@ -104,7 +115,7 @@ class S3Service:
     async def file_exists(self, s3_key: str) -> bool:
         """Check if file exists in S3"""
         try:
-            self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
+            await self._run(self.s3_client.head_object, Bucket=self.bucket_name, Key=s3_key)
             return True
         except ClientError as e:
             if e.response['Error']['Code'] == '404':
@@ -114,7 +125,7 @@ class S3Service:
     async def get_file_info(self, s3_key: str) -> Optional[Dict[str, Any]]:
         """Get file information from S3"""
         try:
-            response = self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
+            response = await self._run(self.s3_client.head_object, Bucket=self.bucket_name, Key=s3_key)
             return {
                 "size": response['ContentLength'],
                 "last_modified": response['LastModified'],
@@ -126,25 +137,19 @@ class S3Service:
                 return None
             raise HTTPException(status_code=500, detail=f"Error getting file info: {str(e)}")
 
-    async def list_files(self, prefix: str) -> list:
-        """List files in S3 with given prefix"""
+    def iter_files(self, prefix: str, delimiter: Optional[str] = None, concurrency: int = 1) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield files under prefix lazily, following continuation tokens. With a
+        delimiter, "directories" are yielded as entries with is_dir=True; with
+        concurrency > 1 sub-prefixes are listed in parallel (see storage.aiter_listing).
+        """
+        list_pages = partial(iter_object_pages, self.s3_client, self.bucket_name)
+        return aiter_listing(list_pages, get_s3_executor(), prefix, delimiter, concurrency)
+
+    async def list_files(self, prefix: str, delimiter: Optional[str] = None, concurrency: int = 1) -> list:
+        """List all files in S3 with given prefix"""
         try:
-            response = self.s3_client.list_objects_v2(
-                Bucket=self.bucket_name,
-                Prefix=prefix
-            )
-            
-            files = []
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    files.append({
-                        "key": obj['Key'],
-                        "size": obj['Size'],
-                        "last_modified": obj['LastModified'],
-                        "filename": os.path.basename(obj['Key'])
-                    })
-            
-            return files
+            return [entry async for entry in self.iter_files(prefix, delimiter, concurrency)]
         except ClientError as e:
             raise HTTPException(status_code=500, detail=f"Error listing files: {str(e)}")
 
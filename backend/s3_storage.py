@@ -0,0 +1,238 @@
+"""
+S3 Storage Backend
+
+StorageBackend implementation for an S3 bucket (STORAGE_BACKEND=s3). Keys are
+the same relative paths used on local disk (uploads/...), so documents keep
+their file_path and are still served through /api/files/serve/<key>.
+
+Uses the same AWS settings as s3_service: S3_BUCKET_NAME, AWS_REGION and
+AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY (or any credential source boto3
+finds on its own, e.g. an instance role). S3_ENDPOINT_URL points both at an
+S3-compatible server instead (MinIO, or moto server for tests).
+
+boto3 is blocking, so the async API runs every S3 call on a dedicated thread
+pool sized to the client's connection pool; S3 latency never blocks the event
+loop or the local-disk storage threads. Uploads above S3_MULTIPART_THRESHOLD
+are sent as multipart uploads with parts uploaded in parallel, and downloads
+are streamed from the response body in chunks.
+"""
+
+import os
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from storage import HashingReader, StorageBackend, UPLOAD_CHUNK_SIZE, directory_entry, upload_result
+
+# Load environment variables from .env file
+load_dotenv()
+
+# S3-compatible endpoint (e.g. http://localhost:9000 for MinIO); unset for AWS
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+# Address buckets by path (http://host/bucket/key), as MinIO and moto server expect
+S3_FORCE_PATH_STYLE = os.getenv("S3_FORCE_PATH_STYLE", "false").lower() in ("1", "true", "yes")
+# HTTP connections kept open to S3; also the number of threads doing S3 calls
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+# Uploads larger than this are split into parts of S3_MULTIPART_CHUNK_SIZE bytes,
+# up to S3_MULTIPART_CONCURRENCY parts in flight per upload
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNK_SIZE = int(os.getenv("S3_MULTIPART_CHUNK_SIZE", str(8 * 1024 * 1024)))
+S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY", "4"))
+
+# delete_objects accepts at most 1000 keys per request
+_DELETE_BATCH_SIZE = 1000
+# Keys per list_objects_v2 page (S3 returns at most 1000)
+S3_LIST_PAGE_SIZE = int(os.getenv("S3_LIST_PAGE_SIZE", "1000"))
+
+_s3_executor: Optional[ThreadPoolExecutor] = None
+_s3_executor_lock = threading.Lock()
+
+
+def get_s3_executor() -> ThreadPoolExecutor:
+    """Get or create the thread pool that runs blocking boto3 calls for async code"""
+    global _s3_executor
+    if _s3_executor is None:
+        with _s3_executor_lock:
+            if _s3_executor is None:
+                _s3_executor = ThreadPoolExecutor(
+                    max_workers=max(1, S3_MAX_POOL_CONNECTIONS),
+                    thread_name_prefix="s3-io"
+                )
+    return _s3_executor
+
+
+def create_s3_client():
+    """
+    boto3 S3 client with a connection pool large enough for the S3 threads and
+    parallel multipart parts. boto3 clients are thread safe, so one is shared.
+    """
+    config = Config(
+        max_pool_connections=max(S3_MAX_POOL_CONNECTIONS, S3_MULTIPART_CONCURRENCY),
+        retries={"max_attempts": 5, "mode": "adaptive"},
+        s3={"addressing_style": "path"} if S3_FORCE_PATH_STYLE else None,
+    )
+    return boto3.client(
+        "s3",
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=os.getenv("AWS_REGION", "us-east-1"),
+        endpoint_url=S3_ENDPOINT_URL,
+        config=config,
+    )
+
+
+def create_transfer_config() -> TransferConfig:
+    """Multipart settings for upload_fileobj / copy"""
+    return TransferConfig(
+        multipart_threshold=S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=S3_MULTIPART_CHUNK_SIZE,
+        max_concurrency=max(1, S3_MULTIPART_CONCURRENCY),
+        use_threads=S3_MULTIPART_CONCURRENCY > 1,
+    )
+
+
+def iter_object_pages(
+    s3_client, bucket_name: str, prefix: str, delimiter: Optional[str] = None, page_size: int = S3_LIST_PAGE_SIZE
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    List keys starting with prefix page by page, following continuation tokens
+    (blocking). With a delimiter, common prefixes are returned as
+    {key, filename, is_dir: True} entries.
+    """
+    params = {"Bucket": bucket_name, "Prefix": prefix, "MaxKeys": page_size}
+    if delimiter:
+        params["Delimiter"] = delimiter
+    while True:
+        response = s3_client.list_objects_v2(**params)
+        page = [
+            {
+                "key": obj["Key"],
+                "filename": obj["Key"].rsplit("/", 1)[-1],
+                "size": obj["Size"],
+                "last_modified": obj["LastModified"],
+                "is_dir": False,
+            }
+            for obj in response.get("Contents", [])
+        ]
+        page.extend(directory_entry(common["Prefix"]) for common in response.get("CommonPrefixes", []))
+        if page:
+            yield page
+        if not response.get("IsTruncated"):
+            break
+        params["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def _is_missing(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+class S3StorageBackend(StorageBackend):
+    name = "s3"
+
+    def __init__(self):
+        self.bucket_name = os.getenv("S3_BUCKET_NAME")
+        if not self.bucket_name:
+            raise ValueError("STORAGE_BACKEND=s3 requires S3_BUCKET_NAME")
+        self.s3_client = create_s3_client()
+        self.transfer_config = create_transfer_config()
+
+    def executor(self):
+        return get_s3_executor()
+
+    def save_file_stream(self, key, stream, content_type=None, chunk_size=UPLOAD_CHUNK_SIZE):
+        content_type = content_type or mimetypes.guess_type(key)[0] or "application/octet-stream"
+        # HashingReader is not seekable, so upload_fileobj reads it front to back
+        # (hashing as it goes) and only buffers the parts currently uploading
+        reader = HashingReader(stream)
+        self.s3_client.upload_fileobj(
+            reader,
+            self.bucket_name,
+            key,
+            ExtraArgs={"ContentType": content_type, "ServerSideEncryption": "AES256"},
+            Config=self.transfer_config,
+        )
+        return upload_result(key, reader.size, reader.hexdigest())
+
+    def iter_file(self, key, start=0, end=None, chunk_size=UPLOAD_CHUNK_SIZE):
+        params = {"Bucket": self.bucket_name, "Key": key}
+        if start or end is not None:
+            if end is not None and end <= start:
+                return
+            params["Range"] = f"bytes={start}-{'' if end is None else end - 1}"
+        try:
+            response = self.s3_client.get_object(**params)
+        except ClientError as e:
+            if _is_missing(e):
+                raise FileNotFoundError(f"File not found: {key}") from e
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":
+                return
+            raise
+        body = response["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def file_info(self, key):
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if _is_missing(e):
+                return None
+            raise
+        return {
+            "key": key,
+            "filename": key.rsplit("/", 1)[-1],
+            "size": response["ContentLength"],
+            "last_modified": response["LastModified"],
+            "content_type": response.get("ContentType"),
+        }
+
+    def _delete(self, key):
+        existed = self.file_exists(key)
+        self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+        return existed
+
+    def delete_files(self, keys: Iterable[str], invalidate_cache: bool = True) -> int:
+        keys = list(dict.fromkeys(keys))
+        if invalidate_cache:
+            for key in keys:
+                self.invalidate_cached_text(key)
+        deleted = 0
+        for offset in range(0, len(keys), _DELETE_BATCH_SIZE):
+            batch = keys[offset:offset + _DELETE_BATCH_SIZE]
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": False},
+            )
+            deleted += len(response.get("Deleted", []))
+            for error in response.get("Errors", []):
+                print(f"Could not delete {error.get('Key')} from S3: {error.get('Message')}")
+        return deleted
+
+    def move_file(self, source_key, target_key):
+        try:
+            self.s3_client.copy(
+                {"Bucket": self.bucket_name, "Key": source_key}, self.bucket_name, target_key,
+                ExtraArgs={"ServerSideEncryption": "AES256"},
+                Config=self.transfer_config,
+            )
+        except ClientError as e:
+            if _is_missing(e):
+                raise FileNotFoundError(f"File not found: {source_key}") from e
+            raise
+        self.s3_client.delete_object(Bucket=self.bucket_name, Key=source_key)
+
+    def iter_file_pages(self, prefix, delimiter=None):
+        return iter_object_pages(self.s3_client, self.bucket_name, prefix, delimiter)
+
+    def list_files(self, prefix):
+        prefix = prefix.rstrip("/") + "/"
+        return [entry for page in self.iter_file_pages(prefix) for entry in page]
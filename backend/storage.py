@@ -0,0 +1,513 @@
+"""
+Storage Backends
+
+One interface for every place that stores or reads uploaded files, selected
+with STORAGE_BACKEND:
+
+- "local" (default): files under backend/uploads/ (see local_storage)
+- "s3": an S3-compatible bucket (see s3_storage)
+- "memory": a process-local dict, for tests and benchmarks
+
+Keys are the relative paths stored on documents (e.g. uploads/blobs/ab/<sha256>),
+so switching backends does not change any stored document. Every backend
+implements blocking primitives for the extraction worker threads; route handlers
+use the a* variants, which run the same primitives on the storage thread pool.
+Large listings are consumed lazily with aiter_files, optionally sharded by
+"directory" and listed in parallel.
+"""
+
+import io
+import os
+import re
+import time
+import asyncio
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+import local_storage
+from local_storage import UPLOAD_CHUNK_SIZE
+
+# Load environment variables from .env file
+load_dotenv()
+
+# local | s3 | memory
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+# Threads doing storage I/O for the async API
+STORAGE_IO_WORKERS = int(os.getenv("STORAGE_IO_WORKERS", "8"))
+
+# Parsed text is only cached for these file types (see extraction_cache)
+TEXT_CACHED_EXTENSIONS = (".pdf", ".xlsx", ".xls")
+_SHA256_NAME = re.compile(r"[0-9a-f]{64}")
+
+_io_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_storage_executor() -> ThreadPoolExecutor:
+    """Get or create the thread pool used by the async storage API"""
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(
+            max_workers=max(1, STORAGE_IO_WORKERS),
+            thread_name_prefix="storage-io"
+        )
+    return _io_executor
+
+
+class HashingReader:
+    """File object wrapper that counts and hashes the bytes read through it"""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.stream.read(size)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+    def hexdigest(self) -> str:
+        return self.digest.hexdigest()
+
+
+def upload_result(key: str, size: int, sha256: str) -> Dict[str, Any]:
+    """Result of a save, in the shape the routes have always returned"""
+    return {
+        "s3_key": key,
+        "file_path": key,
+        "file_url": f"/api/files/serve/{key}",
+        "size": size,
+        "sha256": sha256,
+    }
+
+
+def group_listing(entries: List[Dict[str, Any]], prefix: str, delimiter: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Turn a flat list of files under prefix into listing entries, sorted by key.
+    With a delimiter, files below the next delimiter are collapsed into one
+    {key, filename, is_dir: True} entry per "directory", as S3 does.
+    """
+    files: List[Dict[str, Any]] = []
+    directories = set()
+    for entry in entries:
+        rest = entry["key"][len(prefix):]
+        if delimiter and delimiter in rest:
+            directories.add(prefix + rest.split(delimiter, 1)[0] + delimiter)
+        else:
+            files.append({**entry, "is_dir": False})
+    files.extend(directory_entry(key) for key in directories)
+    return sorted(files, key=lambda entry: entry["key"])
+
+
+def directory_entry(key: str) -> Dict[str, Any]:
+    return {"key": key, "filename": key.rstrip("/").rsplit("/", 1)[-1], "is_dir": True}
+
+
+async def aiter_in_executor(executor: ThreadPoolExecutor, items: Iterator[Any]) -> AsyncIterator[Any]:
+    """Iterate a blocking generator (file chunks, listing pages) on executor, one item per hop"""
+    loop = asyncio.get_running_loop()
+    sentinel = object()
+    try:
+        while True:
+            item = await loop.run_in_executor(executor, next, items, sentinel)
+            if item is sentinel:
+                break
+            yield item
+    finally:
+        try:
+            await loop.run_in_executor(executor, items.close)
+        except ValueError:
+            # Cancelled while a step was still running in the executor; the
+            # generator is closed when it is garbage collected
+            pass
+
+
+async def aiter_listing(
+    list_pages: Callable[[str, Optional[str]], Iterator[List[Dict[str, Any]]]],
+    executor: ThreadPoolExecutor,
+    prefix: str,
+    delimiter: Optional[str] = None,
+    concurrency: int = 1,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield listing entries lazily, page by page. list_pages(prefix, delimiter)
+    is a blocking generator of entry pages.
+
+    With concurrency > 1 (and no delimiter) the listing is sharded: the top
+    level under prefix is listed with "/" as delimiter, then every
+    sub-"directory" is listed in full, up to concurrency at a time. Entries of
+    different shards are yielded as their pages arrive, so the order is only
+    sorted within a shard.
+    """
+    if concurrency <= 1 or delimiter:
+        async for page in aiter_in_executor(executor, list_pages(prefix, delimiter)):
+            for entry in page:
+                yield entry
+        return
+
+    shards: List[str] = []
+    async for page in aiter_in_executor(executor, list_pages(prefix, "/")):
+        for entry in page:
+            if entry["is_dir"]:
+                shards.append(entry["key"])
+            else:
+                yield entry
+    if not shards:
+        return
+
+    # Bounded so a slow consumer holds back the listing instead of buffering it all
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    semaphore = asyncio.Semaphore(concurrency)
+    done = object()
+
+    async def list_shard(shard: str) -> None:
+        try:
+            async with semaphore:
+                async for shard_page in aiter_in_executor(executor, list_pages(shard, None)):
+                    await queue.put(shard_page)
+            await queue.put(done)
+        except Exception as e:
+            await queue.put(e)
+
+    tasks = [asyncio.create_task(list_shard(shard)) for shard in shards]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item = await queue.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                for entry in item:
+                    yield entry
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class StorageBackend(ABC):
+    """
+    Base class of the storage backends. Subclasses implement the blocking
+    primitives; ranges are [start, end) byte offsets, end=None meaning the end
+    of the file.
+    """
+
+    name = "base"
+
+    # Blocking primitives
+    @abstractmethod
+    def save_file_stream(
+        self, key: str, stream: BinaryIO, content_type: Optional[str] = None, chunk_size: int = UPLOAD_CHUNK_SIZE
+    ) -> Dict[str, Any]:
+        """Store a file object chunk by chunk; returns the upload result with size and SHA-256"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_file(
+        self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = UPLOAD_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        """Yield the bytes of a file (or a range of it) in chunks; FileNotFoundError if missing"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def file_info(self, key: str) -> Optional[Dict[str, Any]]:
+        """{key, filename, size, last_modified, content_type} or None if the file does not exist"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def _delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def move_file(self, source_key: str, target_key: str) -> None:
+        """Move a file to another key, replacing any file there"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_files(self, prefix: str) -> List[Dict[str, Any]]:
+        """Files under prefix as {key, filename, size, last_modified}"""
+        raise NotImplementedError
+
+    def iter_file_pages(self, prefix: str, delimiter: Optional[str] = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Listing entries for keys starting with prefix (a plain string prefix, not
+        only a directory), in pages. Entries are files ({key, filename, size,
+        last_modified, is_dir: False}) and, with a delimiter, "directories"
+        ({key, filename, is_dir: True}). Backends with paged listings override this.
+        """
+        directory = prefix.rsplit("/", 1)[0] if "/" in prefix else prefix
+        entries = [entry for entry in self.list_files(directory) if entry["key"].startswith(prefix)]
+        yield group_listing(entries, prefix, delimiter)
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Path on local disk if the backend has one (lets routes use FileResponse)"""
+        return None
+
+    # Derived operations
+    def save_file(self, key: str, content: bytes, content_type: Optional[str] = None) -> Dict[str, Any]:
+        return self.save_file_stream(key, io.BytesIO(content), content_type)
+
+    def read_file(self, key: str) -> bytes:
+        return b"".join(self.iter_file(key))
+
+    def read_range(self, key: str, start: int, end: Optional[int] = None) -> bytes:
+        return b"".join(self.iter_file(key, start, end))
+
+    def file_exists(self, key: str) -> bool:
+        return self.file_info(key) is not None
+
+    def file_sha256(self, key: str) -> str:
+        digest = hashlib.sha256()
+        for chunk in self.iter_file(key):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def delete_file(self, key: str, invalidate_cache: bool = True) -> bool:
+        """Delete a file (and the text cached for it). Returns True if it existed."""
+        if invalidate_cache:
+            self.invalidate_cached_text(key)
+        return self._delete(key)
+
+    def delete_files(self, keys: Iterable[str], invalidate_cache: bool = True) -> int:
+        """Delete many files, batched where the backend supports it; returns how many were deleted"""
+        return sum(1 for key in keys if self.delete_file(key, invalidate_cache))
+
+    def invalidate_cached_text(self, key: str) -> None:
+        """Drop text/rows the AI processor cached for this file (see extraction_cache)"""
+        name = key.rsplit("/", 1)[-1]
+        try:
+            if _SHA256_NAME.fullmatch(name):
+                # Blobs are named by their hash
+                digest = name
+            elif os.path.splitext(name)[1].lower() in TEXT_CACHED_EXTENSIONS and self.file_exists(key):
+                digest = self.file_sha256(key)
+            else:
+                return
+            from extraction_cache import invalidate_document
+            invalidate_document(digest)
+        except Exception as e:
+            print(f"Could not invalidate cached text for {key}: {e}")
+
+    # Async API
+    def executor(self) -> ThreadPoolExecutor:
+        """Thread pool the async API runs the blocking primitives on"""
+        return get_storage_executor()
+
+    async def _offload(self, func: Callable, *args, **kwargs) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor(), partial(func, *args, **kwargs)
+        )
+
+    async def asave_file_stream(
+        self, key: str, stream: BinaryIO, content_type: Optional[str] = None, chunk_size: int = UPLOAD_CHUNK_SIZE
+    ) -> Dict[str, Any]:
+        """Async save_file_stream (stream is a blocking file object, e.g. UploadFile.file)"""
+        return await self._offload(self.save_file_stream, key, stream, content_type, chunk_size)
+
+    async def asave_file(self, key: str, content: bytes, content_type: Optional[str] = None) -> Dict[str, Any]:
+        return await self._offload(self.save_file, key, content, content_type)
+
+    async def aread_file(self, key: str) -> bytes:
+        return await self._offload(self.read_file, key)
+
+    async def aread_range(self, key: str, start: int, end: Optional[int] = None) -> bytes:
+        return await self._offload(self.read_range, key, start, end)
+
+    async def aiter_file(
+        self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = UPLOAD_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """Stream a file (or a range of it) without blocking the event loop"""
+        async for chunk in aiter_in_executor(self.executor(), self.iter_file(key, start, end, chunk_size)):
+            yield chunk
+
+    async def afile_info(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self._offload(self.file_info, key)
+
+    async def afile_exists(self, key: str) -> bool:
+        return await self._offload(self.file_exists, key)
+
+    async def afile_sha256(self, key: str) -> str:
+        return await self._offload(self.file_sha256, key)
+
+    async def adelete_file(self, key: str, invalidate_cache: bool = True) -> bool:
+        return await self._offload(self.delete_file, key, invalidate_cache)
+
+    async def adelete_files(self, keys: Iterable[str], invalidate_cache: bool = True) -> int:
+        return await self._offload(self.delete_files, list(keys), invalidate_cache)
+
+    async def amove_file(self, source_key: str, target_key: str) -> None:
+        await self._offload(self.move_file, source_key, target_key)
+
+    async def alist_files(self, prefix: str) -> List[Dict[str, Any]]:
+        return await self._offload(self.list_files, prefix)
+
+    def aiter_files(
+        self, prefix: str, delimiter: Optional[str] = None, concurrency: int = 1
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield listing entries lazily (see iter_file_pages and aiter_listing)"""
+        return aiter_listing(self.iter_file_pages, self.executor(), prefix, delimiter, concurrency)
+
+
+class LocalStorageBackend(StorageBackend):
+    """Files under backend/uploads/, written atomically (see local_storage)"""
+
+    name = "local"
+
+    def save_file_stream(self, key, stream, content_type=None, chunk_size=UPLOAD_CHUNK_SIZE):
+        return local_storage.save_file_stream(key, stream, content_type, chunk_size)
+
+    def iter_file(self, key, start=0, end=None, chunk_size=UPLOAD_CHUNK_SIZE):
+        full_path = local_storage.get_local_path(key)
+        if not full_path.is_file():
+            raise FileNotFoundError(f"File not found: {key}")
+        with open(full_path, "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else max(0, end - start)
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def read_file(self, key):
+        return local_storage.read_file(key)
+
+    def file_info(self, key):
+        full_path = local_storage.get_local_path(key)
+        try:
+            stat = full_path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not full_path.is_file():
+            return None
+        return {
+            "key": key,
+            "filename": full_path.name,
+            "size": stat.st_size,
+            "last_modified": local_storage.datetime_from_timestamp(stat.st_mtime),
+            "content_type": None,
+        }
+
+    def file_exists(self, key):
+        return local_storage.file_exists(key)
+
+    def file_sha256(self, key):
+        return local_storage.file_sha256(key)
+
+    def _delete(self, key):
+        return local_storage.delete_file(key, invalidate_cache=False)
+
+    def move_file(self, source_key, target_key):
+        local_storage.move_file(source_key, target_key)
+
+    def list_files(self, prefix):
+        return local_storage.list_files(prefix)
+
+    def local_path(self, key):
+        return local_storage.get_local_path(key)
+
+
+class MemoryStorageBackend(StorageBackend):
+    """Files kept in process memory; for tests and storage-free benchmarks"""
+
+    name = "memory"
+
+    def __init__(self):
+        # key -> (content, content type, modified timestamp)
+        self._files: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def save_file_stream(self, key, stream, content_type=None, chunk_size=UPLOAD_CHUNK_SIZE):
+        reader = HashingReader(stream)
+        content = b"".join(iter(lambda: reader.read(chunk_size), b""))
+        with self._lock:
+            self._files[key] = (content, content_type, time.time())
+        return upload_result(key, reader.size, reader.hexdigest())
+
+    def _get(self, key: str) -> tuple:
+        with self._lock:
+            entry = self._files.get(key)
+        if entry is None:
+            raise FileNotFoundError(f"File not found: {key}")
+        return entry
+
+    def iter_file(self, key, start=0, end=None, chunk_size=UPLOAD_CHUNK_SIZE):
+        content = self._get(key)[0]
+        view = memoryview(content)[start:end]
+        for offset in range(0, len(view), chunk_size):
+            yield bytes(view[offset:offset + chunk_size])
+
+    def read_file(self, key):
+        return self._get(key)[0]
+
+    def file_info(self, key):
+        with self._lock:
+            entry = self._files.get(key)
+        if entry is None:
+            return None
+        content, content_type, modified = entry
+        return {
+            "key": key,
+            "filename": key.rsplit("/", 1)[-1],
+            "size": len(content),
+            "last_modified": datetime.utcfromtimestamp(modified),
+            "content_type": content_type,
+        }
+
+    def _delete(self, key):
+        with self._lock:
+            return self._files.pop(key, None) is not None
+
+    def move_file(self, source_key, target_key):
+        with self._lock:
+            if source_key not in self._files:
+                raise FileNotFoundError(f"File not found: {source_key}")
+            self._files[target_key] = self._files.pop(source_key)
+
+    def list_files(self, prefix):
+        prefix = prefix.rstrip("/") + "/"
+        with self._lock:
+            keys = sorted(key for key in self._files if key.startswith(prefix))
+        return [info for info in (self.file_info(key) for key in keys) if info]
+
+
+def _create_s3_backend() -> StorageBackend:
+    from s3_storage import S3StorageBackend
+    return S3StorageBackend()
+
+
+STORAGE_BACKENDS: Dict[str, Callable[[], StorageBackend]] = {
+    "local": LocalStorageBackend,
+    "memory": MemoryStorageBackend,
+    "s3": _create_s3_backend,
+}
+
+# Global storage backend instance (extraction threads may race to create it)
+storage_backend = None
+_storage_lock = threading.Lock()
+
+def get_storage() -> StorageBackend:
+    """Get or create the configured storage backend instance"""
+    global storage_backend
+    if storage_backend is None:
+        with _storage_lock:
+            if storage_backend is None:
+                if STORAGE_BACKEND not in STORAGE_BACKENDS:
+                    raise ValueError(
+                        f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}'; expected one of {', '.join(STORAGE_BACKENDS)}"
+                    )
+                storage_backend = STORAGE_BACKENDS[STORAGE_BACKEND]()
+    return storage_backend
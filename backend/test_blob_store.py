@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Test script for the content-addressed blob store (deduplication and reference
+counting). Files go to the in-memory storage backend and the Mongo blobs
+collection is replaced by a small in-memory stand-in, so no database is needed:
+
+    python test_blob_store.py
+"""
+
+import io
+import os
+import sys
+import asyncio
+import hashlib
+
+os.environ["STORAGE_BACKEND"] = "memory"
+
+import blob_store
+from storage import get_storage
+
+CONTENT = b"%PDF-1.4 media plan approved quotation"
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+class DeleteResult:
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
+
+
+def matches(document, query):
+    for field, condition in query.items():
+        value = document.get(field)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq" and value != operand:
+                return False
+            if operator == "$ne" and value == operand:
+                return False
+            if operator == "$lte" and not (value is not None and value <= operand):
+                return False
+    return True
+
+
+class FakeBlobsCollection:
+    """The subset of the Motor collection API used by blob_store, kept in a dict"""
+
+    def __init__(self):
+        self.documents = {}
+        # Called before the deleting mark is set, to simulate another process adding a reference
+        self.before_claim = None
+
+    def _find(self, query):
+        document = self.documents.get(query["_id"])
+        return document if document is not None and matches(document, query) else None
+
+    async def find_one(self, query, projection=None):
+        document = self._find(query)
+        return dict(document) if document is not None else None
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=False):
+        if "deleting" in query and self.before_claim:
+            self.before_claim()
+        document = self._find(query)
+        if document is None:
+            if not upsert:
+                return None
+            document = {"_id": query["_id"], **update.get("$setOnInsert", {})}
+            self.documents[query["_id"]] = document
+        before = dict(document)
+        self._apply(document, update)
+        return dict(document) if return_document else before
+
+    async def update_one(self, query, update):
+        document = self._find(query)
+        if document is not None:
+            self._apply(document, update)
+
+    async def delete_one(self, query):
+        if self._find(query) is None:
+            return DeleteResult(0)
+        del self.documents[query["_id"]]
+        return DeleteResult(1)
+
+    @staticmethod
+    def _apply(document, update):
+        for field, amount in update.get("$inc", {}).items():
+            document[field] = document.get(field, 0) + amount
+        document.update(update.get("$set", {}))
+        for field in update.get("$unset", {}):
+            document.pop(field, None)
+
+
+def setup():
+    blobs = FakeBlobsCollection()
+    blob_store.blobs_collection = blobs
+    storage = get_storage()
+    storage._files.clear()
+    return blobs, storage
+
+
+def staged_files(storage):
+    return [key for key in storage._files if key.startswith(blob_store._STAGING_DIR)]
+
+
+async def test_dedupe_and_release():
+    """The same content is stored once; the file goes with the last reference"""
+    blobs, storage = setup()
+    first = await blob_store.store_blob(io.BytesIO(CONTENT), "application/pdf")
+    second = await blob_store.store_blob(io.BytesIO(CONTENT), "application/pdf")
+
+    assert first["file_path"] == second["file_path"] == blob_store.blob_path(CONTENT_HASH)
+    assert (first["deduplicated"], second["deduplicated"]) == (False, True)
+    assert blobs.documents[CONTENT_HASH]["refcount"] == 2
+    assert storage.read_file(first["file_path"]) == CONTENT and not staged_files(storage)
+
+    assert await blob_store.release_blob(CONTENT_HASH) is False
+    assert storage.file_exists(first["file_path"])
+    assert await blob_store.release_blob(CONTENT_HASH) is True
+    assert not storage.file_exists(first["file_path"]) and CONTENT_HASH not in blobs.documents
+    assert await blob_store.release_blob(CONTENT_HASH) is False
+    print("✓ Dedupe: two uploads, one file, deleted with the last reference")
+
+
+async def test_concurrent_uploads():
+    """Concurrent uploads of the same content count every reference"""
+    blobs, storage = setup()
+    results = await asyncio.gather(*(blob_store.store_blob(io.BytesIO(CONTENT)) for _ in range(10)))
+    assert blobs.documents[CONTENT_HASH]["refcount"] == 10
+    assert sum(not result["deduplicated"] for result in results) == 1
+    assert not staged_files(storage)
+    print("✓ Concurrent uploads: 10 references, 1 file stored")
+
+
+async def test_failed_move_takes_reference_back():
+    """A failed move leaves no reference, record or staged file behind"""
+    blobs, storage = setup()
+    move_file = storage.move_file
+
+    def failing_move(source_key, target_key):
+        raise OSError("disk full")
+
+    storage.move_file = failing_move
+    try:
+        await blob_store.store_blob(io.BytesIO(CONTENT))
+        raise AssertionError("store_blob should raise when the move fails")
+    except OSError:
+        pass
+    finally:
+        storage.move_file = move_file
+    assert CONTENT_HASH not in blobs.documents, blobs.documents
+    assert not staged_files(storage)
+
+    # An existing reference is kept when a later upload of the same content fails
+    await blob_store.store_blob(io.BytesIO(CONTENT))
+    storage.delete_file(blob_store.blob_path(CONTENT_HASH))
+    storage.move_file = failing_move
+    try:
+        await blob_store.store_blob(io.BytesIO(CONTENT))
+        raise AssertionError("store_blob should raise when the move fails")
+    except OSError:
+        pass
+    finally:
+        storage.move_file = move_file
+    assert blobs.documents[CONTENT_HASH]["refcount"] == 1
+    print("✓ Failed move: reference count restored, staged upload removed")
+
+
+async def test_release_keeps_rereferenced_file():
+    """The file stays when another reference is added before the record is deleted"""
+    blobs, storage = setup()
+    stored = await blob_store.store_blob(io.BytesIO(CONTENT))
+
+    def add_reference():
+        blobs.documents[CONTENT_HASH]["refcount"] += 1
+
+    blobs.before_claim = add_reference
+    assert await blob_store.release_blob(CONTENT_HASH) is False
+    assert storage.file_exists(stored["file_path"])
+    assert blobs.documents[CONTENT_HASH]["refcount"] == 1 and "deleting" not in blobs.documents[CONTENT_HASH]
+    print("✓ Release racing a new reference keeps the file")
+
+
+async def test_upload_during_delete_in_other_process():
+    """An upload waits for another process's delete, then puts the file back"""
+    blobs, storage = setup()
+    await blob_store.store_blob(io.BytesIO(CONTENT))
+    # Another process dropped the last reference and marked the blob as deleting
+    blobs.documents[CONTENT_HASH].update(refcount=0, deleting=True)
+
+    upload = asyncio.create_task(blob_store.store_blob(io.BytesIO(CONTENT)))
+    await asyncio.sleep(blob_store._DELETE_POLL_SECONDS * 3)
+    assert not upload.done(), "the upload should wait for the delete"
+
+    # The other process deletes the file and finishes; the new reference keeps the record
+    storage.delete_file(blob_store.blob_path(CONTENT_HASH))
+    assert await blob_store._finish_delete(CONTENT_HASH) is False
+    stored = await upload
+
+    assert stored["deduplicated"] is False and storage.read_file(stored["file_path"]) == CONTENT
+    assert blobs.documents[CONTENT_HASH]["refcount"] == 1 and "deleting" not in blobs.documents[CONTENT_HASH]
+    assert not staged_files(storage)
+    print("✓ Upload during another process's delete: waits, then stores the file again")
+
+
+async def test_stale_deleting_mark_taken_over():
+    """A deleting mark left by a process that died is cleared by the next upload"""
+    blobs, storage = setup()
+    blobs.documents[CONTENT_HASH] = {"_id": CONTENT_HASH, "refcount": 0, "deleting": True}
+    wait_seconds = blob_store._DELETE_WAIT_SECONDS
+    blob_store._DELETE_WAIT_SECONDS = blob_store._DELETE_POLL_SECONDS * 2
+    try:
+        stored = await blob_store.store_blob(io.BytesIO(CONTENT))
+    finally:
+        blob_store._DELETE_WAIT_SECONDS = wait_seconds
+    assert storage.read_file(stored["file_path"]) == CONTENT
+    assert blobs.documents[CONTENT_HASH]["refcount"] == 1 and "deleting" not in blobs.documents[CONTENT_HASH]
+    print("✓ Stale deleting mark: the upload takes over and stores the file")
+
+
+async def run_all_tests():
+    """Run all blob store tests"""
+    print("=" * 60)
+    print("Blob Store Test Suite")
+    print("=" * 60)
+
+    tests = [
+        test_dedupe_and_release,
+        test_concurrent_uploads,
+        test_failed_move_takes_reference_back,
+        test_release_keeps_rereferenced_file,
+        test_upload_during_delete_in_other_process,
+        test_stale_deleting_mark_taken_over,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            await test()
+        except Exception as e:
+            failed += 1
+            print(f"✗ {test.__name__} failed: {type(e).__name__}: {e}")
+
+    print("\n" + "=" * 60)
+    if failed:
+        print(f"❌ {failed} of {len(tests)} blob store tests failed.")
+    else:
+        print("✅ All blob store tests passed!")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(run_all_tests()) else 1)
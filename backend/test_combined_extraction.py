@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Test script for the combined job extraction (one LLM call per job) and its
+per-section fallback. Documents are kept in the in-memory storage backend and
+the LLM is the stub provider, so no database, API key or network is needed:
+
+    python test_combined_extraction.py
+"""
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+os.environ.update({
+    "STORAGE_BACKEND": "memory",
+    "LLM_PROVIDER": "stub",
+    "LLM_STUB_LATENCY": "0",
+    "EXTRACTION_CACHE_ENABLED": "false",
+    "OCR_ENABLED": "false",
+})
+
+import openpyxl
+from reportlab.pdfgen import canvas
+
+import llm_providers
+from ai_processor import PDF_TEXT_BUDGETS
+from extraction_cache import llm_cache
+from storage import get_storage
+from combined_extraction import extract_job_details_combined
+
+FAST_PATH_INVOICE = """\
+Horizon Media Agency
+Invoice No: HMA-2025-{number}
+Project Code: PR25 | 1042 - {percentage}
+Campaign Name: Ramadan Brand Awareness 2025
+Sub Total SAR 100,000.00
+VAT 15% SAR 15,000.00
+Total Amount (Incl. VAT) SAR 115,000.00
+"""
+
+# No subtotal / VAT to confirm the total, so the fast path leaves it to the LLM
+LLM_INVOICE = """\
+Horizon Media Agency
+Invoice No: HMA-2025-0190
+Campaign Name: Ramadan Brand Awareness 2025
+Total SAR 57,500.00
+"""
+
+JOB_ORDER = "Job Order: PO-102926-2025\nTotal: 287,500.00"
+
+MEDIA_PLAN_ROWS = [
+    ["Client:", "Almarai", None, None],
+    ["Period:", "March 2025", None, None],
+    [None, None, None, None],
+    ["Total Budget by Platform", "Total", "Fee %", "Fee SAR"],
+    ["Television", 60000, 0.1, 6000],
+    ["Digital-Social/biddable Platforms", 40000, 0.1, 4000],
+    ["VAT 15%", None, None, 16500],
+    ["Total Payable", None, None, 126500],
+]
+
+
+class RecordingStubProvider(llm_providers.StubProvider):
+    """Stub provider that records its calls and can drop sections (or section fields) of the combined response"""
+
+    def __init__(self, drop=(), broken=False):
+        super().__init__(latency=0)
+        self.drop = drop
+        self.broken = broken
+        self.calls = []
+
+    def build_response(self, prompt, schema):
+        sections = sorted(schema.get("properties", {}))
+        combined = "invoices" in sections or "job_order" in sections
+        self.calls.append("combined" if combined else ",".join(sections))
+        response = super().build_response(prompt, schema)
+        if combined and self.broken:
+            return ["not", "an", "object"]
+        if combined:
+            for section in self.drop:
+                section, _, field = section.partition(".")
+                if field:
+                    response[section].pop(field, None)
+                else:
+                    response.pop(section, None)
+        return response
+
+
+def pdf(text):
+    buffer = io.BytesIO()
+    page = canvas.Canvas(buffer)
+    for line_number, line in enumerate(text.splitlines()):
+        page.drawString(72, 770 - 16 * line_number, line)
+    page.save()
+    return buffer.getvalue()
+
+
+def xlsx(rows):
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+_checklist = None
+
+
+def make_checklist():
+    """Store the job's documents once (so their digests stay the same) and return its checklist"""
+    global _checklist
+    if _checklist is not None:
+        return _checklist
+    storage = get_storage()
+    prefix = "uploads/jobs/test-combined"
+    invoices = []
+    for number, text in enumerate([
+        FAST_PATH_INVOICE.format(number="0188", percentage="30%"),
+        FAST_PATH_INVOICE.format(number="0189", percentage="50%"),
+        LLM_INVOICE,
+    ], start=1):
+        path = f"{prefix}/agency_invoice/invoice_{number}.pdf"
+        storage.save_file(path, pdf(text), "application/pdf")
+        invoices.append({"file_path": path, "original_filename": f"PR25 | 1042 - Invoice {number}.pdf"})
+
+    storage.save_file(f"{prefix}/job_order/job_order.pdf", pdf(JOB_ORDER), "application/pdf")
+    storage.save_file(f"{prefix}/approved_quotation/media_plan.xlsx", xlsx(MEDIA_PLAN_ROWS))
+    _checklist = {
+        "agency_invoice": invoices,
+        "job_order": [{"file_path": f"{prefix}/job_order/job_order.pdf", "original_filename": "Job Order.pdf"}],
+        "approved_quotation": [{
+            "file_path": f"{prefix}/approved_quotation/media_plan.xlsx",
+            "original_filename": "Media Plan - Actualized.xlsx",
+        }],
+    }
+    return _checklist
+
+
+@contextmanager
+def temporary_llm_cache():
+    """Enable the LLM cache in a temporary directory"""
+    directory = llm_cache.directory
+    llm_cache.directory = Path(tempfile.mkdtemp(prefix="combined-extraction-cache-"))
+    llm_cache.enabled = True
+    try:
+        yield
+    finally:
+        llm_cache.enabled = False
+        shutil.rmtree(llm_cache.directory, ignore_errors=True)
+        llm_cache.directory = directory
+
+
+def run_extraction(provider, branches=("invoice", "po", "media_plan")):
+    llm_providers.llm_provider = provider
+    return extract_job_details_combined(make_checklist(), branches)
+
+
+def test_single_combined_call():
+    """Fast-path invoices and local media plan fields never reach the LLM; the rest is one call"""
+    provider = RecordingStubProvider()
+    invoice_details, po_details, media_plan_details = run_extraction(provider)
+
+    assert provider.calls == ["combined"], provider.calls
+    methods = [invoice["extraction_method"] for invoice in invoice_details["invoices"]]
+    assert methods == ["fast_path", "fast_path", "combined"], methods
+    assert invoice_details["invoices"][0]["total_amount"] == 115000.0
+    assert "invoice_number_in_prompt" not in invoice_details["invoices"][2]
+    assert po_details == {"po_number": "stub-po_number", "po_amount": po_details["po_amount"]}, po_details
+
+    # Sheet values are exact and win; only the market type comes from the LLM
+    assert media_plan_details["net_media_cost"] == 100000.0
+    assert media_plan_details["media_plan_total_amount"] == 126500.0
+    assert media_plan_details["market_type"] == "A/E", media_plan_details
+    print(f"✓ One combined call for {methods.count('combined')} invoice, the job order and the market type")
+
+
+def test_missing_sections_fall_back():
+    """Sections missing from the combined response are extracted with their own calls"""
+    provider = RecordingStubProvider(drop=("invoices", "job_order"))
+    invoice_details, po_details, media_plan_details = run_extraction(provider)
+
+    invoice_call = "agency_invoice_number,campaign_name,percentage,project_code,total_amount"
+    assert sorted(provider.calls) == sorted(["combined", invoice_call, "po_amount,po_number"]), provider.calls
+    methods = [invoice["extraction_method"] for invoice in invoice_details["invoices"]]
+    assert methods == ["fast_path", "fast_path", "llm"], methods
+    assert po_details["po_number"] == "stub-po_number"
+    assert media_plan_details["market_type"] == "A/E"
+    print(f"✓ Missing invoice and job order sections re-extracted ({len(provider.calls)} calls)")
+
+
+def test_broken_response_falls_back():
+    """A combined response that is not an object loses no section"""
+    provider = RecordingStubProvider(broken=True)
+    invoice_details, po_details, media_plan_details = run_extraction(provider)
+
+    assert provider.calls[0] == "combined" and len(provider.calls) == 4, provider.calls
+    assert [invoice["extraction_method"] for invoice in invoice_details["invoices"]] == ["fast_path", "fast_path", "llm"]
+    assert po_details["po_number"] == "stub-po_number"
+    assert media_plan_details["market_type"] == "A/E" and media_plan_details["agency_fees"] == 10000.0
+    print("✓ Broken combined response: every section extracted separately")
+
+
+def test_branches():
+    """Sections not requested are returned as None and not sent to the LLM"""
+    provider = RecordingStubProvider()
+    invoice_details, po_details, media_plan_details = run_extraction(provider, branches=("po",))
+
+    assert invoice_details is None and media_plan_details is None
+    assert provider.calls == ["combined"] and po_details["po_number"] == "stub-po_number"
+    print("✓ Only the requested sections are extracted")
+
+
+def test_incomplete_response_not_cached():
+    """Only a combined response with every section is cached; fallback results are cached on their own"""
+    with temporary_llm_cache():
+        # The job order section is there but lacks the PO number
+        provider = RecordingStubProvider(drop=("job_order.po_number",))
+        run_extraction(provider)
+        assert provider.calls == ["combined", "po_amount,po_number"], provider.calls
+
+        # The incomplete combined response was not cached, so the next run asks again
+        provider = RecordingStubProvider()
+        run_extraction(provider)
+        assert provider.calls == ["combined"], provider.calls
+
+        # Now the complete response is served from the cache
+        provider = RecordingStubProvider()
+        invoice_details, po_details, _ = run_extraction(provider)
+        assert provider.calls == [], provider.calls
+        assert po_details["po_number"] == "stub-po_number"
+        assert invoice_details["invoices"][2]["extraction_method"] == "combined"
+    print("✓ Incomplete combined responses are not cached, complete ones are")
+
+
+def test_budget_change_not_served_from_cache():
+    """A different text budget sends different text, so the cached answer is not reused"""
+    max_chars = PDF_TEXT_BUDGETS["job_order"]["max_chars"]
+    with temporary_llm_cache():
+        try:
+            calls = []
+            for budget in (max_chars, max_chars, 20):
+                PDF_TEXT_BUDGETS["job_order"]["max_chars"] = budget
+                provider = RecordingStubProvider()
+                run_extraction(provider, branches=("po",))
+                calls.append(provider.calls)
+        finally:
+            PDF_TEXT_BUDGETS["job_order"]["max_chars"] = max_chars
+    assert calls == [["combined"], [], ["combined"]], calls
+    print("✓ Changing the job order budget asks the LLM again")
+
+
+def run_all_tests():
+    """Run all combined extraction tests"""
+    print("=" * 60)
+    print("Combined Extraction Test Suite")
+    print("=" * 60)
+
+    tests = [
+        test_single_combined_call,
+        test_missing_sections_fall_back,
+        test_broken_response_falls_back,
+        test_branches,
+        test_incomplete_response_not_cached,
+        test_budget_change_not_served_from_cache,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except Exception as e:
+            failed += 1
+            print(f"✗ {test.__name__} failed: {type(e).__name__}: {e}")
+
+    print("\n" + "=" * 60)
+    if failed:
+        print(f"❌ {failed} of {len(tests)} combined extraction tests failed.")
+    else:
+        print("✅ All combined extraction tests passed!")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Test script for the invoice fast path (regex extraction of agency invoices).
+Uses invoice text as pdfplumber extracts it; no LLM or database is needed.
+
+    python test_invoice_fast_path.py
+"""
+
+import sys
+
+from invoice_fast_path import extract_invoice_locally, try_invoice_fast_path
+
+FILE_NAME = "PR25 | 1042 - 30% Agency Invoice.pdf"
+
+AGENCY_INVOICE = """\
+Horizon Media Agency
+VAT No: 300012345600003
+TAX INVOICE
+Invoice No: HMA-2025-0187
+Invoice Date: 15/04/2025
+Bill To: Almarai Company
+Project Code: PR25 | 1042 - 30%
+Campaign Name: Ramadan Brand Awareness 2025
+Description Qty Rate Amount
+Media buying - TV 1 60,000.00 60,000.00
+Media buying - Digital 1 40,000.00 40,000.00
+Sub Total SAR 100,000.00
+VAT 15% SAR 15,000.00
+Total Amount (Incl. VAT) SAR 115,000.00
+Payment terms: Amount due within 30 days of invoice date
+"""
+
+# Due date printed between the label and the amount
+DUE_DATE_INVOICE = """\
+Invoice No: HMA-2025-0201
+Project Code: PR25 | 1042 - 30%
+Campaign Name: National Day Activation
+Sub-Total 43,478.26
+VAT (15%) 6,521.74
+Total Amount Due 2025-04-30 SAR 50,000
+"""
+
+# Payment terms mention "amount due" before the real total
+PAYMENT_TERMS_INVOICE = """\
+Invoice No: HMA-2025-0202
+Project Code: PR25 | 1042 - 30%
+Campaign Name: Back to School
+Payment terms: Amount due within 30 days of receipt
+Subtotal 8,695.65
+VAT 1,304.35
+Total 10,000
+"""
+
+
+def without_lines(text, *needles):
+    return "\n".join(line for line in text.splitlines() if not any(needle in line for needle in needles))
+
+
+def test_full_invoice():
+    """All fields of a complete invoice; subtotal + VAT confirm the total"""
+    details = try_invoice_fast_path(AGENCY_INVOICE, FILE_NAME)
+    assert details is not None, extract_invoice_locally(AGENCY_INVOICE, FILE_NAME)
+    expected = {
+        "agency_invoice_number": "HMA-2025-0187",
+        "project_code": "PR25|1042-30%",
+        "campaign_name": "Ramadan Brand Awareness 2025",
+        "total_amount": 115000.0,
+        "percentage": "30%",
+    }
+    for field, value in expected.items():
+        assert details[field] == value, (field, details[field])
+    assert details["confidence"] >= 0.8
+    print(f"✓ Full invoice: {details['agency_invoice_number']}, total {details['total_amount']:,.2f}")
+
+
+def test_date_on_total_line():
+    """A due date next to the total is not read as the amount"""
+    details, confidence = extract_invoice_locally(DUE_DATE_INVOICE)
+    assert details["total_amount"] == 50000.0, details["total_amount"]
+    assert confidence["total_amount"] == 1.0
+    assert try_invoice_fast_path(DUE_DATE_INVOICE)["total_amount"] == 50000.0
+
+    for line in ("Total Amount Due 30/04/2025 SAR 50,000", "Total Amount Due 30 Apr 2025 SAR 50,000"):
+        text = DUE_DATE_INVOICE.replace("Total Amount Due 2025-04-30 SAR 50,000", line)
+        assert extract_invoice_locally(text)[0]["total_amount"] == 50000.0, line
+    print("✓ Dates on the total line are skipped (2025-04-30, 30/04/2025, 30 Apr 2025)")
+
+
+def test_payment_terms():
+    """'Amount due within 30 days' is not a total"""
+    details, confidence = extract_invoice_locally(PAYMENT_TERMS_INVOICE)
+    assert details["total_amount"] == 10000.0, details["total_amount"]
+    assert try_invoice_fast_path(PAYMENT_TERMS_INVOICE)["total_amount"] == 10000.0
+    print("✓ Payment terms are skipped, total 10,000 found")
+
+
+def test_unconfirmed_total_goes_to_llm():
+    """Without subtotal + VAT a total is never confident enough to skip the LLM"""
+    for text in (DUE_DATE_INVOICE, PAYMENT_TERMS_INVOICE):
+        unconfirmed = without_lines(text, "Sub", "VAT")
+        details, confidence = extract_invoice_locally(unconfirmed)
+        assert details["total_amount"] in (50000.0, 10000.0)
+        assert confidence["total_amount"] < 0.8, confidence
+        assert try_invoice_fast_path(unconfirmed) is None
+    print("✓ Totals without subtotal + VAT fall back to the LLM")
+
+
+def test_mismatched_total_goes_to_llm():
+    """Subtotal + VAT not adding up to the total lowers its confidence"""
+    text = AGENCY_INVOICE.replace("SAR 115,000.00", "SAR 117,500.00")
+    details, confidence = extract_invoice_locally(text, FILE_NAME)
+    assert details["total_amount"] == 117500.0
+    assert confidence["total_amount"] <= 0.5
+    assert try_invoice_fast_path(text, FILE_NAME) is None
+    print("✓ Subtotal + VAT mismatch falls back to the LLM")
+
+
+def test_missing_fields_go_to_llm():
+    """An invoice without a campaign name is sent to the LLM"""
+    text = without_lines(AGENCY_INVOICE, "Campaign")
+    details, confidence = extract_invoice_locally(text, FILE_NAME)
+    assert "campaign_name" not in details and confidence["campaign_name"] == 0.0
+    assert try_invoice_fast_path(text, FILE_NAME) is None
+    print("✓ Missing campaign name falls back to the LLM")
+
+
+def run_all_tests():
+    """Run all invoice fast path tests"""
+    print("=" * 60)
+    print("Invoice Fast Path Test Suite")
+    print("=" * 60)
+
+    tests = [
+        test_full_invoice,
+        test_date_on_total_line,
+        test_payment_terms,
+        test_unconfirmed_total_goes_to_llm,
+        test_mismatched_total_goes_to_llm,
+        test_missing_fields_go_to_llm,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except Exception as e:
+            failed += 1
+            print(f"✗ {test.__name__} failed: {type(e).__name__}: {e}")
+
+    print("\n" + "=" * 60)
+    if failed:
+        print(f"❌ {failed} of {len(tests)} invoice fast path tests failed.")
+    else:
+        print("✅ All invoice fast path tests passed!")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Test script for the LLM call scheduler (rate limiting, retries, deadlines and
+circuit breaker). No provider or network access is needed: calls are plain
+functions that succeed or raise.
+
+    python test_llm_scheduler.py
+"""
+
+import asyncio
+import sys
+import time
+
+from llm_scheduler import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LLMCallScheduler,
+    LLMDeadlineExceeded,
+    TokenBucket,
+)
+
+
+class ProviderError(Exception):
+    """Error shaped like the google-genai API errors (HTTP status in .code)"""
+
+    def __init__(self, code, retry_after=None):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+
+def failing(code):
+    def func(timeout):
+        raise ProviderError(code)
+    return func
+
+
+def scheduler(**overrides):
+    settings = dict(
+        rate_per_minute=6000, burst=100, max_attempts=3, backoff_base=0, backoff_max=0,
+        deadline=5, failure_threshold=3, reset_timeout=0.1,
+    )
+    settings.update(overrides)
+    return LLMCallScheduler(**settings)
+
+
+def test_token_bucket():
+    """Burst tokens are free, the next one waits for the refill, refunds give tokens back"""
+    bucket = TokenBucket(rate_per_minute=60, burst=2)
+    assert bucket.reserve() == 0 and bucket.reserve() == 0
+    wait = bucket.reserve()
+    assert 0.9 < wait <= 1.0, wait
+    bucket.refund()
+    bucket.refund()
+    assert 0.9 < bucket.available() < 1.1, bucket.available()
+    print(f"✓ Token bucket: third call waits {wait:.2f}s, refunds restore tokens")
+
+
+def test_backoff():
+    """Backoff stays within the cap and honours the provider's Retry-After"""
+    s = scheduler(backoff_base=1, backoff_max=4)
+    delays = [s._backoff(attempt, ProviderError(503)) for attempt in range(10)]
+    assert all(0 <= delay <= 4 for delay in delays), delays
+    assert s._backoff(0, ProviderError(429, retry_after="7")) == 7
+    print("✓ Backoff: jittered delays capped at 4s, Retry-After of 7s honoured")
+
+
+def test_retries():
+    """Retryable errors are retried until the call succeeds; others fail at once"""
+    s = scheduler()
+    outcomes = [ProviderError(503), ProviderError(429), "ok"]
+
+    def flaky(timeout):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert s.call(flaky) == "ok"
+    stats = s.stats()
+    assert (stats["attempts"], stats["retries"], stats["rate_limited"]) == (3, 2, 1), stats
+
+    try:
+        s.call(failing(400))
+        raise AssertionError("400 should not be retried")
+    except ProviderError:
+        pass
+    assert s.stats()["attempts"] == 4
+    assert s.stats()["circuit_breaker"]["state"] == CircuitBreaker.CLOSED
+    print("✓ Retries: 503 and 429 retried, 400 raised after one attempt")
+
+
+def test_breaker_opens_and_recovers():
+    """Consecutive failures open the circuit; a successful trial closes it"""
+    s = scheduler(max_attempts=1, failure_threshold=2)
+    for _ in range(2):
+        try:
+            s.call(failing(503))
+        except ProviderError:
+            pass
+    assert s.breaker.state == CircuitBreaker.OPEN
+    try:
+        s.call(lambda timeout: "not called")
+        raise AssertionError("open circuit should reject calls")
+    except CircuitOpenError:
+        pass
+    time.sleep(0.15)
+    assert s.call(lambda timeout: "trial") == "trial"
+    assert s.breaker.state == CircuitBreaker.CLOSED
+    print("✓ Circuit breaker: opens after 2 failures, closes after a successful trial")
+
+
+def test_deadline_rejection_releases_trial():
+    """A half-open call rejected by its deadline must not keep the circuit stuck"""
+    s = scheduler(rate_per_minute=60, burst=1, max_attempts=1, failure_threshold=1, reset_timeout=0.1, deadline=0.5)
+    try:
+        s.call(failing(503))
+    except ProviderError:
+        pass
+    assert s.breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.15)
+
+    # The bucket is empty (about a second until the next token), so this call cannot start in time
+    try:
+        s.call(lambda timeout: "too late")
+        raise AssertionError("call should miss its deadline")
+    except LLMDeadlineExceeded:
+        pass
+    assert s.bucket.available() >= 0, "rejected call kept its token"
+
+    time.sleep(1.0)
+    assert s.call(lambda timeout: "recovered") == "recovered"
+    assert s.breaker.state == CircuitBreaker.CLOSED
+    print("✓ Deadline rejection in half-open state: token returned, next call makes the trial")
+
+
+def test_cancelled_trial_is_released():
+    """Cancelling the half-open trial call lets the next call make the trial"""
+    async def run():
+        s = scheduler(max_attempts=1, failure_threshold=1, reset_timeout=0.05)
+
+        async def fail(timeout):
+            raise ProviderError(503)
+
+        async def slow(timeout):
+            await asyncio.sleep(10)
+
+        async def ok(timeout):
+            return "ok"
+
+        try:
+            await s.acall(fail)
+        except ProviderError:
+            pass
+        await asyncio.sleep(0.1)
+
+        trial = asyncio.create_task(s.acall(slow))
+        await asyncio.sleep(0.05)
+        assert s.breaker.state == CircuitBreaker.HALF_OPEN
+        trial.cancel()
+        try:
+            await trial
+        except asyncio.CancelledError:
+            pass
+
+        assert await s.acall(ok) == "ok"
+        assert s.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(run())
+    print("✓ Cancelled half-open trial: released, next call closes the circuit")
+
+
+def run_all_tests():
+    """Run all LLM scheduler tests"""
+    print("=" * 60)
+    print("LLM Call Scheduler Test Suite")
+    print("=" * 60)
+
+    tests = [
+        test_token_bucket,
+        test_backoff,
+        test_retries,
+        test_breaker_opens_and_recovers,
+        test_deadline_rejection_releases_trial,
+        test_cancelled_trial_is_released,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except Exception as e:
+            failed += 1
+            print(f"✗ {test.__name__} failed: {type(e).__name__}: {e}")
+
+    print("\n" + "=" * 60)
+    if failed:
+        print(f"❌ {failed} of {len(tests)} LLM scheduler tests failed.")
+    else:
+        print("✅ All LLM scheduler tests passed!")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Test script for the rule-based media plan extractor and the media plan
+selection scores. Uses rows shaped like a pandas/openpyxl read of a media plan
+sheet; no LLM or database is needed.
+
+    python test_media_plan_extractor.py
+"""
+
+import sys
+from datetime import datetime
+
+from media_plan_extractor import extract_media_plan_locally, score_media_plan_candidates
+
+NAN = float("nan")
+
+HEADER = [
+    ["Client:", "Almarai", NAN, NAN],
+    ["Period:", "March 2025", NAN, NAN],
+    ["Version:", "V1", NAN, NAN],
+]
+PLATFORM_TABLE = [
+    ["Total Budget by Platform", "Total", "Fee %", "Fee SAR"],
+    ["Television", 60000.0, 0.1, 6000.0],
+    ["Digital-Social/biddable Platforms", 40000.0, 0.1, 4000.0],
+    ["Radio", 0.0, 0.1, 0.0],
+    ["VAT 15%", NAN, NAN, 16500.0],
+    ["Total Payable", NAN, NAN, "SAR 126,500.00"],
+]
+GEOTARGETING = [
+    ["Platform", "Format", "Geotargeting"],
+    ["Snapchat", "Story", "Saudi Arabia"],
+    ["TikTok", "TopView", "KSA - Riyadh"],
+]
+EMPTY = [[NAN, NAN, NAN, NAN]]
+
+
+def sheet(*blocks):
+    rows = []
+    for block in blocks:
+        if rows:
+            rows += EMPTY
+        rows += block
+    return rows
+
+
+def replace_cell(rows, old, new):
+    return [[new if cell == old else cell for cell in row] for row in rows]
+
+
+def test_platform_table():
+    """All fields from the "Total Budget by Platform" table, header and geotargeting"""
+    fields = extract_media_plan_locally(sheet(HEADER, PLATFORM_TABLE, GEOTARGETING))
+    expected = {
+        "medium": "Television, Digital-Social/biddable Platforms",
+        "net_media_cost": 100000.0,
+        "agency_fees": 10000.0,
+        "taxes_amount": 16500.0,
+        "third_party_cost": 0.0,
+        "media_plan_total_amount": 126500.0,
+        "period_month": "March 2025",
+        "market_type": "DOMESTIC",
+    }
+    assert fields == expected, fields
+    print(f"✓ Platform table: net {fields['net_media_cost']:,.0f} + fees {fields['agency_fees']:,.0f} "
+          f"+ VAT {fields['taxes_amount']:,.0f} = {fields['media_plan_total_amount']:,.0f}")
+
+
+def test_amount_columns_take_precedence():
+    """Net Media Cost / Agency Fee columns override the platform table; rate columns are skipped"""
+    platform_table = replace_cell(replace_cell(PLATFORM_TABLE, 60000.0, 50000.0), 40000.0, 35000.0)
+    columns = [
+        ["Platform", "Net Media Cost SAR", "Agency Fee %", "Agency Fee SAR"],
+        ["Snapchat", 45000.0, 0.1, 4500.0],
+        ["TikTok", 55000.0, 0.1, 5500.0],
+    ]
+    fields = extract_media_plan_locally(sheet(HEADER, platform_table, columns))
+    assert (fields["net_media_cost"], fields["agency_fees"]) == (100000.0, 10000.0), fields
+    assert fields["media_plan_total_amount"] == 126500.0
+
+    # A total row is used instead of the column sum
+    with_total = columns + [["Total", 100000.0, NAN, 10000.0]]
+    with_total[1] = ["Snapchat", "TBC", 0.1, "TBC"]
+    fields = extract_media_plan_locally(sheet(HEADER, platform_table, with_total))
+    assert (fields["net_media_cost"], fields["agency_fees"]) == (100000.0, 10000.0), fields
+    print("✓ Net Media Cost / Agency Fee columns: SAR amounts used, rate column skipped, total row preferred")
+
+
+def test_unbalanced_amounts_go_to_llm():
+    """Amounts that do not add up to Total Payable are left for the LLM"""
+    rows = sheet(HEADER, replace_cell(PLATFORM_TABLE, "SAR 126,500.00", 130000.0))
+    fields = extract_media_plan_locally(rows)
+    assert fields == {"medium": "Television, Digital-Social/biddable Platforms", "period_month": "March 2025"}, fields
+
+    # Without a Total Payable row nothing can be cross-checked
+    fields = extract_media_plan_locally(sheet(HEADER, PLATFORM_TABLE[:-1]))
+    assert "net_media_cost" not in fields and "media_plan_total_amount" not in fields, fields
+    assert extract_media_plan_locally([]) == {}
+    print("✓ Unbalanced or unconfirmed amounts fall back to the LLM")
+
+
+def test_foreign_market_left_to_llm():
+    """Geotargeting outside Saudi Arabia does not set the market type"""
+    geotargeting = replace_cell(replace_cell(GEOTARGETING, "Saudi Arabia", "UAE"), "KSA - Riyadh", "Egypt")
+    fields = extract_media_plan_locally(sheet(HEADER, PLATFORM_TABLE, geotargeting))
+    assert "market_type" not in fields, fields
+    print("✓ Non-Saudi geotargeting leaves the market type to the LLM")
+
+
+def test_selection_scores():
+    """File names outweigh sheet versions and upload order"""
+    rows_v1 = sheet(HEADER, PLATFORM_TABLE)
+    rows_v2 = replace_cell(rows_v1, "V1", "V2")
+
+    scores = score_media_plan_candidates([
+        {"file_name": "Media Plan - Actualized.xlsx", "uploaded_at": datetime(2025, 3, 1), "rows": rows_v1},
+        {"file_name": "Media Plan - Approved.xlsx", "uploaded_at": datetime(2025, 4, 1), "rows": rows_v2},
+    ])
+    assert scores == [4, -2], scores
+
+    # Same names: the higher version and the later upload win
+    scores = score_media_plan_candidates([
+        {"file_name": "Media Plan.xlsx", "uploaded_at": "2025-03-01T10:00:00", "rows": rows_v2},
+        {"file_name": "Media Plan.xlsx", "uploaded_at": "2025-03-02T10:00:00", "rows": rows_v1},
+        {"file_name": "Media Plan.xlsx"},
+    ])
+    assert scores == [1, 1, 0], scores
+
+    # Sheet words only count when the sheets differ
+    final = replace_cell(rows_v1, "Almarai", "Almarai - final delivered")
+    scores = score_media_plan_candidates([
+        {"file_name": "Media Plan A.xlsx", "rows": rows_v1},
+        {"file_name": "Media Plan B.xlsx", "rows": final},
+    ])
+    assert scores == [0, 4], scores
+    assert score_media_plan_candidates([{"file_name": "a.xlsx", "rows": rows_v1}, {"file_name": "b.xlsx", "rows": rows_v1}]) == [0, 0]
+    print("✓ Selection scores: file name, sheet words, version and upload order")
+
+
+def run_all_tests():
+    """Run all media plan extractor tests"""
+    print("=" * 60)
+    print("Media Plan Extractor Test Suite")
+    print("=" * 60)
+
+    tests = [
+        test_platform_table,
+        test_amount_columns_take_precedence,
+        test_unbalanced_amounts_go_to_llm,
+        test_foreign_market_left_to_llm,
+        test_selection_scores,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except Exception as e:
+            failed += 1
+            print(f"✗ {test.__name__} failed: {type(e).__name__}: {e}")
+
+    print("\n" + "=" * 60)
+    if failed:
+        print(f"❌ {failed} of {len(tests)} media plan extractor tests failed.")
+    else:
+        print("✅ All media plan extractor tests passed!")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
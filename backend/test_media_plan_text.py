@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Test script for the media plan text compaction (sheet rows to prompt text).
+Uses rows shaped like a pandas/openpyxl read of a media plan sheet; no LLM or
+database is needed.
+
+    python test_media_plan_text.py
+"""
+
+import sys
+from datetime import datetime
+
+from media_plan_text import compact_media_plan_rows, find_blocks, normalize_cell, normalize_rows
+
+NAN = float("nan")
+
+HEADER = [
+    ["Client:", "Almarai", NAN, NAN],
+    ["Period:", datetime(2025, 3, 1), NAN, NAN],
+    ["Market:", "العربية\nKSA", NAN, NAN],
+]
+PLATFORM_TABLE = [
+    ["Total Budget by Platform", "Total", "Fee %", "Fee SAR"],
+    ["Television", 60000.0, 0.1, 6000.0],
+    ["Digital-Social/biddable Platforms", 40000.0, 0.1, 4000.0],
+    ["VAT 15%", NAN, NAN, 16500.0],
+    ["Total Payable", NAN, NAN, 126500.0],
+]
+WIDE_TABLE = [
+    ["Platform", "Format", "Start", "End", "Impressions", "CPM", "Net Media Cost SAR", "Agency Fee SAR", "Geotargeting", "Notes"],
+    ["Snapchat", "Story", datetime(2025, 3, 1), datetime(2025, 3, 31), 1200000.0, 12.5, 15000.0, 1500.0, "Saudi Arabia", "Pending"],
+    ["TikTok", "TopView", datetime(2025, 3, 1), datetime(2025, 3, 31), 2500000.0, 10.0, 25000.0, 2500.0, "Saudi Arabia", NAN],
+    ["Total", NAN, NAN, NAN, NAN, NAN, 40000.0, 4000.0, NAN, NAN],
+]
+NOTES = [
+    ["Notes:", "Rates are subject to platform availability at the time of booking", NAN, NAN],
+    ["Grand Total Media", 100000.0, NAN, NAN],
+]
+EMPTY = [[NAN, None, "", NAN]]
+
+SHEET = HEADER + EMPTY + PLATFORM_TABLE + EMPTY + WIDE_TABLE + EMPTY + NOTES
+
+
+def test_normalize_cell():
+    """NaN, whole floats, dates and bilingual labels"""
+    cases = [
+        (NAN, ""),
+        (None, ""),
+        ("nan", ""),
+        (60000.0, "60000"),
+        (12.5, "12.5"),
+        (datetime(2025, 3, 1), "2025-03-01"),
+        (datetime(2025, 3, 1, 14, 30), "2025-03-01 14:30:00"),
+        ("2025-03-01 00:00:00", "2025-03-01"),
+        ("إجمالي الميزانية\nTotal Budget", "Total Budget"),
+        ("صافي التكلفة", "صافي التكلفة"),
+        ("  Net   Media\nCost  ", "Net Media Cost"),
+    ]
+    for cell, expected in cases:
+        assert normalize_cell(cell) == expected, (cell, normalize_cell(cell))
+    print(f"✓ normalize_cell: {len(cases)} cell shapes rendered")
+
+
+def test_find_blocks():
+    """Blocks are runs of rows with at least one non-empty cell"""
+    blocks = find_blocks(normalize_rows(SHEET))
+    assert blocks == [(0, 3), (4, 9), (10, 14), (15, 17)], blocks
+    assert find_blocks(normalize_rows(EMPTY + HEADER)) == [(1, 4)]
+    assert find_blocks([]) == []
+    print(f"✓ find_blocks: {blocks}")
+
+
+def test_compact_regions():
+    """Header, platform table, wide table columns and grand totals are kept; notes are dropped"""
+    text = compact_media_plan_rows(SHEET, token_budget=0)
+    lines = text.split("\n")
+
+    assert lines[0] == "Client:\tAlmarai", lines[0]
+    assert "Period:\t2025-03-01" in lines and "Market:\tKSA" in lines
+    assert "Total Budget by Platform\tTotal\tFee %\tFee SAR" in lines
+    assert "Total Payable\t\t\t126500" in lines
+    assert "Grand Total Media\t100000" in lines
+
+    # The wide table keeps its label column and the amount / geotargeting columns only
+    header = next(line for line in lines if line.startswith("Platform"))
+    assert header.split("\t") == ["Platform", "", "", "", "Net Media Cost SAR", "Agency Fee SAR", "Geotargeting"], header
+    assert "Snapchat\t\t\t\t15000\t1500\tSaudi Arabia" in lines
+    for dropped in ("Impressions", "CPM", "Story", "Pending", "Rates are subject"):
+        assert dropped not in text, dropped
+
+    # Regions are written in sheet order with a blank line between them
+    assert lines.count("") == 3, lines
+    assert text.index("Client:") < text.index("Total Budget") < text.index("Snapchat") < text.index("Grand Total")
+    print(f"✓ Compaction: {len(lines)} lines, notes and wide-table columns dropped")
+
+
+def test_token_budget():
+    """Regions are added by priority until the budget is spent"""
+    full = compact_media_plan_rows(SHEET, token_budget=0)
+    without_table = compact_media_plan_rows(SHEET[:9] + EMPTY + NOTES, token_budget=0)
+
+    # Room for the header, the platform table and the grand total, but not the wide table
+    budget = len(without_table) // 4 + 1
+    assert len(full) > budget * 4
+    text = compact_media_plan_rows(SHEET, token_budget=budget)
+    assert "Total Budget by Platform" in text and "Grand Total Media" in text, text
+    assert "Snapchat" not in text, text
+
+    # Not even the header fits: it is cut off at the budget
+    assert compact_media_plan_rows(SHEET, token_budget=2) == "Client:\t"
+    assert compact_media_plan_rows(EMPTY) == ""
+    print(f"✓ Token budget: {budget} tokens keep {len(text)} of {len(full)} characters")
+
+
+def run_all_tests():
+    """Run all media plan text tests"""
+    print("=" * 60)
+    print("Media Plan Text Test Suite")
+    print("=" * 60)
+
+    tests = [
+        test_normalize_cell,
+        test_find_blocks,
+        test_compact_regions,
+        test_token_budget,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except Exception as e:
+            failed += 1
+            print(f"✗ {test.__name__} failed: {type(e).__name__}: {e}")
+
+    print("\n" + "=" * 60)
+    if failed:
+        print(f"❌ {failed} of {len(tests)} media plan text tests failed.")
+    else:
+        print("✅ All media plan text tests passed!")
+    print("=" * 60)
+    return failed == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Test script for the S3 storage backend (STORAGE_BACKEND=s3).
+Run it against AWS or a local S3-compatible server, e.g. moto server:
+
+    moto_server -p 5000
+    S3_ENDPOINT_URL=http://localhost:5000 S3_FORCE_PATH_STYLE=true \\
+    S3_BUCKET_NAME=test-bucket AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test \\
+    python test_s3_storage.py
+
+The bucket is created if it does not exist. Everything is written under test/
+and deleted again at the end.
+"""
+
+import io
+import os
+import time
+import asyncio
+import hashlib
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+from s3_storage import S3_MULTIPART_THRESHOLD, S3StorageBackend, iter_object_pages
+
+TEST_PREFIX = "test/s3_storage"
+
+async def test_connection():
+    """Create the backend and make sure the bucket exists"""
+    print("Testing S3 storage backend connection...")
+    try:
+        storage = S3StorageBackend()
+        try:
+            await storage._offload(storage.s3_client.head_bucket, Bucket=storage.bucket_name)
+        except Exception:
+            await storage._offload(storage.s3_client.create_bucket, Bucket=storage.bucket_name)
+            print(f"✓ Created bucket: {storage.bucket_name}")
+        print(f"✓ Connected to S3 bucket: {storage.bucket_name}")
+        return storage
+    except Exception as e:
+        print(f"✗ Failed to connect to S3: {e}")
+        return None
+
+async def test_small_upload(storage):
+    """Upload a small file in a single request and read it back"""
+    print("\nTesting small upload...")
+    key = f"{TEST_PREFIX}/small.txt"
+    content = b"This is a test file for the S3 storage backend."
+    result = await storage.asave_file_stream(key, io.BytesIO(content), "text/plain")
+    ok = result["size"] == len(content) and result["sha256"] == hashlib.sha256(content).hexdigest()
+    ok = ok and await storage.aread_file(key) == content
+    print(f"{'✓' if ok else '✗'} Small upload round trip")
+    return ok
+
+async def test_multipart_upload(storage):
+    """Upload a file above the multipart threshold and stream it back"""
+    print("\nTesting multipart upload...")
+    key = f"{TEST_PREFIX}/large.bin"
+    content = os.urandom(S3_MULTIPART_THRESHOLD * 2 + 12345)
+    started = time.perf_counter()
+    result = await storage.asave_file_stream(key, io.BytesIO(content), "application/octet-stream")
+    print(f"  Uploaded {len(content) / 1024 / 1024:.1f} MB in {time.perf_counter() - started:.2f}s")
+    info = await storage._offload(storage.s3_client.head_object, Bucket=storage.bucket_name, Key=key)
+    # Multipart uploads have ETags of the form "<md5>-<parts>"
+    multipart = "-" in info["ETag"]
+    digest = hashlib.sha256()
+    async for chunk in storage.aiter_file(key, chunk_size=256 * 1024):
+        digest.update(chunk)
+    ok = multipart and result["sha256"] == digest.hexdigest() == hashlib.sha256(content).hexdigest()
+    print(f"{'✓' if ok else '✗'} Multipart upload ({info['ETag']}) and streamed download")
+    return ok
+
+async def test_ranged_read(storage):
+    """Read byte ranges of a stored file"""
+    print("\nTesting ranged reads...")
+    key = f"{TEST_PREFIX}/range.txt"
+    await storage.asave_file(key, b"0123456789")
+    ok = (
+        await storage.aread_range(key, 2, 5) == b"234"
+        and await storage.aread_range(key, 7) == b"789"
+        and (await storage.afile_info(key))["size"] == 10
+    )
+    print(f"{'✓' if ok else '✗'} Ranged reads")
+    return ok
+
+async def test_concurrent_uploads(storage, count=20):
+    """Upload many files at once; the S3 threads run them in parallel"""
+    print(f"\nTesting {count} concurrent uploads...")
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        storage.asave_file(f"{TEST_PREFIX}/many/{i}.txt", f"file {i}".encode()) for i in range(count)
+    ))
+    files = await storage.alist_files(f"{TEST_PREFIX}/many/")
+    ok = len(files) == count
+    print(f"{'✓' if ok else '✗'} {len(files)} files uploaded in {time.perf_counter() - started:.2f}s")
+    return ok
+
+async def test_listing(storage, count=20):
+    """Paginated, delimiter and parallel listing of the concurrent upload files"""
+    print("\nTesting listing...")
+    prefix = f"{TEST_PREFIX}/many/"
+    pages = await storage._offload(
+        lambda: list(iter_object_pages(storage.s3_client, storage.bucket_name, prefix, page_size=7))
+    )
+    paged_ok = [len(page) for page in pages] == [7, 7, count - 14]
+    top_level = [entry async for entry in storage.aiter_files(f"{TEST_PREFIX}/", delimiter="/")]
+    delimiter_ok = any(entry["is_dir"] and entry["key"] == prefix for entry in top_level)
+    sharded = [entry["key"] async for entry in storage.aiter_files(f"{TEST_PREFIX}/", concurrency=4)]
+    sharded_ok = len(sharded) == len(set(sharded)) == len(await storage.alist_files(TEST_PREFIX))
+    ok = paged_ok and delimiter_ok and sharded_ok
+    print(f"{'✓' if ok else '✗'} Pages {[len(page) for page in pages]}, "
+          f"{len(top_level)} top-level entries, {len(sharded)} keys listed in parallel")
+    return ok
+
+async def test_cleanup(storage):
+    """Batch delete everything the tests wrote"""
+    print("\nTesting batch delete...")
+    keys = [f["key"] for f in await storage.alist_files(TEST_PREFIX)]
+    deleted = await storage.adelete_files(keys, invalidate_cache=False)
+    ok = deleted == len(keys) and not await storage.alist_files(TEST_PREFIX)
+    print(f"{'✓' if ok else '✗'} Deleted {deleted} files")
+    return ok
+
+async def run_all_tests():
+    """Run all S3 storage backend tests"""
+    print("=" * 60)
+    print("S3 Storage Backend Test Suite")
+    print("=" * 60)
+
+    storage = await test_connection()
+    if not storage:
+        print("\n❌ S3 connection failed. Please check your configuration.")
+        return
+
+    results = []
+    for test in (test_small_upload, test_multipart_upload, test_ranged_read, test_concurrent_uploads, test_listing):
+        try:
+            results.append(await test(storage))
+        except Exception as e:
+            print(f"✗ {test.__name__} failed: {e}")
+            results.append(False)
+    results.append(await test_cleanup(storage))
+
+    print("\n" + "=" * 60)
+    if all(results):
+        print("✅ All S3 storage backend tests passed!")
+    else:
+        print("❌ Some S3 storage backend tests failed.")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    if not os.getenv("S3_BUCKET_NAME"):
+        print("❌ Missing required environment variable: S3_BUCKET_NAME")
+        exit(1)
+
+    asyncio.run(run_all_tests())